@@ -0,0 +1,241 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from pathlib import Path
+import logging
+import sqlite3
+import contextlib
+import tempfile
+import datetime
+import hashlib
+import random
+import time
+import statistics
+
+import utilities
+
+# The lookups done by the scripts on the run info table, with a function returning the parameters for a random run
+benchmark_queries = {
+    "run by RunName": (
+        "SELECT `RunID`,`RunName`,`path`,`type`,`sample`,`pixel row`,`pixel col`,`begin location`,`end location`,`Observations` FROM 'RunInfo' WHERE `RunName`=?;",
+        lambda run: [run['RunName']],
+    ),
+    "run by name": (
+        "SELECT `RunName`,`path`,`SHA256`,`MD5` FROM 'RunInfo' WHERE `name`=?;",
+        lambda run: [run['name']],
+    ),
+    "runs by sample and pixel": (
+        "SELECT `RunID`,`RunName` FROM 'RunInfo' WHERE `sample`=? AND `pixel row`=? AND `pixel col`=?;",
+        lambda run: [run['sample'], run['pixel row'], run['pixel col']],
+    ),
+    "runs by type": (
+        "SELECT `RunID`,`RunName` FROM 'RunInfo' WHERE `type`=? LIMIT 100;",
+        lambda run: [run['type']],
+    ),
+    "runs by start range": (
+        "SELECT `RunID`,`RunName` FROM 'RunInfo' WHERE `start` BETWEEN ? AND ?;",
+        lambda run: [run['start'], str(datetime.datetime.fromisoformat(run['start']) + datetime.timedelta(days=1))],
+    ),
+    "runs by temperature": (
+        "SELECT `RunID`,`RunName` FROM 'RunInfo' WHERE `temperature [C]`=? LIMIT 100;",
+        lambda run: [run['temperature [C]']],
+    ),
+    "runs by selection": (
+        "SELECT `RunName` FROM `RunInfo` " + utilities.compile_run_selection(utilities.parse_run_selection(["sample=S type=CV temperature<=0"]))[0] + " ORDER BY `RunID`;",
+        lambda run: utilities.compile_run_selection(utilities.parse_run_selection([f"sample={run['sample']}", f"type={run['type']}", f"temperature<={run['temperature [C]']}"]))[1],
+    ),
+    "latest runs": (
+        "SELECT `RunID`,`RunName` FROM 'RunInfo' ORDER BY `start` DESC LIMIT 10;",
+        lambda run: [],
+    ),
+}
+
+def make_synthetic_runs(num_runs: int, seed: int = 42):
+    rng = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1, 0, 0, 0)
+    runs = []
+    for idx in range(num_runs):
+        run_type = rng.choice([utilities.CVIV_Types.IV_Two_Probes, utilities.CVIV_Types.CV])
+        run_start = start + datetime.timedelta(minutes=30*idx)
+        content = f"synthetic run {idx}".encode('utf-8')
+        pixel_row = rng.randint(0, 3)
+        pixel_col = rng.randint(0, 3)
+        runs += [{
+            'RunName': 'CVIV-Run{:04d}'.format(idx),
+            'path': f"/synthetic/campaign{idx//1000}/run_{idx}.{utilities.get_run_file_extension(run_type)}",
+            'name': f"run_{idx}.{utilities.get_run_file_extension(run_type)}",
+            'type': run_type,
+            'start': str(run_start),
+            'stop': str(run_start + datetime.timedelta(minutes=25)),
+            'tester': 'tester',
+            'temperature [C]': float(rng.choice([-30, -25, -20, 20])),
+            'V step mode': 'from file',
+            'sample': f"Sample-{rng.randint(0, 499)}",
+            'irradiation flux [p/cm^2]': 0.0,
+            'irradiated': False,
+            'pixel': f"{pixel_row} {pixel_col}",
+            'pixel row': pixel_row,
+            'pixel col': pixel_col,
+            'begin location': 33,
+            'end location': 314,
+            'SHA256': hashlib.sha256(content).hexdigest(),
+            'MD5': hashlib.md5(content).hexdigest(),
+        }]
+    return runs
+
+def script_main(
+                num_runs: int = 100000,
+                repeats: int = 200,
+                db_path: Path = None,
+                no_indexes: bool = False,
+                ):
+    logger = logging.getLogger('benchmark_run_db')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if db_path is not None:
+            # The benchmark runs on a copy, so the database being measured is never changed (e.g. by --noIndexes)
+            logger.info(f"Copying {db_path} to a temporary database")
+            copy_path = Path(tmp_dir) / 'run_db.sqlite'
+            with contextlib.closing(sqlite3.connect(f"{db_path.absolute().as_uri()}?mode=ro", uri=True)) as source_conn:
+                with contextlib.closing(sqlite3.connect(copy_path)) as copy_conn:
+                    source_conn.backup(copy_conn)
+            db_path = copy_path
+        else:
+            db_path = Path(tmp_dir) / 'run_db.sqlite'
+            runs = make_synthetic_runs(num_runs)
+            logger.info(f"Creating a synthetic database with {num_runs} runs")
+            with sqlite3.connect(db_path) as sql_conn:
+                columns = [col for col in runs[0].keys() if col != 'RunName']
+                utilities.create_run_info_table(sql_conn, 'RunInfo', columns, logger)
+                column_str = ",".join([f"`{col}`" for col in ['RunName'] + columns])
+                values_str = ",".join(["?"]*(len(columns) + 1))
+                values = [[run['RunName']] + row for run, row in zip(runs, utilities.convert_run_info_values(runs, columns))]
+                sql_conn.executemany(f"INSERT INTO 'RunInfo'({column_str}) VALUES({values_str});", values)
+                sql_conn.execute("ANALYZE;")
+
+        with sqlite3.connect(db_path) as sql_conn:
+            if no_indexes:
+                for (index_name, ) in sql_conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='RunInfo' AND name LIKE 'RunInfo\\_by\\_%' ESCAPE '\\';").fetchall():
+                    sql_conn.execute(f"DROP INDEX `{index_name}`;")
+
+            columns = [row[0] for row in sql_conn.execute("SELECT name FROM pragma_table_info('RunInfo');")]
+            sample_runs = [dict(zip(columns, row)) for row in sql_conn.execute("SELECT * FROM 'RunInfo' ORDER BY RANDOM() LIMIT ?;", [repeats])]
+            total_runs = sql_conn.execute("SELECT COUNT(*) FROM 'RunInfo';").fetchall()[0][0]
+
+            print(f"Benchmarking {len(benchmark_queries)} lookups on {total_runs} runs ({db_path})")
+            for query_name, (query, get_params) in benchmark_queries.items():
+                print(f"\n{query_name}: {query}")
+                for row in sql_conn.execute("EXPLAIN QUERY PLAN " + query, get_params(sample_runs[0])):
+                    print(f"    plan: {row[3]}")
+
+                timings = []
+                for run in sample_runs:
+                    params = get_params(run)
+                    query_start = time.perf_counter()
+                    sql_conn.execute(query, params).fetchall()
+                    timings += [time.perf_counter() - query_start]
+                print(f"    latency: median {statistics.median(timings)*1e6:.1f} us, max {max(timings)*1e6:.1f} us over {len(timings)} lookups")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='benchmark_run_db.py',
+                    description='This script reports the query plan and latency of the run database lookups done by the scripts, on a synthetic database or an existing one',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-n',
+        '--numRuns',
+        metavar = 'N',
+        type = int,
+        help = 'Number of runs in the synthetic database. Default: 100000',
+        default = 100000,
+        dest = 'num_runs',
+    )
+    parser.add_argument(
+        '-r',
+        '--repeats',
+        metavar = 'N',
+        type = int,
+        help = 'Number of lookups timed for each query. Default: 200',
+        default = 200,
+        dest = 'repeats',
+    )
+    parser.add_argument(
+        '-d',
+        '--dbPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to a database directory to benchmark instead of a synthetic database. The benchmark runs on a temporary copy, the database is never modified',
+        dest = 'db_path',
+    )
+    parser.add_argument(
+        '--noIndexes',
+        action = 'store_true',
+        help = 'Drop the secondary indexes (of the synthetic database or of the copy) before running the benchmark, for comparison',
+        dest = 'no_indexes',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    db_path: Path = args.db_path
+    if db_path is not None:
+        db_path = db_path.absolute() / "run_db.sqlite"
+        if not db_path.exists() or not db_path.is_file():
+            raise RuntimeError("The database file does not exist")
+
+    script_main(args.num_runs, args.repeats, db_path, args.no_indexes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from pathlib import Path
+import logging
+import tempfile
+import time
+import statistics
+import numpy
+
+import utilities
+
+def make_synthetic_run_file(file_path: Path, run_type: utilities.CVIV_Types, num_rows: int, seed: int = 42):
+    # A header of the usual size followed by the data block, returns the line and byte locations of the block
+    cols = utilities.get_data_columns(run_type)
+    rng = numpy.random.default_rng(seed)
+    header = "".join([f"header line {idx}\n" for idx in range(36)])
+    with open(file_path, 'w', newline='') as f:
+        f.write(header)
+        f.write("BEGIN\n")
+        begin_offset = f.tell()
+        values = rng.normal(size=(num_rows, len(cols)))*1e-9
+        numpy.savetxt(f, values, fmt="%.6e", delimiter="\t")
+        end_offset = f.tell()
+        f.write("END\n")
+    begin_location = 36
+    end_location = begin_location + num_rows + 1
+    return begin_location, end_location, begin_offset, end_offset
+
+def time_parser(file_path: Path, repeats: int, parse):
+    timings = []
+    for _ in range(repeats):
+        with open(file_path, 'rb') as f:
+            parse_start = time.perf_counter()
+            data = parse(f)
+            timings += [time.perf_counter() - parse_start]
+    return statistics.median(timings), data
+
+def script_main(
+                rows: list[int] = [200, 1000000],
+                repeats: int = 5,
+                run_type: utilities.CVIV_Types = utilities.CVIV_Types.CV,
+                ):
+    logger = logging.getLogger('benchmark_run_parser')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_rows in rows:
+            file_path = Path(tmp_dir) / f"run_{num_rows}.{utilities.get_run_file_extension(run_type)}"
+            logger.info(f"Creating a synthetic {run_type.name} run with {num_rows} rows")
+            begin_location, end_location, begin_offset, end_offset = make_synthetic_run_file(file_path, run_type, num_rows)
+
+            pandas_time, pandas_data = time_parser(file_path, repeats, lambda f: utilities.parse_run_data(f, run_type, begin_location, end_location))
+            offset_time, offset_data = time_parser(file_path, repeats, lambda f: utilities.parse_run_data(f, run_type, begin_location, end_location, begin_offset, end_offset))
+
+            same = all(numpy.array_equal(pandas_data[col], offset_data[col]) for col in pandas_data)
+            print(f"{num_rows} rows ({file_path.stat().st_size/1e6:.2f} MB):")
+            print(f"    pandas, line based: median {pandas_time*1e3:.2f} ms")
+            print(f"    byte offsets:       median {offset_time*1e3:.2f} ms ({pandas_time/offset_time:.1f}x), identical values: {same}")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='benchmark_run_parser.py',
+                    description='This script compares the time taken to parse the data block of synthetic runs with the line based pandas parser and with the byte offset parser',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-n',
+        '--rows',
+        metavar = 'N',
+        type = int,
+        nargs = '+',
+        help = 'Number of rows of the synthetic runs to parse, one run per value. Default: 200 1000000',
+        default = [200, 1000000],
+        dest = 'rows',
+    )
+    parser.add_argument(
+        '-r',
+        '--repeats',
+        metavar = 'N',
+        type = int,
+        help = 'Number of times each run is parsed. Default: 5',
+        default = 5,
+        dest = 'repeats',
+    )
+    parser.add_argument(
+        '-t',
+        '--type',
+        type = str,
+        help = 'Type of the synthetic runs. Default: CV',
+        choices = ["CV", "IV_Two_Probes"],
+        default = "CV",
+        dest = 'run_type',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    script_main(args.rows, args.repeats, utilities.CVIV_Types[args.run_type])
+
+if __name__ == "__main__":
+    main()
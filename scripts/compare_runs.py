@@ -22,7 +22,6 @@
 
 from pathlib import Path
 import logging
-import sqlite3
 import shutil
 import pandas
 import datetime
@@ -40,19 +39,25 @@ def compare_runs_task(
                         font_size: int = 18,
                       ):
     with Federico.handle_task("compare_runs", drop_old_data=True) as Felicity:
-        with sqlite3.connect(db_path) as sql_conn:
+        with utilities.get_db_connection(db_path) as sql_conn:
             df = pandas.DataFrame()
             param_df = pandas.DataFrame()
+            cv_params = utilities.get_cv_parameters(sql_conn, 'CVParameters', 'RunInfo', run_df['Runs'])
+            cv_params = {run: run_params.drop(columns="RunName").reset_index(drop=True) for run, run_params in cv_params.groupby("RunName")}
             for index, row in run_df.iterrows():
                 run = row['Runs']
                 labels = row['labels']
 
                 run_info = utilities.get_all_run_info(sql_conn, "RunInfo", run)
 
-                this_run_df = pandas.read_csv(output_path / run / "data.csv")
+                this_run_df = utilities.get_run_dataframe(sql_conn, utilities.get_run_record(sql_conn, "RunInfo", run))
+                if this_run_df is None:  # Runs processed before the measurements were kept in the database
+                    this_run_df = utilities.read_run_dataframe(output_path / run)
                 if run_info["Run Type"] == utilities.CVIV_Types.CV:
                     file = output_path / run / "extracted_cv.csv"
-                    if file.exists():
+                    if run in cv_params:
+                        this_run_param_df = cv_params[run]
+                    elif file.exists():  # Runs processed before the parameters were kept in the database
                         this_run_param_df = pandas.read_csv(file)
                     else:
                         this_run_param_df = pandas.DataFrame()
@@ -255,13 +260,22 @@ def script_main(
                 run_file_path: Path,
                 plot_legend: str,
                 font_size: int = 18,
+                selection: list[str] = None,
                 ):
     logger = logging.getLogger('compare_runs')
 
     with RM.RunManager(output_path / run_name) as Xavier:
         Xavier.create_run(raise_error=False)
 
-        shutil.copy(run_file_path, Xavier.path_directory / "compare_runs.csv")
+        if selection is None:
+            shutil.copy(run_file_path, Xavier.path_directory / "compare_runs.csv")
+        else:  # The selected runs are written as a run file, labelled by their name, so the comparison can be repeated
+            with utilities.get_db_connection(db_path) as sql_conn:
+                selected_runs = [run for (run, ) in utilities.select_runs(sql_conn, 'RunInfo', selection)]
+            if len(selected_runs) == 0:
+                raise RuntimeError(f"No runs match the selection: {' '.join(selection)}")
+            logger.info(f"Selected {len(selected_runs)} runs")
+            pandas.DataFrame({"Runs": selected_runs, "labels": selected_runs}).to_csv(Xavier.path_directory / "compare_runs.csv", index=False)
 
         run_df = pandas.read_csv(Xavier.path_directory / "compare_runs.csv")
         if plot_legend == "FILE":
@@ -269,7 +283,7 @@ def script_main(
 
         all_runs_found_in_db = True
         run_types = []
-        with sqlite3.connect(db_path) as sql_conn:
+        with utilities.get_db_connection(db_path) as sql_conn:
             for run in run_df["Runs"]:
                 info = utilities.get_run_info(sql_conn, "RunInfo", run, {"type": "Run Type"})
                 if len(info) == 0:
@@ -359,6 +373,15 @@ def main():
         default = "FILE",
         dest = 'plot_legend',
     )
+    parser.add_argument(
+        '-s',
+        '--select',
+        metavar = 'TERM',
+        type = str,
+        nargs = '+',
+        help = 'Compare the runs matching the selection instead of the ones in the run file, e.g. "sample=FBK-3 type=CV temperature<-20 pixel=1 2"',
+        dest = 'selection',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -407,12 +430,13 @@ def main():
     output_path = output_path.absolute()
 
     run_file_path: Path = args.run_file
-    if not run_file_path.exists() or not run_file_path.is_file():
-        logging.error("You must define a valid run file")
-        exit(1)
-    run_file_path = run_file_path.absolute()
+    if args.selection is None:
+        if not run_file_path.exists() or not run_file_path.is_file():
+            logging.error("You must define a valid run file")
+            exit(1)
+        run_file_path = run_file_path.absolute()
 
-    script_main(args.run_name, db_path, output_path, run_file_path, args.plot_legend, args.font_size)
+    script_main(args.run_name, db_path, output_path, run_file_path, args.plot_legend, args.font_size, args.selection)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
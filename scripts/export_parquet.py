@@ -0,0 +1,265 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from pathlib import Path
+import logging
+import sqlite3
+import pickle
+import shutil
+import os
+
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+import utilities
+
+_arrow_types = {
+    str: pyarrow.string(),
+    float: pyarrow.float64(),
+    int: pyarrow.int64(),
+    bool: pyarrow.bool_(),
+    utilities.CVIV_Types: pyarrow.string(),  # Exported by name, so the partitions read type=CV instead of type=2
+}
+
+def get_run_info_export_columns(sql_conn: sqlite3.Connection, runInfoTable: str):
+    # Every column in the schema registry is exported, the ones missing from older databases as nulls
+    existing = [row[1] for row in sql_conn.execute(f"PRAGMA table_info('{runInfoTable}');")]
+    columns = [("RunID", int), ("RunName", str)]
+    columns += [(col, info[2]) for col, info in utilities.run_info_schema.items()]
+    columns += [("Observations", str)]
+    select = [f"`{col}`" if col in existing else f"NULL AS `{col}`" for col, _ in columns]
+    return columns, select
+
+def convert_column(values: tuple, python_type):
+    if python_type == utilities.CVIV_Types:
+        return [None if value is None else utilities.CVIV_Types(value).name for value in values]
+    elif python_type == bool:
+        return [None if value is None else bool(value) for value in values]
+    return values
+
+def iter_record_batches(cursor: sqlite3.Cursor, columns: list[tuple], export_pass: int, batch_size: int):
+    # Only batch_size rows are held in memory at any time, the dataset writer flushes them to the partitions
+    schema = make_export_schema(columns)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        arrays = []
+        for (col, python_type), values in zip(columns, zip(*rows)):
+            arrays += [pyarrow.array(convert_column(values, python_type), type=_arrow_types[python_type])]
+        arrays += [pyarrow.array([export_pass]*len(rows), type=pyarrow.int64())]
+        yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+def make_export_schema(columns: list[tuple]):
+    return pyarrow.schema([(col, _arrow_types[python_type]) for col, python_type in columns] + [("exportPass", pyarrow.int64())])
+
+def write_partitioned(batches, columns: list[tuple], base_dir: Path, export_pass: int):
+    schema = make_export_schema(columns)
+    pyarrow.dataset.write_dataset(
+                                    batches,
+                                    base_dir,
+                                    schema = schema,
+                                    format = "parquet",
+                                    partitioning = pyarrow.dataset.partitioning(pyarrow.schema([schema.field("sample"), schema.field("type")]), flavor="hive"),
+                                    basename_template = f"export{export_pass}-{{i}}.parquet",
+                                    existing_data_behavior = "overwrite_or_ignore",
+                                 )
+
+def script_main(
+                db_path: Path,
+                output_path: Path,
+                batch_size: int = 10000,
+                full: bool = False,
+                ):
+    logger = logging.getLogger('export_parquet')
+
+    runInfoTable = 'RunInfo'
+    cvParametersTable = 'CVParameters'
+
+    runs_path = output_path / "runs"
+    parameters_path = output_path / "cv_parameters"
+    observations_path = output_path / "observations.parquet"
+    state_path = output_path / "export_state.pkl"
+
+    state = {'pass': 0, 'last_run_id': 0, 'last_parameters_change': -1}
+    if full:
+        for path in [runs_path, parameters_path]:
+            if path.is_dir():
+                shutil.rmtree(path)
+    elif state_path.exists():
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+        if 'last_parameters_change' not in state:  # Exports from before the change stamps, the parameters are exported again in full
+            state = {'pass': state['pass'], 'last_run_id': state['last_run_id'], 'last_parameters_change': -1}
+    export_pass = state['pass']
+
+    # The dataset writer pulls the batches from its own thread, so the connection is not a pooled one
+    sql_conn = utilities.open_db_connection(db_path, check_same_thread=False)
+    try:
+        # A single read transaction, so all the exported tables come from the same snapshot of the database. In WAL
+        # mode this does not block the scripts writing to it
+        sql_conn.execute("BEGIN TRANSACTION;")
+        try:
+            last_run_id = sql_conn.execute(f"SELECT MAX(`RunID`) FROM `{runInfoTable}`;").fetchall()[0][0] or 0
+
+            columns, select = get_run_info_export_columns(sql_conn, runInfoTable)
+            new_runs = sql_conn.execute(f"SELECT COUNT(*) FROM `{runInfoTable}` WHERE `RunID` > ?;", [state['last_run_id']]).fetchall()[0][0]
+            if new_runs > 0:
+                logger.info(f"Exporting {new_runs} new runs")
+                cursor = sql_conn.execute(f"SELECT {','.join(select)} FROM `{runInfoTable}` WHERE `RunID` > ? AND `RunID` <= ? ORDER BY `RunID`;", [state['last_run_id'], last_run_id])
+                write_partitioned(iter_record_batches(cursor, columns, export_pass, batch_size), columns, runs_path, export_pass)
+
+            # The observations can change after a run was exported, so they are always exported in full
+            obs_columns = [("RunID", int), ("RunName", str), ("Observations", str)]
+            cursor = sql_conn.execute(f"SELECT `RunID`,`RunName`,`Observations` FROM `{runInfoTable}` WHERE `RunID` <= ? ORDER BY `RunID`;", [last_run_id])
+            tmp_path = observations_path.with_suffix(".tmp")
+            with pyarrow.parquet.ParquetWriter(tmp_path, make_export_schema(obs_columns)) as writer:
+                for batch in iter_record_batches(cursor, obs_columns, export_pass, batch_size):
+                    writer.write_batch(batch)
+            os.replace(tmp_path, observations_path)
+
+            # Parameters extracted again are stamped with a new changeID (see utilities.create_cv_parameters_change_stamp) and exported
+            # again, readers should keep the highest exportPass of each (RunID, version, tag1). The unstamped rows of older
+            # databases count as change 0, so they are only exported by the first export
+            last_parameters_change = state['last_parameters_change']
+            res = sql_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{cvParametersTable}';")
+            if len(res.fetchall()) > 0:
+                existing = [row[1] for row in sql_conn.execute(f"PRAGMA table_info('{cvParametersTable}');")]
+                order = "p.`changeID`, p.`rowid`" if "changeID" in existing else "p.`rowid`"
+                if "changeID" in existing:
+                    last_parameters_change = sql_conn.execute(f"SELECT MAX(`changeID`) FROM `{cvParametersTable}`;").fetchall()[0][0] or 0
+                    if state['last_parameters_change'] < 0:
+                        where, params = "COALESCE(p.`changeID`, 0) <= ?", [last_parameters_change]
+                    else:
+                        where, params = "p.`changeID` > ? AND p.`changeID` <= ?", [state['last_parameters_change'], last_parameters_change]
+                else:
+                    last_parameters_change = 0
+                    where, params = ("1", []) if state['last_parameters_change'] < 0 else ("0", [])
+                new_parameters = sql_conn.execute(f"SELECT COUNT(*) FROM `{cvParametersTable}` p WHERE {where};", params).fetchall()[0][0]
+                if new_parameters > 0:
+                    logger.info(f"Exporting {new_parameters} new extracted parameter sets")
+                    param_columns = [("RunID", int), ("RunName", str), ("sample", str), ("type", utilities.CVIV_Types), ("version", int), ("tag1", str), ("tag2", str), ("gainLayerDepletionVoltage", float), ("fullDepletionVoltage", float)]
+                    query = f"SELECT p.`RunID`,r.`RunName`,r.`sample`,r.`type`,p.`version`,p.`tag1`,p.`tag2`,p.`gainLayerDepletionVoltage`,p.`fullDepletionVoltage` FROM `{cvParametersTable}` p JOIN `{runInfoTable}` r ON p.`RunID` = r.`RunID` WHERE {where} ORDER BY {order};"
+                    cursor = sql_conn.execute(query, params)
+                    write_partitioned(iter_record_batches(cursor, param_columns, export_pass, batch_size), param_columns, parameters_path, export_pass)
+        finally:
+            sql_conn.execute("COMMIT TRANSACTION;")
+    finally:
+        sql_conn.close()
+
+    state = {'pass': export_pass + 1, 'last_run_id': last_run_id, 'last_parameters_change': last_parameters_change}
+    with open(state_path, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='export_parquet.py',
+                    description='This script exports the run information, the observations and the extracted parameters to a Parquet dataset, partitioned by sample and run type, only adding the runs which are new since the last export',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-d',
+        '--dbPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the database directory, where the run database is placed. Default: ./data',
+        default = "./data",
+        dest = 'db_path',
+    )
+    parser.add_argument(
+        '-o',
+        '--outputPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the directory where the Parquet dataset is kept.',
+        required = True,
+        dest = 'output_path',
+    )
+    parser.add_argument(
+        '--batchSize',
+        metavar = 'N',
+        type = int,
+        help = 'Number of rows read from the database and converted at a time. Default: 10000',
+        default = 10000,
+        dest = 'batch_size',
+    )
+    parser.add_argument(
+        '--full',
+        action = 'store_true',
+        help = 'Discard the previous exports and export all the runs again',
+        dest = 'full',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    db_path: Path = args.db_path
+    if not db_path.exists():
+        raise RuntimeError("The database path does not exist")
+    db_path = db_path.absolute()
+    db_path = db_path / "run_db.sqlite"
+    if not db_path.exists() or not db_path.is_file():
+        raise RuntimeError("The database file does not exist")
+
+    output_path: Path = args.output_path
+    if not output_path.exists() or not output_path.is_dir():
+        logging.error("You must define a valid output path")
+        exit(1)
+    output_path = output_path.absolute()
+
+    script_main(db_path, output_path, args.batch_size, args.full)
+
+if __name__ == "__main__":
+    main()
@@ -21,86 +21,53 @@
 #############################################################################
 
 from pathlib import Path
+import concurrent.futures
 import logging
-import sqlite3
-import pandas
-import datetime
 
 import lip_pps_run_manager as RM
 
 import utilities
 
-def load_df_task(Pedro: RM.RunManager, db_path: Path, run_name: str, output_path: Path, backup_path: Path):
+def load_df_task(Pedro: RM.RunManager, db_path: Path, run_name: str, output_path: Path, backup_path: Path, write_csv: bool = False):
     with Pedro.handle_task("load_df_task", drop_old_data=True) as Lilly:
-        with sqlite3.connect(db_path) as sql_conn:
+        with utilities.get_db_connection(db_path) as sql_conn:
             utilities.enable_foreign_keys(sql_conn)
 
-            run_info_sql = f"SELECT `RunID`,`RunName`,`path`,`type`,`sample`,`pixel row`,`pixel col`,`begin location`,`end location`,`start` FROM 'RunInfo' WHERE `RunName`=?;"
-            res = sql_conn.execute(run_info_sql, [run_name]).fetchall()
-            if len(res) == 0:
+            run_info = utilities.get_run_record(sql_conn, 'RunInfo', run_name)
+            if run_info is None:
                 raise RuntimeError(f"Unable to find information in the database for run {run_name}")
 
-            runId = res[0][0]
-            run_file_path = Path(res[0][2])
-            run_type = utilities.CVIV_Types(res[0][3])
-            sample = res[0][4]
-            pixel_row = res[0][5]
-            pixel_col = res[0][6]
-            begin_location = res[0][7]
-            end_location = res[0][8]
-            start = datetime.datetime.fromisoformat(res[0][9])
-
-            if not run_file_path.exists() or not run_file_path.is_file():
-                orig_run_file_path = run_file_path
-                extension = "dat"
-                if run_type == utilities.CVIV_Types.IV or run_type == utilities.CVIV_Types.IV_Two_Probes:
-                    extension = 'iv'
-                elif run_type == utilities.CVIV_Types.CV:
-                    extension = 'cv'
-                run_file_path = backup_path / (res[0][1] + "." + extension)
-
-            if not run_file_path.exists() or not run_file_path.is_file():
-                raise RuntimeError(f"Could not find the run file for run {run_name}")
-
-            cols = None
-            # TODO: Missing standard IV
-            if run_type == utilities.CVIV_Types.IV_Two_Probes:
-                cols = ["Bias Voltage [V]", "Total Current [A]", "Pad Current [A]"]
-            elif run_type == utilities.CVIV_Types.CV:
-                cols = ["Voltage [V]", "Capacitance [F]", "Conductivity [S]", "Bias Voltage [V]", "Pad Current [A]"]
-            else:
-                raise RuntimeError(f"Columns are not defined for the run type {run_type}")
-
-            df = pandas.read_csv(
-                                run_file_path,
-                                sep = "\t",
-                                names = cols,
-                                skiprows = begin_location + 1,
-                                nrows = end_location - begin_location - 1,
-                                 )
-
-            for col in df.columns:
-                if col in ["Capacitance [F]", "Conductivity [S]", "Legend"]:
-                    continue
-                df[col] = -df[col]
-
-            if run_type == utilities.CVIV_Types.CV:
-                df["InverseCSquare"] = 1/(df["Capacitance [F]"]**2)
-
-            tmp = df['Bias Voltage [V]'].diff()
-            tmp.fillna(tmp[1], inplace = True)
-            tmp.loc[tmp == 0] = tmp.shift(-1)
-            df['Ascending'] = (tmp > 0)
-            df['Descending'] = (tmp < 0)
-
-            df['Is Coarse'] = False
-            if start > datetime.datetime(2023, 8, 1, 0, 0, 0):
-                df.loc[:19, 'Is Coarse'] = True # 20-1 because indexing from 0
-                #df['Is Coarse'].iloc[:20] = True
+            runId = run_info['RunID']
+            run_file_path = Path(run_info['path'])
+            run_type = utilities.CVIV_Types(run_info['type'])
+            sample = run_info['sample']
+            pixel_row = run_info['pixel row']
+            pixel_col = run_info['pixel col']
+            begin_location = run_info['begin location']
+            end_location = run_info['end location']
+            sha256 = run_info['SHA256']
+
+            # The measurements are normally stored when the run is loaded, only runs loaded by older versions of
+            # load_runs (or whose data could not be parsed then) need the run file to be parsed here, or the copy of
+            # the run file in the database if the file is no longer available
+            data = utilities.load_run_data(sql_conn, 'RunData', runId)
+            if data is None:
+                run_file_path = utilities.find_run_file(run_file_path, run_info['RunName'], run_type, sha256, backup_path)
+                if run_file_path is not None:
+                    with utilities.open_cviv_file(run_file_path) as run_file:
+                        data = utilities.parse_run_data(run_file, run_type, begin_location, end_location, run_info.get('begin offset'), run_info.get('end offset'))
+                else:
+                    data = utilities.parse_backup_blob(sql_conn, 'runBackup', run_info)
+                    if data is None:
+                        raise RuntimeError(f"Could not find the run file for run {run_name}")
+
+                utilities.write_db(sql_conn, utilities.create_run_data_table, 'RunData', 'RunInfo', logging.getLogger('load_df'))
+                utilities.write_db(sql_conn, utilities.store_run_data, 'RunData', runId, data)
+
+            df = utilities.make_run_dataframe(run_type, data)
             #print(df.to_string())
 
-            # df.to_feather(Lilly.path_directory / "data.feather")
-            df.to_csv(Lilly.path_directory / "data.csv", index=False)
+            utilities.save_run_dataframe(df, run_type, Lilly.path_directory, write_csv=write_csv)
 
             # print(df)
 
@@ -110,45 +77,151 @@ def script_main(
                 output_path: Path,
                 backup_path: Path,
                 already_exists: bool = False,
+                write_csv: bool = False,
                 ):
     logger = logging.getLogger('load_df')
 
     run_file_path: Path = None
-    with sqlite3.connect(db_path) as sql_conn:
+    with utilities.get_db_connection(db_path) as sql_conn:
         utilities.enable_foreign_keys(sql_conn)
 
-        run_info_sql = f"SELECT `RunName`,`path`,`type`,`name`,`RunID` FROM 'RunInfo' WHERE `RunName`=?;"
-        res = sql_conn.execute(run_info_sql, [run_name]).fetchall()
+        run_info = utilities.get_run_record(sql_conn, 'RunInfo', run_name)
 
         if not backup_path.exists():
             backup_path.mkdir()
 
-        if len(res) > 0:
-            run_file_path = Path(res[0][1])
-            if not run_file_path.exists() or not run_file_path.is_file():
-                orig_run_file_path = run_file_path
-                extension = "dat"
-                if res[0][2] == utilities.CVIV_Types.IV.value or res[0][2] == utilities.CVIV_Types.IV_Two_Probes.value:
-                    extension = 'iv'
-                elif res[0][2] == utilities.CVIV_Types.CV.value:
-                    extension = 'cv'
-                run_file_path = backup_path / (res[0][0] + "." + extension)
-                if not run_file_path.exists() or not run_file_path.is_file():
-                    print(f"The original run file ({orig_run_file_path}) is no longer available, and the backup file ({run_file_path}) could not be found. Recreating the backup file from database.")
-
-                    res = sql_conn.execute("SELECT `Data` FROM 'runBackup' WHERE `RunID`=?;", [res[0][4]]).fetchall()
-                    with run_file_path.open("wb") as file:
-                        file.write(res[0][0])
-
-                    if not run_file_path.exists() or not run_file_path.is_file():
-                        raise RuntimeError(f"Unable to recreate the backup run file ({run_file_path}).")
+        if run_info is not None and utilities.load_run_data(sql_conn, 'RunData', run_info['RunID'], ["Bias Voltage [V]"]) is not None:
+            run_file_path = Path(run_info['path'])  # The measurements are in the database, the run file is not needed
+        elif run_info is not None:
+            orig_run_file_path = Path(run_info['path'])
+            sha256 = run_info['SHA256']
+            run_file_path = utilities.find_run_file(orig_run_file_path, run_info['RunName'], utilities.CVIV_Types(run_info['type']), sha256, backup_path)
+            if run_file_path is None:
+                # The measurements are then parsed straight from the copy of the run file in the database
+                if len(utilities.get_runs_with_backup_blob(sql_conn, 'runBackup', [run_info['RunID']])) == 0:
+                    raise RuntimeError(f"The original run file ({orig_run_file_path}) is no longer available, the backup file could not be found and the database does not hold a copy of the run file for run {run_name}.")
+                logger.info(f"The original run file ({orig_run_file_path}) is no longer available, the run will be loaded from the copy in the database")
+                run_file_path = orig_run_file_path
     if run_file_path is None:
         raise RuntimeError(f"Could not find a run file in the run database for run {run_name}")
 
     with RM.RunManager(output_path / run_name) as William:
         William.create_run(raise_error=not already_exists)
 
-        load_df_task(William, db_path, run_name, output_path, backup_path)
+        load_df_task(William, db_path, run_name, output_path, backup_path, write_csv=write_csv)
+
+def load_df_batch_task(db_path: Path, run_path: Path, run_info: dict, source: str, run_file_path: Path = None, write_csv: bool = False):
+    # Runs in the worker processes of load_df_batch: the measurements are read from the database (source "data"), or
+    # parsed from the run file ("file") or from its copy in the database ("blob"), in which case they are returned so
+    # the main process can store them in the database
+    run_type = utilities.CVIV_Types(run_info['type'])
+    with RM.RunManager(run_path) as Gabriel:
+        Gabriel.create_run(raise_error=False)
+
+        with Gabriel.handle_task("load_df_task", drop_old_data=True) as Lilly:
+            if source == "file":
+                with utilities.open_cviv_file(run_file_path) as run_file:
+                    data = utilities.parse_run_data(run_file, run_type, run_info['begin location'], run_info['end location'], run_info.get('begin offset'), run_info.get('end offset'))
+            else:
+                with utilities.get_db_connection(db_path) as sql_conn:
+                    if source == "data":
+                        data = utilities.load_run_data(sql_conn, 'RunData', run_info['RunID'])
+                    else:
+                        data = utilities.parse_backup_blob(sql_conn, 'runBackup', run_info)
+                if data is None:
+                    raise RuntimeError(f"The measurements of run {run_info['RunName']} are no longer in the database")
+
+            df = utilities.make_run_dataframe(run_type, data)
+            utilities.save_run_dataframe(df, run_type, Lilly.path_directory, write_csv=write_csv)
+
+    if source == "data":
+        return None
+    return data
+
+# Loads the dataframes of many runs at once: the run information is fetched with a single query, the run files are
+# only looked for (falling back to the copy in the database) for the runs whose measurements are not in the database
+# and the runs are then loaded by a pool of worker processes. Runs whose load_df task is already completed are skipped,
+# unless reload_data is set. Returns the names of the runs which could not be loaded, the errors are logged
+def load_df_batch(
+                db_path: Path,
+                run_names: list[str],
+                output_path: Path,
+                backup_path: Path,
+                reload_data: bool = False,
+                write_csv: bool = False,
+                workers: int = 1,
+                ):
+    logger = logging.getLogger('load_df')
+
+    if not reload_data:
+        skipped = set()
+        for run_name in run_names:
+            run_path = output_path / run_name
+            if run_path.exists() and run_path.is_dir():
+                with RM.RunManager(run_path) as David:
+                    if David.task_completed("load_df_task"):
+                        skipped.add(run_name)
+        run_names = [run_name for run_name in run_names if run_name not in skipped]
+
+    failed_runs = []
+    jobs = {}
+    with utilities.get_db_connection(db_path) as sql_conn:
+        utilities.enable_foreign_keys(sql_conn)
+
+        run_records = utilities.get_run_records(sql_conn, 'RunInfo', run_names)
+        run_ids = [run_info['RunID'] for run_info in run_records.values()]
+        runs_with_data = utilities.get_runs_with_data(sql_conn, 'RunData', run_ids)
+        runs_with_blob = utilities.get_runs_with_backup_blob(sql_conn, 'runBackup', run_ids)
+
+        for run_name in run_names:
+            run_info = run_records.get(run_name)
+            if run_info is None:
+                logger.error(f"Unable to find information in the database for run {run_name}")
+                failed_runs += [run_name]
+                continue
+            if run_info['RunID'] in runs_with_data:
+                jobs[run_name] = (run_info, "data", None)
+                continue
+
+            run_file_path = utilities.find_run_file(Path(run_info['path']), run_name, utilities.CVIV_Types(run_info['type']), run_info['SHA256'], backup_path)
+            if run_file_path is not None:
+                jobs[run_name] = (run_info, "file", run_file_path)
+            elif run_info['RunID'] in runs_with_blob:
+                jobs[run_name] = (run_info, "blob", None)
+            else:
+                logger.error(f"The run file of run {run_name} is no longer available and the database does not hold a copy of it")
+                failed_runs += [run_name]
+
+        def store_data(run_name: str, data: dict):
+            if data is None:
+                return
+            utilities.write_db(sql_conn, utilities.create_run_data_table, 'RunData', 'RunInfo', logger)
+            utilities.write_db(sql_conn, utilities.store_run_data, 'RunData', jobs[run_name][0]['RunID'], data)
+            sql_conn.commit()
+
+        if workers is None or workers <= 1:
+            for run_name, (run_info, source, run_file_path) in jobs.items():
+                try:
+                    store_data(run_name, load_df_batch_task(db_path, output_path / run_name, run_info, source, run_file_path, write_csv))
+                except Exception as error:
+                    logger.error(f'Unable to load run {run_name}: {type(error).__name__}: {error}')
+                    failed_runs += [run_name]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for run_name, (run_info, source, run_file_path) in jobs.items():
+                    futures[executor.submit(load_df_batch_task, db_path, output_path / run_name, run_info, source, run_file_path, write_csv)] = run_name
+
+                for future in concurrent.futures.as_completed(futures):
+                    run_name = futures[future]
+                    try:
+                        store_data(run_name, future.result())
+                        logger.info(f"Loaded run {run_name}")
+                    except Exception as error:
+                        logger.error(f'Unable to load run {run_name}: {type(error).__name__}: {error}')
+                        failed_runs += [run_name]
+
+    return failed_runs
 
 def main():
     import argparse
@@ -191,10 +264,26 @@ def main():
         '--run',
         metavar = 'RUN_NAME',
         type = str,
-        help = 'The name of the run to process. The run database information will be used to find the run',
+        nargs = '+',
+        help = 'The name of the run to process, or of several runs to load them all at once. The run database information will be used to find the runs',
         required = True,
         dest = 'run',
     )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        metavar = 'N',
+        type = int,
+        help = 'Number of runs to load in parallel, when several runs are given. Default: 1',
+        default = 1,
+        dest = 'workers',
+    )
+    parser.add_argument(
+        '--csv',
+        action = 'store_true',
+        help = 'Also save the run dataframe as data.csv, next to data.parquet',
+        dest = 'write_csv',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -248,7 +337,12 @@ def main():
         exit(1)
     output_path = output_path.absolute()
 
-    script_main(db_path, args.run, output_path, backup_path)
+    if len(args.run) == 1:
+        script_main(db_path, args.run[0], output_path, backup_path, write_csv=args.write_csv)
+    else:
+        failed_runs = load_df_batch(db_path, args.run, output_path, backup_path, reload_data=True, write_csv=args.write_csv, workers=args.workers)
+        if len(failed_runs) > 0:
+            raise RuntimeError(f"Unable to load {len(failed_runs)} runs: {', '.join(failed_runs)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
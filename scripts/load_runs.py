@@ -22,21 +22,161 @@
 
 from pathlib import Path
 import logging
+import tempfile
 import pickle
 import pandas
 import sqlite3
-import shutil
 
 import lip_pps_run_manager as RM
 
 import utilities
 
 
+# The measurements are parsed once, here, and stored in the database for all the later tasks. A run whose measurements
+# can not be parsed is still loaded, load_df will try to parse it again
+def store_measurements(
+                        sql_conn: sqlite3.Connection,
+                        runDataTable: str,
+                        run_id: int,
+                        runInfo: dict,
+                        file,
+                        logger: logging.Logger,
+                        ):
+    run_type = runInfo['type']
+    if utilities.get_data_columns(run_type) is None:
+        return
+    try:
+        data = utilities.parse_run_data(file, run_type, runInfo['begin location'], runInfo['end location'], runInfo.get('begin offset'), runInfo.get('end offset'))
+    except Exception as error:
+        logger.warning(f"Unable to parse the measurements of {runInfo['path']}, they will be parsed by load_df: {type(error).__name__}: {error}")
+        return
+    utilities.store_run_data(sql_conn, runDataTable, run_id, data)
+
+def ingest_runs(
+                sql_conn: sqlite3.Connection,
+                runInfoTable: str,
+                runBackupTable: str,
+                run_list: list[dict],
+                backup_path: Path,
+                logger: logging.Logger,
+                backup_mode: str = "store",
+                blob_codec: str = "zlib",
+                runDataTable: str = 'RunData',
+                ):
+    if backup_mode not in ["store", "database", "both"]:
+        raise RuntimeError(f"Unknown backup mode: {backup_mode}")
+
+    # Load the existing name->hash map and allocate the run names from a single counter, instead of querying the
+    # database several times for each run
+    known_runs = {}
+    for name, run_name, path, sha256, md5 in sql_conn.execute(f"SELECT `name`,`RunName`,`path`,`SHA256`,`MD5` FROM `{runInfoTable}` ORDER BY `RunID`;"):
+        if name not in known_runs:
+            known_runs[name] = (run_name, path, sha256, md5)
+    next_idx = sql_conn.execute(f"SELECT COUNT(RunName) FROM `{runInfoTable}`").fetchall()[0][0]
+    last_run_id = sql_conn.execute(f"SELECT MAX(RunID) FROM `{runInfoTable}`").fetchall()[0][0]
+    if last_run_id is None:
+        last_run_id = 0
+
+    new_runs = []
+    columns = []
+    for runInfo in run_list:
+        if runInfo['name'] in known_runs:
+            known = known_runs[runInfo['name']]
+            matches = True
+            if runInfo['path'] != known[1]:
+                print("Path does not match, but this could be due to running from a different computer or user...")
+                #matches = False
+            if runInfo['SHA256'] != known[2]:
+                matches = False
+            if runInfo['MD5'] != known[3]:
+                matches = False
+
+            if matches:
+                continue
+            else:
+                raise RuntimeError(f"Had a matching measurement name, but the other parameters do not match... name {runInfo['name']}")
+
+        run_name = 'CVIV-Run{:04d}'.format(next_idx)
+        next_idx += 1
+        known_runs[runInfo['name']] = (run_name, runInfo['path'], runInfo['SHA256'], runInfo['MD5'])
+        new_runs += [(run_name, runInfo)]
+        for key in runInfo:
+            if key not in columns and key in utilities.run_info_schema:
+                columns += [key]
+
+    if len(new_runs) == 0:
+        return []
+
+    column_str = "'RunName'"
+    values_str = "?"
+    for key in columns:
+        column_str += f",'{key}'"
+        values_str += ", ?"
+
+    values = utilities.convert_run_info_values([runInfo for run_name, runInfo in new_runs], columns)
+    values = [[run_name] + row for (run_name, runInfo), row in zip(new_runs, values)]
+
+    insert_sql = f"INSERT INTO '{runInfoTable}'({column_str}) VALUES({values_str});"
+    sql_conn.executemany(insert_sql, values)
+    utilities.invalidate_run_info_cache(sql_conn, runInfoTable)
+
+    run_ids = dict(sql_conn.execute(f"SELECT `RunName`,`RunID` FROM `{runInfoTable}` WHERE `RunID` > ?;", [last_run_id]).fetchall())
+    new_runs = [(run_ids[run_name], run_name, runInfo) for run_name, runInfo in new_runs]
+
+    # Backup the run information
+    insert_sql = f"INSERT INTO '{runBackupTable}'('RunID','SHA256') VALUES(?, ?);"
+    sql_conn.executemany(insert_sql, [(run_id, runInfo['SHA256']) for run_id, run_name, runInfo in new_runs])
+    archive_runs = {}
+    for run_id, run_name, runInfo in new_runs:
+        archive_path, member = utilities.split_archive_path(runInfo['path'])
+        if member is not None:
+            archive_runs.setdefault(archive_path, {})[member] = (run_id, runInfo)
+            continue
+        if backup_mode == "store" or backup_mode == "both":
+            utilities.add_to_backup_store(backup_path, Path(runInfo['path']), runInfo['SHA256'])
+        if backup_mode == "database" or backup_mode == "both":
+            utilities.write_backup_blob(sql_conn, runBackupTable, run_id, utilities.iter_file_chunks(Path(runInfo['path'])), blob_codec)
+        with utilities.open_cviv_file(Path(runInfo['path'])) as file:
+            store_measurements(sql_conn, runDataTable, run_id, runInfo, file, logger)
+
+    # The members of each archive are backed up in a single pass over the archive, since compressed tarballs can not be
+    # read out of order without decompressing them from the start. Each member is streamed once, in chunks, into the
+    # backup store (or a spool file if the copy is only kept in the database) and the other copies and the measurements
+    # are then read from there, so the member is never fully held in memory
+    for archive_path, members in archive_runs.items():
+        for member, file in utilities.iter_archive_files(archive_path, set(members.keys())):
+            run_id, runInfo = members[member]
+            if backup_mode == "store" or backup_mode == "both":
+                store_path = utilities.write_to_backup_store(backup_path, utilities.iter_stream_chunks(file), runInfo['SHA256'])
+                if backup_mode == "both":
+                    utilities.write_backup_blob(sql_conn, runBackupTable, run_id, utilities.iter_file_chunks(store_path), blob_codec)
+                with utilities.open_cviv_file(store_path) as stored_file:
+                    store_measurements(sql_conn, runDataTable, run_id, runInfo, stored_file, logger)
+            else:
+                with tempfile.SpooledTemporaryFile(max_size=16*utilities.BLOB_CHUNK_SIZE) as spool:
+                    for chunk in utilities.iter_stream_chunks(file):
+                        spool.write(chunk)
+                    spool.seek(0)
+                    utilities.write_backup_blob(sql_conn, runBackupTable, run_id, utilities.iter_stream_chunks(spool), blob_codec)
+                    spool.seek(0)
+                    store_measurements(sql_conn, runDataTable, run_id, runInfo, spool, logger)
+
+    logger.info(f"Added {len(new_runs)} new runs to the database")
+    return new_runs
+
 def script_main(
                 run_path: Path,
                 data_path: Path,
                 backup_path: Path,
                 input_path: Path,
+                workers: int = 1,
+                rehash: bool = False,
+                max_depth: int = None,
+                include: list[str] = None,
+                exclude: list[str] = None,
+                backup_mode: str = "store",
+                blob_codec: str = "zlib",
+                recursive: bool = False,
                 ):
     logger = logging.getLogger('load_runs')
 
@@ -60,78 +200,42 @@ def script_main(
         task_name = f'load_pass_{load_idx}'
         with Johnny.handle_task(task_name, drop_old_data=True) as Carrie:
             sql_path = data_path / 'run_db.sqlite'
-            run_list = utilities.find_and_sort_cviv_runs(input_path, logger)
-
-            run_df = pandas.DataFrame(run_list, index=None)
-
-            with sqlite3.connect(sql_path) as sql_conn:
+            with utilities.get_db_connection(sql_path) as sql_conn:
                 utilities.enable_foreign_keys(sql_conn)
 
+                runInfoTable = f'RunInfo'
+                scanIndexTable = f'ScanIndex'
+
+                scan_index = {}
+                if not rehash:
+                    scan_index = utilities.load_scan_index(sql_conn, scanIndexTable, runInfoTable)
+
+                run_list, error_report, scanned_files = utilities.find_and_sort_cviv_runs(
+                                                                                            input_path,
+                                                                                            logger,
+                                                                                            workers = workers,
+                                                                                            scan_index = scan_index,
+                                                                                            max_depth = max_depth,
+                                                                                            include = include,
+                                                                                            exclude = exclude,
+                                                                                            recursive = recursive,
+                                                                                           )
+                if len(error_report) > 0:
+                    logger.warning(f"{len(error_report)} files could not be processed, see the scan error report in {Carrie.task_path}")
+                    pandas.DataFrame(error_report, index=None).to_csv(Carrie.task_path / "scan_errors.csv", index=False)
+
+                run_df = pandas.DataFrame(run_list, index=None)
+
                 res = sql_conn.execute("BEGIN TRANSACTION;")
                 try:
-                    runInfoTable = f'RunInfo'
                     utilities.create_run_info_table(sql_conn, runInfoTable, run_df.columns, logger)
                     utilities.create_run_backup_table(sql_conn, 'runBackup', runInfoTable, logger)
+                    utilities.create_scan_index_table(sql_conn, scanIndexTable, logger)
+                    utilities.create_run_data_table(sql_conn, 'RunData', runInfoTable, logger)
+
+                    ingest_runs(sql_conn, runInfoTable, 'runBackup', run_list, backup_path, logger, backup_mode=backup_mode, blob_codec=blob_codec)
 
-                    for idx in range(len(run_list)):
-                        runInfo = run_list[idx]
-
-                        find_sql = f"SELECT `RunName`,`path`,`name`,`SHA256`,`MD5` FROM `{runInfoTable}` WHERE `name`='{runInfo['name']}';"
-                        res = sql_conn.execute(find_sql).fetchall()
-                        if len(res) > 0:
-                            res = res[0]
-                            matches = True
-                            if runInfo['path'] != res[1]:
-                                print("Path does not match, but this could be due to running from a different computer or user...")
-                                #matches = False
-                            if runInfo['name'] != res[2]:
-                                matches = False
-                            if runInfo['SHA256'] != res[3]:
-                                matches = False
-                            if runInfo['MD5'] != res[4]:
-                                matches = False
-
-                            if matches:
-                                continue
-                            else:
-                                raise RuntimeError(f"Had a matching measurement name, but the other parameters do not match... name {runInfo['name']}")
-
-                        count_sql = f"SELECT COUNT(RunName) FROM `{runInfoTable}`"
-                        next_idx = sql_conn.execute(count_sql).fetchall()[0][0]
-
-                        column_str = "'RunName'"
-                        values_str = "?"
-                        values = ['CVIV-Run{:04d}'.format(next_idx)]
-
-                        for key in runInfo:
-                            column_str += f",'{key}'"
-                            values_str += ", ?"
-                            if type(runInfo[key]) == bool:
-                                values += [int(runInfo[key])]
-                            elif type(runInfo[key]) == utilities.CVIV_Types:
-                                values += [int(runInfo[key].value)]
-                            else:
-                                values += [runInfo[key]]
-
-                        insert_sql = f"INSERT INTO '{runInfoTable}'({column_str}) VALUES({values_str});"
-                        sql_conn.execute(insert_sql, values)
-
-                        find_sql = f"SELECT `RunID`,`RunName` FROM `{runInfoTable}` WHERE `SHA256`='{runInfo['SHA256']}';"
-                        res = sql_conn.execute(find_sql).fetchall()[0]
-
-                        # Backup the run information
-                        Data = None
-                        with open(runInfo['path'], 'rb') as file:
-                            Data = file.read()
-                        insert_sql = f"INSERT INTO 'runBackup'('RunID','Data') VALUES(?, ?);"
-                        sql_conn.execute(insert_sql, [res[0], Data])
-
-                        extension = 'dat'
-                        if runInfo['type'] == utilities.CVIV_Types.IV or runInfo['type'] == utilities.CVIV_Types.IV_Two_Probes:
-                            extension = 'iv'
-                        elif runInfo['type'] == utilities.CVIV_Types.CV:
-                            extension = 'cv'
-                        shutil.copy(runInfo['path'], backup_path / f'{res[1]}.{extension}')
+                    utilities.update_scan_index(sql_conn, scanIndexTable, scanned_files)
                 except:
                     res = sql_conn.execute("ROLLBACK TRANSACTION;")
                     raise
@@ -178,6 +282,66 @@ def main():
         required = True,
         dest = 'input_path',
     )
+    parser.add_argument(
+        '--backupMode',
+        type = str,
+        help = 'Where to keep the backup of the raw run files: in the content-addressed backup store in the backup directory (hardlinked to the original where possible), as a BLOB in the database or both. Default: store',
+        choices = ["store", "database", "both"],
+        default = "store",
+        dest = 'backup_mode',
+    )
+    parser.add_argument(
+        '--blobCodec',
+        type = str,
+        help = 'Compression to use for the run files kept in the database. Default: zlib',
+        choices = utilities.BLOB_CODECS,
+        default = "zlib",
+        dest = 'blob_codec',
+    )
+    parser.add_argument(
+        '--maxDepth',
+        metavar = 'DEPTH',
+        type = int,
+        help = 'Maximum number of directory levels to descend into below the input directory, implies --recursive. Default: no limit',
+        dest = 'max_depth',
+    )
+    parser.add_argument(
+        '--recursive',
+        help = 'Search the whole input directory tree for runs, including the files directly in the input directory. By default only the files in the sub-directories of the input directory are considered',
+        action = 'store_true',
+        dest = 'recursive',
+    )
+    parser.add_argument(
+        '--include',
+        metavar = 'GLOB',
+        type = str,
+        nargs = '+',
+        help = 'Only consider files matching one of these patterns. Patterns with a "/" are matched against the path relative to the input directory, otherwise against the file name',
+        dest = 'include',
+    )
+    parser.add_argument(
+        '--exclude',
+        metavar = 'GLOB',
+        type = str,
+        nargs = '+',
+        help = 'Skip files and directories matching one of these patterns. Patterns with a "/" are matched against the path relative to the input directory, otherwise against the name',
+        dest = 'exclude',
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        metavar = 'N',
+        type = int,
+        help = 'Number of worker processes used to extract the run metadata. Use 0 for one per CPU core. Default: 1',
+        default = 1,
+        dest = 'workers',
+    )
+    parser.add_argument(
+        '--rehash',
+        action = 'store_true',
+        help = 'Ignore the scan index and re-read and re-hash all the files in the input directory',
+        dest = 'rehash',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -230,7 +394,7 @@ def main():
         exit(1)
     input_path = input_path.absolute()
 
-    script_main(data_path / 'Load_Runs', data_path, backup_path, input_path)
+    script_main(data_path / 'Load_Runs', data_path, backup_path, input_path, args.workers, args.rehash, args.max_depth, args.include, args.exclude, args.backup_mode, args.blob_codec, args.recursive or args.max_depth is not None)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,243 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+
+from pathlib import Path
+import logging
+import hashlib
+
+import lip_pps_run_manager as RM
+
+import utilities
+
+def migrate_backup_task(
+                        Bernard: RM.RunManager,
+                        db_path: Path,
+                        backup_path: Path,
+                        logger: logging.Logger,
+                        keep_blobs: bool = False,
+                        blob_codec: str = "zlib",
+                        ):
+    with Bernard.handle_task("migrate_backup", drop_old_data=True) as Beatrice:
+        with utilities.get_db_connection(db_path) as sql_conn:
+            utilities.enable_foreign_keys(sql_conn)
+
+            runInfoTable = 'RunInfo'
+            runBackupTable = 'runBackup'
+            legacyTable = 'runBackup_legacy'
+
+            res = sql_conn.execute("BEGIN TRANSACTION;")
+            try:
+                if utilities.is_legacy_run_backup_table(sql_conn, runBackupTable):
+                    logger.info(f"Converting the {runBackupTable} table to the backup store layout")
+                    sql_conn.execute(f"ALTER TABLE `{runBackupTable}` RENAME TO `{legacyTable}`;")
+                    utilities.create_run_backup_table(sql_conn, runBackupTable, runInfoTable, logger)
+                    source_table = legacyTable
+                else:
+                    utilities.create_run_backup_table(sql_conn, runBackupTable, runInfoTable, logger)  # On a fresh database there is nothing else to do
+                    source_table = runBackupTable
+
+                if source_table == legacyTable:
+                    codec_column = "NULL"  # The old layout only holds uncompressed data
+                else:
+                    codec_column = "b.`Codec`"
+                res = sql_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{runInfoTable}';")
+                if len(res.fetchall()) > 0:
+                    query = f"SELECT b.`RunID`,{codec_column},r.`RunName`,r.`type`,r.`SHA256` FROM `{source_table}` b LEFT JOIN `{runInfoTable}` r ON b.`RunID` = r.`RunID` WHERE b.`Data` IS NOT NULL;"
+                else:  # Without any runs, all the backups are orphaned
+                    query = f"SELECT b.`RunID`,{codec_column},NULL,NULL,NULL FROM `{source_table}` b WHERE b.`Data` IS NOT NULL;"
+                backup_list = sql_conn.execute(query).fetchall()
+
+                migrated = 0
+                for run_id, codec, run_name, run_type, sha256 in backup_list:
+                    # The BLOB is streamed out of the database, so it is never fully held in memory
+                    data_hash = hashlib.sha256()
+                    for chunk in utilities.iter_backup_blob(sql_conn, source_table, run_id, codec):
+                        data_hash.update(chunk)
+                    data_sha256 = data_hash.hexdigest()
+
+                    if sha256 is None:
+                        # Orphaned BLOB, the content is kept in the backup store but can not be referenced from the database
+                        utilities.write_to_backup_store(backup_path, utilities.iter_backup_blob(sql_conn, source_table, run_id, codec), data_sha256)
+                        if source_table == runBackupTable:  # The legacy table is dropped as a whole
+                            sql_conn.execute(f"DELETE FROM `{runBackupTable}` WHERE `RunID`=?;", [run_id])
+                        logger.warning(f"The backup with RunID {run_id} does not belong to any run, it was saved in the backup store as {data_sha256} and removed from the database")
+                        continue
+
+                    keep_data = keep_blobs
+                    if data_sha256 != sha256:
+                        logger.error(f"The backup of run {run_name} does not match the SHA256 recorded for the run, keeping it in the database")
+                        keep_data = True
+                    else:
+                        # Reuse the backup file created by older versions of load_runs, if it is intact, through a hardlink
+                        legacy_file = backup_path / f"{run_name}.{utilities.get_run_file_extension(utilities.CVIV_Types(run_type))}"
+                        legacy_sha256 = None
+                        if legacy_file.is_file():
+                            legacy_hash = hashlib.sha256()
+                            for chunk in utilities.iter_file_chunks(legacy_file):
+                                legacy_hash.update(chunk)
+                            legacy_sha256 = legacy_hash.hexdigest()
+                        if legacy_sha256 == sha256:
+                            utilities.add_to_backup_store(backup_path, legacy_file, sha256)
+                        else:
+                            utilities.write_to_backup_store(backup_path, utilities.iter_backup_blob(sql_conn, source_table, run_id, codec), sha256)
+
+                    if source_table == legacyTable:
+                        sql_conn.execute(f"INSERT INTO `{runBackupTable}`(`RunID`,`SHA256`) VALUES(?, ?);", [run_id, sha256])
+                        if keep_data:
+                            utilities.write_backup_blob(sql_conn, runBackupTable, run_id, utilities.iter_backup_blob(sql_conn, source_table, run_id), blob_codec)
+                    elif not keep_data:
+                        sql_conn.execute(f"UPDATE `{runBackupTable}` SET `Data`=NULL,`Codec`=NULL WHERE `RunID`=?;", [run_id])
+                    migrated += 1
+
+                if source_table == legacyTable:
+                    sql_conn.execute(f"DROP TABLE `{legacyTable}`;")
+            except:
+                res = sql_conn.execute("ROLLBACK TRANSACTION;")
+                raise
+            else:
+                res = sql_conn.execute("COMMIT TRANSACTION;")
+
+            logger.info(f"Moved {migrated} run backups to the backup store")
+
+def script_main(
+                db_path: Path,
+                backup_path: Path,
+                keep_blobs: bool = False,
+                vacuum: bool = False,
+                blob_codec: str = "zlib",
+                ):
+    logger = logging.getLogger('migrate_backup')
+
+    if not backup_path.exists():
+        backup_path.mkdir()
+
+    run_path = db_path.parent / "MigrateBackup"
+
+    with RM.RunManager(run_path.resolve()) as Bernard:
+        Bernard.create_run(raise_error=False)
+
+        migrate_backup_task(Bernard, db_path, backup_path, logger, keep_blobs=keep_blobs, blob_codec=blob_codec)
+
+    if vacuum:
+        # Give the space of the removed BLOBs back to the file system
+        with utilities.get_db_connection(db_path) as sql_conn:
+            sql_conn.execute("VACUUM;")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='migrate_backup.py',
+                    description='This script moves the run backups stored as BLOBs in the database into the content-addressed backup store',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-d',
+        '--dbPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the database directory, where the run database is placed. Default: ./data',
+        default = "./data",
+        dest = 'db_path',
+    )
+    parser.add_argument(
+        '-b',
+        '--backupPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the data backup directory. If not set, a sub-directory in the database directory is assumed.',
+        #required = True,
+        dest = 'backup_path',
+    )
+    parser.add_argument(
+        '--keepBlobs',
+        action = 'store_true',
+        help = 'Keep a copy of the run files in the database, besides the one in the backup store',
+        dest = 'keep_blobs',
+    )
+    parser.add_argument(
+        '--blobCodec',
+        type = str,
+        help = 'Compression to use for the run files which are kept in the database. Default: zlib',
+        choices = utilities.BLOB_CODECS,
+        default = "zlib",
+        dest = 'blob_codec',
+    )
+    parser.add_argument(
+        '--vacuum',
+        action = 'store_true',
+        help = 'Compact the database file after the migration, so the space used by the BLOBs is freed',
+        dest = 'vacuum',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    db_path: Path = args.db_path
+    if not db_path.exists():
+        raise RuntimeError("The database path does not exist")
+    db_path = db_path.absolute()
+    db_path = db_path / "run_db.sqlite"
+    if not db_path.exists() or not db_path.is_file():
+        raise RuntimeError("The database file does not exist")
+
+    backup_path: Path = args.backup_path
+    # If the backup path is not set:
+    if backup_path is None:
+        backup_path = db_path.parent / 'backup'
+    backup_path = backup_path.absolute()
+
+    script_main(db_path, backup_path, args.keep_blobs, args.vacuum, args.blob_codec)
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,6 @@
 
 from pathlib import Path
 import logging
-import sqlite3
 import pandas
 
 import lip_pps_run_manager as RM
@@ -37,27 +36,28 @@ def plot_iv_task(
                  ):
     if Pedro.task_completed("load_df_task"):
         with Pedro.handle_task("plot_iv_task", drop_old_data=True) as Isabel:
-            with sqlite3.connect(db_path) as sql_conn:
+            with utilities.get_db_connection(db_path) as sql_conn:
                 utilities.enable_foreign_keys(sql_conn)
 
                 run_name = Isabel.run_name
 
-                run_info_sql = f"SELECT `RunID`,`RunName`,`path`,`type`,`sample`,`pixel row`,`pixel col`,`begin location`,`end location`,`Observations` FROM 'RunInfo' WHERE `RunName`=?;"
-                res = sql_conn.execute(run_info_sql, [run_name]).fetchall()
-                if len(res) == 0:
+                run_info = utilities.get_run_record(sql_conn, 'RunInfo', run_name)
+                if run_info is None:
                     raise RuntimeError(f"Unable to find information in the database for run {run_name}")
 
-                runId = res[0][0]
-                run_file_path = Path(res[0][2])
-                run_type = utilities.CVIV_Types(res[0][3])
-                sample = res[0][4]
-                pixel_row = res[0][5]
-                pixel_col = res[0][6]
-                begin_location = res[0][7]
-                end_location = res[0][8]
-                observations = res[0][9]
+                runId = run_info['RunID']
+                run_file_path = Path(run_info['path'])
+                run_type = utilities.CVIV_Types(run_info['type'])
+                sample = run_info['sample']
+                pixel_row = run_info['pixel row']
+                pixel_col = run_info['pixel col']
+                begin_location = run_info['begin location']
+                end_location = run_info['end location']
+                observations = run_info['Observations']
 
-                df = pandas.read_csv(Isabel.path_directory / "data.csv")
+                df = utilities.get_run_dataframe(sql_conn, run_info, ["Bias Voltage [V]", "Pad Current [A]", "Total Current [A]"])
+                if df is None:  # Runs processed before the measurements were kept in the database
+                    df = utilities.read_run_dataframe(Isabel.path_directory, ["Bias Voltage [V]", "Pad Current [A]", "Total Current [A]"])
 
                 color_var = None
                 if len(df["Is Coarse"].unique()) > 1:
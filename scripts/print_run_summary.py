@@ -22,24 +22,24 @@
 
 from pathlib import Path
 import logging
-import sqlite3
 
 import utilities
 
 
 def script_main(
                 db_path: Path,
+                selection: list[str] = None,
                 ):
     logger = logging.getLogger('print_run_summary')
 
     print_string_iv = "{runId}: {runName} - {start} : Sample {sample} : Pixel {pixel_row} {pixel_col} : {temperature} C : {run_type} : {observations}"
     print_string_cv = "{runId}: {runName} - {start} : Sample {sample} : Pixel {pixel_row} {pixel_col} : {temperature} C : {run_type} {frequency} Hz : {observations}"
 
-    with sqlite3.connect(db_path) as sql_conn:
+    with utilities.get_db_connection(db_path) as sql_conn:
         utilities.enable_foreign_keys(sql_conn)
 
-        run_info_sql = f"SELECT `RunID`,`RunName`,`path`,`type`,`sample`,`pixel row`,`pixel col`,`begin location`,`end location`,`Observations`,`start`,`stop`,`temperature [C]`,`LCR frequency [Hz]` FROM 'RunInfo';"
-        res = sql_conn.execute(run_info_sql).fetchall()
+        columns = ["RunID","RunName","path","type","sample","pixel row","pixel col","begin location","end location","Observations","start","stop","temperature [C]","LCR frequency [Hz]"]
+        res = utilities.select_runs(sql_conn, 'RunInfo', [] if selection is None else selection, columns)
 
         for runInfo in res:
             runDict = {
@@ -86,6 +86,15 @@ def main():
         default = "./data",
         dest = 'db_path',
     )
+    parser.add_argument(
+        '-s',
+        '--select',
+        metavar = 'TERM',
+        type = str,
+        nargs = '+',
+        help = 'Only print the runs matching the selection, e.g. "sample=FBK-3 type=CV temperature<-20 pixel=1 2". Default: all runs',
+        dest = 'selection',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -127,7 +136,7 @@ def main():
     if not db_path.exists() or not db_path.is_file():
         raise RuntimeError("The database file does not exist")
 
-    script_main(db_path)
+    script_main(db_path, args.selection)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -22,62 +22,109 @@
 
 from pathlib import Path
 import logging
-import sqlite3
+import concurrent.futures
 
 import lip_pps_run_manager as RM
 
 import utilities
 
 from load_df import script_main as load_df
+from load_df import load_df_batch
 from plot_iv import script_main as plot_iv
 from plot_cv import script_main as plot_cv
 from extract_parameters import script_main as extract_parameters
 
+def process_run(
+                db_path: Path,
+                backup_path: Path,
+                output_path: Path,
+                run_name: str,
+                reload_data: bool = False,
+                font_size: int = 18,
+                write_csv: bool = False,
+                ):
+    run_path = output_path / run_name
+    already_exists = False
+    no_load = False
+    if run_path.exists() and run_path.is_dir():
+        with RM.RunManager(run_path) as David:
+            if David.task_completed("load_df_task"):
+                if reload_data:
+                    already_exists = True
+                else:
+                    no_load = True
+            else:
+                already_exists = True
+
+    if not no_load:
+        load_df(
+                db_path=db_path,
+                run_name=run_name,
+                output_path=output_path,
+                backup_path=backup_path,
+                already_exists=already_exists,
+                write_csv=write_csv,
+                )
+
+    plot_iv(db_path=db_path, run_path=run_path, font_size=font_size)
+    plot_cv(db_path=db_path, run_path=run_path, font_size=font_size)
+    extract_parameters(db_path=db_path, run_path=run_path, font_size=font_size)
+
 def script_main(
                 db_path: Path,
                 backup_path: Path,
                 output_path: Path,
                 reload_data: bool = False,
                 font_size: int = 18,
+                selection: list[str] = None,
+                workers: int = 1,
+                write_csv: bool = False,
                 ):
     logger = logging.getLogger('process_all_runs')
 
     res = []
-    with sqlite3.connect(db_path) as sql_conn:
+    with utilities.get_db_connection(db_path) as sql_conn:
         utilities.enable_foreign_keys(sql_conn)
 
-        run_info_sql = f"SELECT `RunName` FROM 'RunInfo';"
-        res = sql_conn.execute(run_info_sql).fetchall()
-
-    for runInfo in res:
-        run_name: str = runInfo[0]
-        logger.info(f"Processing run {run_name}")
-
-        run_path = output_path / run_name
-        already_exists = False
-        no_load = False
-        if run_path.exists() and run_path.is_dir():
-            with RM.RunManager(run_path) as David:
-                if David.task_completed("load_df_task"):
-                    if reload_data:
-                        already_exists = True
-                    else:
-                        no_load = True
-                else:
-                    already_exists = True
+        if selection is None:
+            run_info_sql = f"SELECT `RunName` FROM 'RunInfo';"
+            res = sql_conn.execute(run_info_sql).fetchall()
+        else:
+            res = utilities.select_runs(sql_conn, 'RunInfo', selection)
+            logger.info(f"Selected {len(res)} runs")
 
-        if not no_load:
-            load_df(
-                    db_path=db_path,
-                    run_name=run_name,
-                    output_path=output_path,
-                    backup_path=backup_path,
-                    already_exists=already_exists,
-                    )
+    # The run dataframes are all loaded first, in one batch, the runs which fail to load are tried again (and their
+    # error raised or reported) when they are processed below
+    load_df_batch(db_path, [runInfo[0] for runInfo in res], output_path, backup_path, reload_data=reload_data, write_csv=write_csv, workers=workers)
+    reload_data = False
+
+    if workers is None or workers <= 1:
+        for runInfo in res:
+            run_name: str = runInfo[0]
+            logger.info(f"Processing run {run_name}")
+
+            process_run(db_path, backup_path, output_path, run_name, reload_data=reload_data, font_size=font_size, write_csv=write_csv)
+        return
 
-        plot_iv(db_path=db_path, run_path=run_path, font_size=font_size)
-        plot_cv(db_path=db_path, run_path=run_path, font_size=font_size)
-        extract_parameters(db_path=db_path, run_path=run_path, font_size=font_size)
+    # The runs are processed in parallel, with all the database writes of the workers going through a single writer
+    failed_runs = []
+    with utilities.DBWriter(db_path) as writer:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=utilities.set_db_writer, initargs=(writer,)) as executor:
+            futures = {}
+            for runInfo in res:
+                run_name: str = runInfo[0]
+                futures[executor.submit(process_run, db_path, backup_path, output_path, run_name, reload_data, font_size, write_csv)] = run_name
+
+            for future in concurrent.futures.as_completed(futures):
+                run_name = futures[future]
+                try:
+                    future.result()
+                    logger.info(f"Processed run {run_name}")
+                except Exception as error:
+                    logger.error(f'Unable to process run {run_name}: {type(error).__name__}: {error}')
+                    failed_runs += [run_name]
+    if len(failed_runs) > 0:
+        raise RuntimeError(f"Unable to process {len(failed_runs)} runs: {', '.join(failed_runs)}")
 
 
 def main():
@@ -132,6 +179,30 @@ def main():
         default = 18,
         dest = 'font_size',
     )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        metavar = 'N',
+        type = int,
+        help = 'Number of runs to process in parallel, the database writes then go through a single writer process. Default: 1',
+        default = 1,
+        dest = 'workers',
+    )
+    parser.add_argument(
+        '-s',
+        '--select',
+        metavar = 'TERM',
+        type = str,
+        nargs = '+',
+        help = 'Only process the runs matching the selection, e.g. "sample=FBK-3 type=CV temperature<-20 pixel=1 2". Default: all runs',
+        dest = 'selection',
+    )
+    parser.add_argument(
+        '--csv',
+        action = 'store_true',
+        help = 'Also save the run dataframes as data.csv, next to data.parquet',
+        dest = 'write_csv',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -185,7 +256,7 @@ def main():
         exit(1)
     output_path = output_path.absolute()
 
-    script_main(db_path, backup_path, output_path, args.reload, args.font_size)
+    script_main(db_path, backup_path, output_path, args.reload, args.font_size, args.selection, args.workers, args.write_csv)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
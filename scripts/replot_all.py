@@ -23,6 +23,8 @@
 from pathlib import Path
 import logging
 
+import utilities
+
 from replot import script_main as replot
 
 
@@ -30,13 +32,21 @@ def script_main(
                 db_path: Path,
                 base_path: Path,
                 font_size: int = 18,
+                selection: list[str] = None,
                 ):
     logger = logging.getLogger('replot_all')
 
     if not base_path.exists() or not base_path.is_dir():
         raise RuntimeError(f"The path ({base_path}) does not exist or is not a directory")
 
-    for subdir in base_path.iterdir():
+    if selection is None:
+        subdirs = base_path.iterdir()
+    else:
+        with utilities.get_db_connection(db_path) as sql_conn:
+            subdirs = [base_path / run_name for (run_name, ) in utilities.select_runs(sql_conn, 'RunInfo', selection)]
+        logger.info(f"Selected {len(subdirs)} runs")
+
+    for subdir in subdirs:
         if not subdir.is_dir():
             continue
         if not (subdir / "run_info.txt").exists():
@@ -84,6 +94,15 @@ def main():
         default = 18,
         dest = 'font_size',
     )
+    parser.add_argument(
+        '-s',
+        '--select',
+        metavar = 'TERM',
+        type = str,
+        nargs = '+',
+        help = 'Only replot the run directories of the runs matching the selection, e.g. "sample=FBK-3 type=CV temperature<-20 pixel=1 2". Default: all the run directories',
+        dest = 'selection',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -131,7 +150,7 @@ def main():
         exit(1)
     path = path.absolute()
 
-    script_main(db_path, path, args.font_size)
+    script_main(db_path, path, args.font_size, args.selection)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -22,7 +22,6 @@
 
 from pathlib import Path
 import logging
-import sqlite3
 import pickle
 
 import lip_pps_run_manager as RM
@@ -36,18 +35,12 @@ def script_main(
                 ):
     logger = logging.getLogger('set_run_observation')
 
-    with sqlite3.connect(db_path) as sql_conn:
+    with utilities.get_db_connection(db_path) as sql_conn:
         utilities.enable_foreign_keys(sql_conn)
 
-        run_info_sql = f"SELECT `RunName`,`path` FROM 'RunInfo' WHERE `RunName`=?;"
-        res = sql_conn.execute(run_info_sql, [run_name]).fetchall()
-
-        if len(res) == 0:
+        if utilities.get_run_record(sql_conn, 'RunInfo', run_name) is None:
             raise RuntimeError(f"Unable to find the run {run_name}.")
 
-        del res
-        del run_info_sql
-
     if observations == "":
         observations = None
 
@@ -75,19 +68,17 @@ def script_main(
 
         task_name = f'{run_name}_set_observation_{obs_idx}'
         with Alan.handle_task(task_name, drop_old_data=True) as Ada:
-            with sqlite3.connect(db_path) as sql_conn:
+            with utilities.get_db_connection(db_path) as sql_conn:
                 utilities.enable_foreign_keys(sql_conn)
 
                 # Get Primary Key
-                query = "SELECT `RunID` FROM `RunInfo` WHERE `RunName`=?;"
-                res = sql_conn.execute(query, [run_name]).fetchall()
-                if len(res) == 0:
+                run_info = utilities.get_run_record(sql_conn, 'RunInfo', run_name)
+                if run_info is None:
                     raise RuntimeError(f"Something is seriously wrong because we could not find the run {run_name} on the second attempt.")
-                key = res[0][0]
+                key = run_info['RunID']
 
                 # Update the observations
-                query = "UPDATE `RunInfo` SET Observations=? WHERE RunID=?;"
-                sql_conn.execute(query, [observations, key])
+                utilities.write_db(sql_conn, utilities.set_run_observations, 'RunInfo', key, observations)
 
         obs_info[run_name][obs_idx] = Alan.task_ran_successfully(task_name)
         with open(previous_observations, 'wb') as f:
@@ -23,12 +23,36 @@
 from pathlib import Path
 import logging
 import enum
+import os
+import fnmatch
+import itertools
+import collections
+import threading
+import multiprocessing
+import multiprocessing.util
+from queue import Empty
+from multiprocessing.reduction import ForkingPickler
+import contextlib
+import concurrent.futures
 import datetime
 import sqlite3
 import hashlib
+import shutil
+import tempfile
+import zlib
+import lzma
+import re
+import shlex
+import json
+import io
+import tarfile
+import zipfile
 import numpy
 
 import pandas
+import pyarrow
+import pyarrow.csv
+import pyarrow.parquet
 
 import plotly.express as px
 import plotly.graph_objects as go
@@ -60,8 +84,8 @@ class CVIV_Types(enum.Enum):
 
 def is_cviv_run(file_path: Path):
     if file_path.suffix == ".iv" or file_path.suffix == ".cv" or file_path.suffix == ".txt":
-        with open(file_path, "r") as file:
-            info_line = file.readline()
+        with open_cviv_file(file_path) as file:
+            info_line = io.TextIOWrapper(file).readline()
 
             run_type = CVIV_Types.get_type(info_line)
             if run_type is None:
@@ -69,266 +93,751 @@ def is_cviv_run(file_path: Path):
             return True
     return False
 
+# Runs inside tar and zip archives are referred to by the path of the archive and the name of the member, joined by
+# ARCHIVE_MEMBER_SEPARATOR, e.g. /data/campaign1.tar.gz::day1/run.iv
+ARCHIVE_MEMBER_SEPARATOR = "::"
+_archive_suffixes = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz"]
+
+def is_archive(file_path: Path):
+    name = file_path.name.lower()
+    for suffix in _archive_suffixes:
+        if name.endswith(suffix):
+            return True
+    return False
+
+# Returns the path of the file on disk and the name of the archive member, None if the path is not archive-qualified
+def split_archive_path(file_path: Path):
+    file_path = str(file_path)
+    if ARCHIVE_MEMBER_SEPARATOR in file_path:
+        archive_path, member = file_path.split(ARCHIVE_MEMBER_SEPARATOR, 1)
+        return Path(archive_path), member
+    return Path(file_path), None
+
+# Opens a run file in binary mode, either a plain file or an archive member, without extracting anything to disk
+@contextlib.contextmanager
+def open_cviv_file(file_path: Path):
+    archive_path, member = split_archive_path(file_path)
+    if member is None:
+        with open(archive_path, "rb") as file:
+            yield file
+    elif archive_path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            with archive.open(member) as file:
+                yield file
+    else:
+        with tarfile.open(archive_path, "r:*") as archive:
+            file = archive.extractfile(member)
+            if file is None:
+                raise RuntimeError(f'The archive member {member} of {archive_path} is not a regular file')
+            with file:
+                yield file
+
+def run_file_exists(file_path: Path):
+    archive_path, member = split_archive_path(file_path)
+    if not archive_path.is_file():
+        return False
+    if member is None:
+        return True
+    try:
+        if archive_path.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.getinfo(member)
+        else:
+            with tarfile.open(archive_path, "r:*") as archive:
+                archive.getmember(member)
+    except (KeyError, OSError, zipfile.BadZipFile, tarfile.TarError):
+        return False
+    return True
+
+# Yields the name and an open file object of the regular files in an archive, in the order they are stored. Tar
+# archives are read as a stream, so compressed tarballs are decompressed only once. If members is set, only those
+# members are returned
+def iter_archive_files(archive_path: Path, members: set[str] = None):
+    if archive_path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if members is not None and info.filename not in members:
+                    continue
+                with archive.open(info) as file:
+                    yield info.filename, file
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if members is not None and member.name not in members:
+                    continue
+                yield member.name, archive.extractfile(member)
+
+_end_marker_regex = re.compile(rb'^END\r?$', re.MULTILINE)
+
+# Reads a run file line by line, feeding every byte into the SHA256 and MD5 digests exactly once
+class HashingLineReader:
+    def __init__(self, file, chunk_size: int = 1048576):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._peeked = None
+        self.sha = hashlib.sha256()
+        self.md5 = hashlib.md5()
+        self.offset = 0       # Byte offset of the next line to be returned
+        self.line_number = 0  # Index of the next line to be returned
+
+    def _read_raw_line(self):
+        raw = self._file.readline()
+        self.sha.update(raw)
+        self.md5.update(raw)
+        # Mimic the universal newlines of text mode, so the header lines always end in '\n'
+        line = raw.decode('utf-8')
+        if line[-2:] == '\r\n':
+            line = line[:-2] + '\n'
+        return raw, line
+
+    def peek(self):
+        if self._peeked is None:
+            self._peeked = self._read_raw_line()
+        return self._peeked[1]
+
+    def readline(self):
+        if self._peeked is None:
+            raw, line = self._read_raw_line()
+        else:
+            raw, line = self._peeked
+            self._peeked = None
+        if raw != b'':
+            self.offset += len(raw)
+            self.line_number += 1
+        return line
+
+    # Hashes the rest of the file in chunks and returns the line index and byte offset of the last END line
+    def find_end_marker(self):
+        end_line = None
+        end_offset = None
+        carry = b''
+        if self._peeked is not None:
+            carry = self._peeked[0]
+            self._peeked = None
+        while True:
+            chunk = self._file.read(self._chunk_size)
+            self.sha.update(chunk)
+            self.md5.update(chunk)
+            buffer = carry + chunk
+            if chunk == b'':
+                complete = buffer  # Last line, possibly without a trailing newline
+                carry = b''
+            else:
+                complete = buffer[:buffer.rfind(b'\n') + 1]
+                carry = buffer[len(complete):]
+
+            last_match = None
+            for last_match in _end_marker_regex.finditer(complete):
+                pass
+            if last_match is not None:
+                end_line = self.line_number + complete.count(b'\n', 0, last_match.start())
+                end_offset = self.offset + last_match.start()
+
+            self.line_number += complete.count(b'\n')
+            self.offset += len(complete)
+            if chunk == b'':
+                break
+        return end_line, end_offset
+
+def parse_cviv_file(file_path: Path, logger: logging.Logger):
+    if file_path.suffix == ".iv" or file_path.suffix == ".cv" or file_path.suffix == ".txt":
+        return get_cviv_metadata(file_path, logger)
+    return None
+
+# The file is opened only once, the header is parsed up to BEGIN and the rest is only hashed, so memory use does not
+# depend on the size of the data block. Returns None if the file is not a CVIV run
 def get_cviv_metadata(file_path: Path, logger: logging.Logger):
+    with open_cviv_file(file_path) as file:
+        return _get_cviv_metadata_from_file(file, file_path, logger)
+
+def _get_cviv_metadata_from_file(file, file_path: Path, logger: logging.Logger):
+    reader = HashingLineReader(file)
+    run_type = CVIV_Types.get_type(reader.readline())
+    if run_type is None:
+        return None
+
     metadata = {
         'path': str(file_path),
         'name': file_path.name,
-        'type': None,
+        'type': run_type,
     }
+    _parse_cviv_header(reader, metadata, file_path, logger)
+
+    if 'begin location' not in metadata:
+        raise RuntimeError(f'Could not find the BEGIN marker of the data block in run {str(file_path)}')
+    metadata['end location'], metadata['end offset'] = reader.find_end_marker()
+    if metadata['end location'] is None:
+        raise RuntimeError(f'Could not find the END marker of the data block in run {str(file_path)}')
+
+    metadata['SHA256'] = reader.sha.hexdigest()
+    metadata['MD5'] = reader.md5.hexdigest()
 
-    with open(file_path, "r") as file:
-        info_line = file.readline()
-
-        metadata['type'] = CVIV_Types.get_type(info_line)
-
-        lines = file.readlines()
-        line_idx = 0
-        set_voltage = None
-        while line_idx < len(lines):
-            if lines[line_idx] == ':Program Version\n':
-                line_idx += 1
-                metadata['version'] = lines[line_idx][:-1]
-            elif lines[line_idx] == ':start\n':
-                line_idx += 1
-                metadata['start'] = datetime.datetime.strptime(lines[line_idx][:-1], "%d/%m/%Y %H:%M:%S")
-            elif lines[line_idx] == ':stop\n':
-                line_idx += 1
-                metadata['stop'] = datetime.datetime.strptime(lines[line_idx][:-1], "%d/%m/%Y %H:%M:%S")
-            elif lines[line_idx] == ':elapsed[s]\n':
-                line_idx += 1
-                metadata['elapsed [s]'] = float(lines[line_idx][:-1])
-            elif lines[line_idx] == ':tester\n':
-                line_idx += 1
-                metadata['tester'] = lines[line_idx][:-1]
-            elif lines[line_idx] == ':temperature[C]\n':
-                line_idx += 1
-                metadata['temperature [C]'] = float(lines[line_idx][:-1])
-            elif lines[line_idx] == ':Instruments\n':
-                line_idx += 1
-                while lines[line_idx][0] != ':':
-                    if lines[line_idx][:9] == 'I meter: ':
-                        metadata['I meter'] = lines[line_idx][9:-1]
-                        metadata['I averaging'] = 5  # For some runs, this number was different (fix below)
-                    elif lines[line_idx][:10] == 'V source: ':
-                        metadata['V source'] = lines[line_idx][10:-1]
-                        if metadata['V source'] == 'Keithley 2410':
-                            metadata['V integration time [ms]'] = float(lines[line_idx + 1][:-1].split(': ')[1])
-                            metadata['V averaging'] = int(lines[line_idx + 2][:-1].split(': ')[1])
-                            metadata['compliance [A]'] = float(lines[line_idx + 3][:-1].split(': ')[1])
-                            line_idx += 3
-                        else:
-                            raise RuntimeError(f'Unknown V Source instrument type ({metadata["V source"]}), in run {str(file_path)}')
-                    elif lines[line_idx][:11] == 'LCR meter: ':
-                        metadata['LCR meter'] = lines[line_idx][11:-1]
-                        if metadata['LCR meter'] == 'Agilent E4980A':
-                            metadata['LCR frequency [Hz]'] = int(lines[line_idx + 1][:-1].split(' ')[2])
-                            metadata['LCR signal level [V]'] = float(lines[line_idx + 2][:-1].split(' ')[3])/1000.
-                            metadata['LCR averaging'] = int(lines[line_idx + 3][:-1].split(': ')[1])
-                            line_idx += 3
-                        elif metadata['LCR meter'] == 'Unknown':
-                            metadata['LCR frequency [Hz]'] = int(lines[line_idx + 1][:-1].split(' ')[2])
-                            line_idx += 1
-                        else:
-                            raise RuntimeError(f'Unknown LCR Meter instrument type ({metadata["LCR meter"]}), in run {str(file_path)}')
+    return metadata
+
+def _parse_cviv_header(reader: HashingLineReader, metadata: dict, file_path: Path, logger: logging.Logger):
+    set_voltage = None
+    while (line := reader.readline()) != '':
+        if line == ':Program Version\n':
+            metadata['version'] = reader.readline()[:-1]
+        elif line == ':start\n':
+            metadata['start'] = datetime.datetime.strptime(reader.readline()[:-1], "%d/%m/%Y %H:%M:%S")
+        elif line == ':stop\n':
+            metadata['stop'] = datetime.datetime.strptime(reader.readline()[:-1], "%d/%m/%Y %H:%M:%S")
+        elif line == ':elapsed[s]\n':
+            metadata['elapsed [s]'] = float(reader.readline()[:-1])
+        elif line == ':tester\n':
+            metadata['tester'] = reader.readline()[:-1]
+        elif line == ':temperature[C]\n':
+            metadata['temperature [C]'] = float(reader.readline()[:-1])
+        elif line == ':Instruments\n':
+            while reader.peek()[0] != ':':
+                line = reader.readline()
+                if line[:9] == 'I meter: ':
+                    metadata['I meter'] = line[9:-1]
+                    metadata['I averaging'] = 5  # For some runs, this number was different (fix below)
+                elif line[:10] == 'V source: ':
+                    metadata['V source'] = line[10:-1]
+                    if metadata['V source'] == 'Keithley 2410':
+                        metadata['V integration time [ms]'] = float(reader.readline()[:-1].split(': ')[1])
+                        metadata['V averaging'] = int(reader.readline()[:-1].split(': ')[1])
+                        metadata['compliance [A]'] = float(reader.readline()[:-1].split(': ')[1])
                     else:
-                        logger.error(f'Unknown line in Instruments block: {lines[line_idx][:-1]}')
-                    line_idx += 1
-                line_idx -= 1
-            elif lines[line_idx] == ':LCR open correction: C[F] , G[S]\n':
-                line_idx += 1
-                params = lines[line_idx][:-1].split(', ')
-                metadata['LCR open correction C [F]'] = float(params[0])
-                metadata['LCR open correction G [S]'] = float(params[1])
-            elif lines[line_idx] == ':ramp up step [V], delay [s], down step [V], delay[s]\n':
-                line_idx += 1
-                params = lines[line_idx][:-1].split(', ')
-                metadata['ramp up step [V]']    = float(params[0])
-                metadata['ramp up delay [s]']   = float(params[1])
-                metadata['ramp down step [V]']  = float(params[2])
-                metadata['ramp down delay [s]'] = float(params[3])
-            elif lines[line_idx] == ':step mode\n':
-                line_idx += 1
-                metadata['V step mode'] = lines[line_idx][:-1]
-            elif lines[line_idx] == ':set voltage start [V], voltage stop [V], number of steps\n':
-                line_idx += 1
-                set_voltage = lines[line_idx][:-1].split(', ')
-            elif lines[line_idx] == ':Sample\n':
-                line_idx += 1
-                metadata['sample'] = lines[line_idx][:-1]
-            elif lines[line_idx] == ':Sample_comment\n':
-                while lines[line_idx + 1][0] != ':':
-                    line_idx += 1
-                    if lines[line_idx][:6] == 'pixel ':
-                        pixel_str = lines[line_idx][6:-1]
-                        #metadata['pixel'] = pixel_str
-                        info = pixel_str.split(' ')
-                        metadata['pixel row'] = int(info[0])
-                        metadata['pixel col'] = int(info[1])
-                        # Fix row and col for Perugia measurements
-                        if metadata['type'] == CVIV_Types.IV_Perugia or metadata['type'] == CVIV_Types.CV_Perugia:
-                            row = metadata['pixel row']
-                            col = metadata['pixel col']
-                            metadata['pixel col'] = row
-                            metadata['pixel row'] = col
-                        metadata['pixel'] = "{} {}".format(metadata['pixel row'], metadata['pixel col'])
-                    elif lines[line_idx][:-1] == 'PPS pre-irrad' or lines[line_idx][:-1] == 'FBK sample - pre-irrad' or lines[line_idx][:-1] == 'PPS TI':
-                        metadata['irradiation flux [p/cm^2]'] = 0.0
-                        metadata['irradiated'] = False
-                    elif lines[line_idx][:-1] == 'IRRAD 1E16':
-                        metadata['irradiation flux [p/cm^2]'] = 1E16
-                        metadata['irradiated'] = True
-                    elif lines[line_idx][:-1] == 'IRRAD 5E15':
-                        metadata['irradiation flux [p/cm^2]'] = 5E15
-                        metadata['irradiated'] = True
+                        raise RuntimeError(f'Unknown V Source instrument type ({metadata["V source"]}), in run {str(file_path)}')
+                elif line[:11] == 'LCR meter: ':
+                    metadata['LCR meter'] = line[11:-1]
+                    if metadata['LCR meter'] == 'Agilent E4980A':
+                        metadata['LCR frequency [Hz]'] = int(reader.readline()[:-1].split(' ')[2])
+                        metadata['LCR signal level [V]'] = float(reader.readline()[:-1].split(' ')[3])/1000.
+                        metadata['LCR averaging'] = int(reader.readline()[:-1].split(': ')[1])
+                    elif metadata['LCR meter'] == 'Unknown':
+                        metadata['LCR frequency [Hz]'] = int(reader.readline()[:-1].split(' ')[2])
                     else:
-                        if 'comments' not in metadata:
-                            metadata['comments'] = ''
-                        metadata['comments'] += lines[line_idx]
-            # TODO:
-            #:Irradiation(Location,Fluence/Dose,Units,Particle,Date)
-            #:Annealing_history(time[min],Temp[C],Date)
-            elif lines[line_idx] == 'BEGIN\n':
-                metadata['begin location'] = line_idx + 1 #  Offset because of the extra readline at the start to get the run type
-            elif lines[line_idx] == 'END\n':
-                metadata['end location'] = line_idx + 1 #  Offset because of the extra readline at the start to get the run type
-
-            line_idx += 1
-
-        # Fix I averaging for the initial runs
-        if 'I averaging' in metadata and metadata['start'] < datetime.datetime(2023, 7, 5, 3, 0, 0):
-            metadata['I averaging'] = 1
-
-        # Fetch the voltage steps if needed:
-        if metadata['V step mode'] == 'linear':
-            metadata['V start [V]'] = float(set_voltage[0])
-            metadata['V stop [V]']  = float(set_voltage[1])
-            metadata['V steps']     = int(set_voltage[2])
-        elif metadata['V step mode'] == 'linear hysteresis':
-            metadata['V start [V]'] = float(set_voltage[0])
-            metadata['V stop [V]']  = float(set_voltage[1])
-            metadata['V steps']     = int(set_voltage[2])
-        elif metadata['V step mode'] == 'from file':
-            # No action needed for "from file", but empty values need to be added so that the columns are created
-            metadata['V start [V]'] = None
-            metadata['V stop [V]']  = None
-            metadata['V steps']     = None
-        else:
-            raise RuntimeError(f'Unknown voltage step mode ({metadata["V step mode"]}), in run {str(file_path)}')
+                        raise RuntimeError(f'Unknown LCR Meter instrument type ({metadata["LCR meter"]}), in run {str(file_path)}')
+                else:
+                    logger.error(f'Unknown line in Instruments block: {line[:-1]}')
+        elif line == ':LCR open correction: C[F] , G[S]\n':
+            params = reader.readline()[:-1].split(', ')
+            metadata['LCR open correction C [F]'] = float(params[0])
+            metadata['LCR open correction G [S]'] = float(params[1])
+        elif line == ':ramp up step [V], delay [s], down step [V], delay[s]\n':
+            params = reader.readline()[:-1].split(', ')
+            metadata['ramp up step [V]']    = float(params[0])
+            metadata['ramp up delay [s]']   = float(params[1])
+            metadata['ramp down step [V]']  = float(params[2])
+            metadata['ramp down delay [s]'] = float(params[3])
+        elif line == ':step mode\n':
+            metadata['V step mode'] = reader.readline()[:-1]
+        elif line == ':set voltage start [V], voltage stop [V], number of steps\n':
+            set_voltage = reader.readline()[:-1].split(', ')
+        elif line == ':Sample\n':
+            metadata['sample'] = reader.readline()[:-1]
+        elif line == ':Sample_comment\n':
+            while reader.peek()[0] != ':':
+                line = reader.readline()
+                if line[:6] == 'pixel ':
+                    pixel_str = line[6:-1]
+                    #metadata['pixel'] = pixel_str
+                    info = pixel_str.split(' ')
+                    metadata['pixel row'] = int(info[0])
+                    metadata['pixel col'] = int(info[1])
+                    # Fix row and col for Perugia measurements
+                    if metadata['type'] == CVIV_Types.IV_Perugia or metadata['type'] == CVIV_Types.CV_Perugia:
+                        row = metadata['pixel row']
+                        col = metadata['pixel col']
+                        metadata['pixel col'] = row
+                        metadata['pixel row'] = col
+                    metadata['pixel'] = "{} {}".format(metadata['pixel row'], metadata['pixel col'])
+                elif line[:-1] == 'PPS pre-irrad' or line[:-1] == 'FBK sample - pre-irrad' or line[:-1] == 'PPS TI':
+                    metadata['irradiation flux [p/cm^2]'] = 0.0
+                    metadata['irradiated'] = False
+                elif line[:-1] == 'IRRAD 1E16':
+                    metadata['irradiation flux [p/cm^2]'] = 1E16
+                    metadata['irradiated'] = True
+                elif line[:-1] == 'IRRAD 5E15':
+                    metadata['irradiation flux [p/cm^2]'] = 5E15
+                    metadata['irradiated'] = True
+                else:
+                    if 'comments' not in metadata:
+                        metadata['comments'] = ''
+                    metadata['comments'] += line
+        # TODO:
+        #:Irradiation(Location,Fluence/Dose,Units,Particle,Date)
+        #:Annealing_history(time[min],Temp[C],Date)
+        elif line == 'BEGIN\n':
+            # The header ends here, the data block is only hashed and searched for the END marker
+            metadata['begin location'] = reader.line_number - 1
+            metadata['begin offset'] = reader.offset
+            break
 
-        if 'pixel' not in metadata:
-            raise RuntimeError(f'The pixel which was measured was not defined for run {str(file_path)}')
+    # Fix I averaging for the initial runs
+    if 'I averaging' in metadata and metadata['start'] < datetime.datetime(2023, 7, 5, 3, 0, 0):
+        metadata['I averaging'] = 1
 
-    # TODO: MD5, SHA
-    sha = hashlib.sha256()
-    md5 = hashlib.md5()
-    with open(file_path, "rb") as file:
-        while chunk := file.read(65536):
-            sha.update(chunk)
-            md5.update(chunk)
-    metadata['SHA256'] = sha.hexdigest()
-    metadata['MD5'] = md5.hexdigest()
+    # Fetch the voltage steps if needed:
+    if metadata['V step mode'] == 'linear':
+        metadata['V start [V]'] = float(set_voltage[0])
+        metadata['V stop [V]']  = float(set_voltage[1])
+        metadata['V steps']     = int(set_voltage[2])
+    elif metadata['V step mode'] == 'linear hysteresis':
+        metadata['V start [V]'] = float(set_voltage[0])
+        metadata['V stop [V]']  = float(set_voltage[1])
+        metadata['V steps']     = int(set_voltage[2])
+    elif metadata['V step mode'] == 'from file':
+        # No action needed for "from file", but empty values need to be added so that the columns are created
+        metadata['V start [V]'] = None
+        metadata['V stop [V]']  = None
+        metadata['V steps']     = None
+    else:
+        raise RuntimeError(f'Unknown voltage step mode ({metadata["V step mode"]}), in run {str(file_path)}')
 
-    return metadata
+    if 'pixel' not in metadata:
+        raise RuntimeError(f'The pixel which was measured was not defined for run {str(file_path)}')
+
+# Schema of the run info table: column name -> (SQL type, constraints, python type of the values, display name)
+# The python type is used to convert the values in bulk when runs are inserted, see convert_run_info_values
+# Columns are only ever added: append new columns at the end and bump RUN_INFO_SCHEMA_VERSION, the existing databases
+# are then migrated the next time the table is opened. The constraints can not be added to existing tables, so the
+# added columns only get the SQL type. Since a new table gets all the columns, NOT NULL is only for the columns which
+# are set for every run (those the header parser does not always set, e.g. from the Sample_comment, must allow NULL)
+RUN_INFO_SCHEMA_VERSION = 1
+run_info_schema = {
+    "path":                      ("TEXT",    "NOT NULL UNIQUE", str,        "Path"),
+    "name":                      ("TEXT",    "NOT NULL",        str,        "File Name"),
+    "type":                      ("INTEGER", "NOT NULL",        CVIV_Types, "Run Type"),
+    "version":                   ("TEXT",    "",                str,        "Version"),
+    "start":                     ("TEXT",    "NOT NULL",        str,        "Start Time"),
+    "stop":                      ("TEXT",    "",                str,        "Stop Time"),
+    "elapsed [s]":               ("REAL",    "",                float,      "Elapsed Time"),
+    "tester":                    ("TEXT",    "",                str,        "Tester"),
+    "temperature [C]":           ("REAL",    "",                float,      "Temperature"),
+    "I meter":                   ("TEXT",    "",                str,        "I meter"),
+    "I averaging":               ("INTEGER", "",                int,        "I averaging"),
+    "V source":                  ("TEXT",    "",                str,        "V source"),
+    "V integration time [ms]":   ("REAL",    "",                float,      "V integration time"),
+    "V averaging":               ("INTEGER", "",                int,        "V averaging"),
+    "compliance [A]":            ("REAL",    "",                float,      "Compliance"),
+    "ramp up step [V]":          ("REAL",    "",                float,      "Ramp-up Step"),
+    "ramp up delay [s]":         ("REAL",    "",                float,      "Ramp-up Delay"),
+    "ramp down step [V]":        ("REAL",    "",                float,      "Ramp-down Step"),
+    "ramp down delay [s]":       ("REAL",    "",                float,      "Ramp-down Delay"),
+    "V step mode":               ("TEXT",    "NOT NULL",        str,        "V Step Mode"),
+    "sample":                    ("TEXT",    "",                str,        "Sample"),
+    "irradiation flux [p/cm^2]": ("REAL",    "",                float,      "Irradiation Flux"),
+    "irradiated":                ("INTEGER", "",                bool,       "Irradiated"),
+    "pixel":                     ("TEXT",    "NOT NULL",        str,        "Pixel"),
+    "pixel row":                 ("INTEGER", "NOT NULL",        int,        "Pixel Row"),
+    "pixel col":                 ("INTEGER", "NOT NULL",        int,        "Pixel Column"),
+    "begin location":            ("INTEGER", "NOT NULL",        int,        "Begin Location"),
+    "end location":              ("INTEGER", "NOT NULL",        int,        "End Location"),
+    "begin offset":              ("INTEGER", "",                int,        "Begin Offset"),
+    "end offset":                ("INTEGER", "",                int,        "End Offset"),
+    "V start [V]":               ("REAL",    "",                float,      "V Start"),
+    "V stop [V]":                ("REAL",    "",                float,      "V Stop"),
+    "V steps":                   ("INTEGER", "",                int,        "V Steps"),
+    "comments":                  ("TEXT",    "",                str,        "Comments"),
+    "LCR meter":                 ("TEXT",    "",                str,        "LCR meter"),
+    "LCR frequency [Hz]":        ("INTEGER", "",                int,        "LCR Frequency"),
+    "LCR signal level [V]":      ("REAL",    "",                float,      "LCR Signal Level"),
+    "LCR averaging":             ("INTEGER", "",                int,        "LCR averaging"),
+    "LCR open correction C [F]": ("REAL",    "",                float,      "LCR Open Correction C"),
+    "LCR open correction G [S]": ("REAL",    "",                float,      "LCR Open Correction G"),
+    "SHA256":                    ("TEXT",    "NOT NULL UNIQUE", str,        "SHA256"),
+    "MD5":                       ("TEXT",    "NOT NULL UNIQUE", str,        "MD5"),
+}
 
 def get_column_info_for_db(colName: str):
-    if colName == "path":
-        return "TEXT NOT NULL UNIQUE"
-    elif colName == "name":
-        return "TEXT NOT NULL"
-    elif colName == "type":
-        return "INTEGER NOT NULL"
-    elif colName == "version":
-        return "TEXT"
-    elif colName == "start":
-        return "TEXT NOT NULL"
-    elif colName == "stop":
-        return "TEXT"
-    elif colName == "elapsed [s]":
-        return "REAL"
-    elif colName == "tester":
-        return "TEXT NOT NULL"
-    elif colName == "temperature [C]":
-        return "REAL NOT NULL"
-    elif colName == "I meter":
-        return "TEXT"
-    elif colName == "I averaging":
-        return "INTEGER"
-    elif colName == "V source":
-        return "TEXT"
-    elif colName == "V integration time [ms]":
-        return "REAL"
-    elif colName == "V averaging":
-        return "INTEGER"
-    elif colName == "compliance [A]":
-        return "REAL"
-    elif colName == "ramp up step [V]":
-        return "REAL"
-    elif colName == "ramp up delay [s]":
-        return "REAL"
-    elif colName == "ramp down step [V]":
-        return "REAL"
-    elif colName == "ramp down delay [s]":
-        return "REAL"
-    elif colName == "V step mode":
-        return "TEXT NOT NULL"
-    elif colName == "sample":
-        return "TEXT NOT NULL"
-    elif colName == "irradiation flux [p/cm^2]":
-        return "REAL NOT NULL"
-    elif colName == "irradiated":
-        return "INTEGER NOT NULL"
-    elif colName == "pixel":
-        return "TEXT NOT NULL"
-    elif colName == "pixel row":
-        return "INTEGER NOT NULL"
-    elif colName == "pixel col":
-        return "INTEGER NOT NULL"
-    elif colName == "begin location":
-        return "INTEGER NOT NULL"
-    elif colName == "end location":
-        return "INTEGER NOT NULL"
-    elif colName == "V start [V]":
-        return "REAL"
-    elif colName == "V stop [V]":
-        return "REAL"
-    elif colName == "V steps":
-        return "INTEGER"
-    elif colName == "comments":
-        return "TEXT"
-    elif colName == "LCR meter":
-        return "TEXT"
-    elif colName == "LCR frequency [Hz]":
-        return "INTEGER"
-    elif colName == "LCR signal level [V]":
-        return "REAL"
-    elif colName == "LCR averaging":
-        return "INTEGER"
-    elif colName == "LCR open correction C [F]":
-        return "REAL"
-    elif colName == "LCR open correction G [S]":
-        return "REAL"
-    elif colName == "SHA256":
-        return "TEXT NOT NULL UNIQUE"
-    elif colName == "MD5":
-        return "TEXT NOT NULL UNIQUE"
-    return None
+    if colName not in run_info_schema:
+        return None
+    sql_type, constraints, _, _ = run_info_schema[colName]
+    return f"{sql_type} {constraints}".strip()
 
-def find_and_sort_cviv_runs(base_path: Path, logger: logging.Logger):
-    run_list = []
-    for subdir in base_path.iterdir():
-        if not subdir.is_dir():
+# Values which sqlite can not store directly, per python type of the column. The other types are passed as they are
+_run_info_converters = {
+    bool: lambda value: int(value),
+    CVIV_Types: lambda value: int(value.value),
+}
+
+def convert_run_info_values(runs: list[dict], columns: list[str]):
+    # Builds the rows to insert column by column, so the conversion is chosen once per column instead of once per value
+    column_values = []
+    for col in columns:
+        values = [run.get(col, None) for run in runs]
+        converter = _run_info_converters.get(run_info_schema[col][2])
+        if converter is not None:
+            values = [None if value is None else converter(value) for value in values]
+        column_values += [values]
+    return [list(row) for row in zip(*column_values)]
+
+def scan_cviv_file(file_path: Path, logger_name: str = 'scan_cviv_file'):
+    # Module level so that it can be shipped to the worker processes of find_and_sort_cviv_runs
+    logger = logging.getLogger(logger_name)
+    try:
+        return file_path, parse_cviv_file(file_path, logger), None
+    except Exception as error:
+        return file_path, None, f'{type(error).__name__}: {error}'
+
+def scan_archive(archive_path: Path, logger_name: str = 'scan_cviv_file'):
+    # The archive is read in a single pass, the members are parsed straight out of it without extracting them
+    logger = logging.getLogger(logger_name)
+    results = []
+    try:
+        for member, file in iter_archive_files(archive_path):
+            member_path = Path(str(archive_path) + ARCHIVE_MEMBER_SEPARATOR + member)
+            if member_path.suffix != ".iv" and member_path.suffix != ".cv" and member_path.suffix != ".txt":
+                continue
+            try:
+                results += [(member_path, _get_cviv_metadata_from_file(file, member_path, logger), None)]
+            except Exception as error:
+                results += [(member_path, None, f'{type(error).__name__}: {error}')]
+    except Exception as error:
+        results += [(archive_path, None, f'{type(error).__name__}: {error}')]
+    return results
+
+def scan_input_file(file_path: Path, logger_name: str = 'scan_cviv_file'):
+    # Returns the file and the list of (path, metadata, error) of the runs in it, more than one for archives
+    if is_archive(file_path):
+        return file_path, scan_archive(file_path, logger_name)
+    return file_path, [scan_cviv_file(file_path, logger_name)]
+
+# Cheap completeness check for files which may still be being written: only the tail of the file is read, and the
+# file is considered complete once its last non-empty line is the END marker
+def has_end_marker(file_path: Path, tail_size: int = 4096):
+    with open(file_path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        file.seek(max(0, file.tell() - tail_size))
+        tail = file.read().rstrip()
+    return _end_marker_regex.fullmatch(tail.rsplit(b'\n', 1)[-1].rstrip(b'\r')) is not None
+
+# Lazily walks the input directory, yielding the os.DirEntry of every file found. The cached type information of the
+# entries is used, so no extra stat is needed to tell files and directories apart. Directory symlinks directly in
+# base_path are followed, as the campaign directories are often links to shared storage, each directory only once.
+# Deeper directory symlinks are not followed, to avoid loops. The include patterns select files, the exclude patterns
+# skip both files and directories, and are matched against the name or, if they contain a '/', against the path
+# relative to base_path.
+# A max_depth of 0 only looks at the files directly in base_path, None means no limit
+def walk_input_files(base_path: Path, max_depth: int = None, include: list[str] = None, exclude: list[str] = None, min_depth: int = 0):
+    def matches(patterns: list[str], name: str, relative_path: str):
+        for pattern in patterns:
+            if '/' in pattern:
+                if fnmatch.fnmatchcase(relative_path, pattern):
+                    return True
+            elif fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    if exclude is None:
+        exclude = []
+
+    def stat_key(path):
+        stat = os.stat(path)
+        return (stat.st_dev, stat.st_ino)
+
+    pending = [(str(base_path), '', 0)]
+    visited = set()
+    with contextlib.suppress(OSError):  # Otherwise reported when listing it
+        visited.add(stat_key(base_path))
+    while len(pending) > 0:
+        directory, relative_directory, depth = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as error:
+            logging.getLogger('walk_input_files').error(f'Unable to list the directory {directory}: {error}')
             continue
-        for file in subdir.iterdir():
-            if not file.is_file():
+        for entry in entries:
+            relative_path = relative_directory + entry.name
+            if matches(exclude, entry.name, relative_path):
                 continue
-            is_cviv = is_cviv_run(file)
-            if not is_cviv:
+            if entry.is_dir(follow_symlinks=(depth == 0)):
+                if max_depth is None or depth < max_depth:
+                    if depth == 0:
+                        try:
+                            key = stat_key(entry.path)
+                        except OSError as error:
+                            logging.getLogger('walk_input_files').error(f'Unable to access the directory {entry.path}: {error}')
+                            continue
+                        if key in visited:  # A link to base_path or to a directory already walked
+                            continue
+                        visited.add(key)
+                    subdirs += [(entry.path, relative_path + '/', depth + 1)]
+            elif entry.is_file():
+                if depth < min_depth:
+                    continue
+                if include is not None and not matches(include, entry.name, relative_path):
+                    continue
+                yield entry
+        pending += reversed(subdirs)
+
+# The run files in the input directory. By default the usual layout is assumed, with the run files in the
+# sub-directories of the input directory (one per measurement campaign) and any files directly in it ignored. With
+# recursive the whole tree is searched, down to max_depth levels, including the files directly in the input directory
+def walk_run_files(base_path: Path, recursive: bool = False, max_depth: int = None, include: list[str] = None, exclude: list[str] = None):
+    if not recursive:
+        return walk_input_files(base_path, max_depth=1, include=include, exclude=exclude, min_depth=1)
+    return walk_input_files(base_path, max_depth=max_depth, include=include, exclude=exclude)
+
+def find_and_sort_cviv_runs(
+                            base_path: Path,
+                            logger: logging.Logger,
+                            workers: int = 1,
+                            scan_index: dict[str, tuple] = None,
+                            max_depth: int = None,
+                            include: list[str] = None,
+                            exclude: list[str] = None,
+                            recursive: bool = False,
+                           ):
+    if scan_index is None:
+        scan_index = {}
+
+    scanned_files = {}
+    skipped_files = 0
+    def candidate_files():
+        nonlocal skipped_files
+        for entry in walk_run_files(base_path, recursive=recursive, max_depth=max_depth, include=include, exclude=exclude):
+            file_path = Path(entry.path)
+            file_stat = entry.stat()
+            file_key = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+            if scan_index.get(str(file_path)) == file_key:  # Unchanged since the last scan, no need to open it
+                skipped_files += 1
                 continue
+            scanned_files[str(file_path)] = file_key + (None, )
+            yield file_path
+
+    if workers is None or workers < 1:
+        workers = os.cpu_count()
+
+    run_list = []
+    error_report = []
+    with contextlib.ExitStack() as stack:
+        # The candidates are submitted as the walk progresses, so the workers start parsing before the walk finishes
+        if workers > 1:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=workers))
+            results = executor.map(
+                                    scan_input_file,
+                                    candidate_files(),
+                                    itertools.repeat(logger.name),
+                                    chunksize = 16,
+                                  )
+        else:
+            results = map(scan_input_file, candidate_files(), itertools.repeat(logger.name))
+
+        for input_file, file_results in results:
+            # Archives are indexed as non-CVIV files, so they are only read again if they change
+            status = False
+            for file, metadata, error in file_results:
+                if error is not None:
+                    logger.error(f'Unable to process the file {file}: {error}')
+                    error_report += [{
+                        'path': str(file),
+                        'error': error,
+                    }]
+                    status = None
+                    continue
+                if metadata is None:
+                    continue
+                if status is not None and file == input_file:
+                    status = metadata['SHA256']
+                run_list += [metadata]
+            scanned_files[str(input_file)] = scanned_files[str(input_file)][:3] + (status, )
+
+    if skipped_files > 0:
+        logger.info(f'Skipped {skipped_files} files which are unchanged since the last scan')
+
+    # The path breaks ties between runs with the same start time, so the order does not depend on the scan order
+    # scanned_files maps each path to its (size, mtime, inode) and the SHA256 of the run, False if it is not a CVIV run
+    # or None if it could not be processed, so that the caller can update the scan index
+    return sorted(run_list, key=lambda d: (d['start'], d['path'])), error_report, scanned_files
+
+# Settings applied to every connection to the run database. WAL lets any number of readers work alongside one writer,
+# and with WAL synchronous=NORMAL is still safe against corruption, only the last transactions may be lost on power loss
+DB_BUSY_TIMEOUT = 60            # seconds to wait for the writer lock before failing
+DB_CACHE_SIZE = -65536          # negative values are in KiB, i.e. 64 MiB of page cache per connection
+DB_MMAP_SIZE = 268435456        # 256 MiB of the database file read through memory mapping
+
+def open_db_connection(db_path: Path, check_same_thread: bool = True):
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    if conn.execute("PRAGMA journal_mode;").fetchall()[0][0] != "wal":
+        conn.execute("PRAGMA journal_mode = WAL;")  # Persistent, only needs to be set once per database file
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE};")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    enable_foreign_keys(conn)
+    return conn
+
+# Pooled connections, one per database for each process and thread, since sqlite connections can not be shared
+# between threads nor survive a fork. The connection is kept open and handed out again to every task, so that the page
+# cache is reused across tasks. It can be used in a with statement, like the one from sqlite3.connect, which commits
+# (or rolls back) on exit but does not close the connection. The connections are closed when the process exits, so the
+# last one to close checkpoints the WAL into the database file
+_db_pool = threading.local()
 
-            metadata = get_cviv_metadata(file, logger)
-            run_list += [metadata]
+def get_db_connection(db_path: Path):
+    if getattr(_db_pool, 'pid', None) != os.getpid():
+        _db_pool.pid = os.getpid()
+        _db_pool.connections = {}
+        if threading.current_thread() is threading.main_thread():  # The exit handlers run in the main thread
+            # Unlike atexit, the multiprocessing finalizers also run when the worker processes exit
+            multiprocessing.util.Finalize(None, close_db_connections, exitpriority=0)
 
-    return sorted(run_list, key=lambda d: d['start'])
+    key = str(Path(db_path).resolve())
+    conn = _db_pool.connections.get(key)
+    if conn is None:
+        conn = open_db_connection(db_path)
+        _db_pool.connections[key] = conn
+    return conn
+
+def close_db_connections():
+    if getattr(_db_pool, 'pid', None) != os.getpid():
+        return
+    for conn in _db_pool.connections.values():
+        conn.close()
+    _db_pool.connections = {}
+
+# Single writer for the run database, for when several processes work on it in parallel. All the writes are sent
+# through a queue to a dedicated process, which applies the writes waiting in the queue together in one transaction,
+# instead of every worker fighting for the database lock. Reads are still done directly by the workers
+# A write is a module level function called as func(conn, *args), each one in its own savepoint so that a failing
+# write does not undo the others in its group. execute() only returns once the transaction with the write has been
+# committed, so the worker can read its own writes right after
+class DBWriter:
+    def __init__(self, db_path: Path, max_batch: int = 1000):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._queue = multiprocessing.Queue()
+        self._failures = multiprocessing.Value('i', 0)
+        self._stopped = multiprocessing.Event()  # Set by the writer when it exits, the worker processes can not check the process itself
+        self._process = None
+
+    def __getstate__(self):  # The writer is handed to the worker processes, but only the owner controls the process
+        state = self.__dict__.copy()
+        state['_process'] = None
+        return state
+
+    def start(self):
+        self._process = multiprocessing.Process(target=_db_writer_main, args=(self.db_path, self._queue, self._failures, self._stopped, self.max_batch), name="db_writer")
+        self._process.start()
+        return self
+
+    def _writer_alive(self):
+        if self._stopped.is_set():
+            return False
+        return self._process is None or self._process.is_alive()
+
+    def execute(self, func, *args, poll_interval: float = 1.0):
+        # The request is pickled here, since the queue pickles in the background and an error there would never be reported
+        request = bytes(ForkingPickler.dumps((func, args)))
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        try:
+            self._queue.put((request, sender))  # The queue pickles the sender in the background, it is only closed after the reply
+            while not receiver.poll(poll_interval):
+                if not self._writer_alive() and not receiver.poll():
+                    raise RuntimeError(f"The database write {func.__name__} was not done, the db_writer process is no longer running")
+            status, result = receiver.recv()
+        finally:
+            receiver.close()
+            sender.close()
+        if status == "error":
+            raise RuntimeError(f"The database write {func.__name__} failed: {result}")
+        return result
+
+    def stop(self):
+        self._queue.put(None)
+        self._process.join()
+        exitcode = self._process.exitcode
+        self._process = None
+        if exitcode != 0:
+            raise RuntimeError(f"The db_writer process exited with code {exitcode}, see its log")
+        if self._failures.value > 0:  # Only the failures which could not be reported to the caller of execute
+            raise RuntimeError(f"{self._failures.value} database writes failed without being reported, see the log of the db_writer")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def _db_writer_main(db_path: Path, queue, failures, stopped, max_batch: int):
+    try:
+        _db_writer_loop(db_path, queue, failures, max_batch)
+    finally:
+        stopped.set()
+
+def _db_writer_loop(db_path: Path, queue, failures, max_batch: int):
+    logger = logging.getLogger('db_writer')
+    conn = open_db_connection(db_path)
+
+    running = True
+    while running:
+        batch = [queue.get()]
+        while len(batch) < max_batch:
+            try:
+                batch += [queue.get_nowait()]
+            except Empty:
+                break
+
+        replies = []
+        conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+        try:
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                request, reply = item
+                conn.execute("SAVEPOINT db_writer;")
+                try:
+                    func, args = ForkingPickler.loads(request)
+                    result = func(conn, *args)
+                except Exception as error:
+                    conn.execute("ROLLBACK TO db_writer;")
+                    logger.error(f"A database write failed: {type(error).__name__}: {error}")
+                    replies += [(reply, ("error", f"{type(error).__name__}: {error}"))]
+                else:
+                    replies += [(reply, ("ok", result))]
+                conn.execute("RELEASE db_writer;")
+            conn.execute("COMMIT TRANSACTION;")
+        except Exception as error:
+            conn.execute("ROLLBACK TRANSACTION;")
+            logger.error(f"Unable to commit {len(replies)} database writes: {type(error).__name__}: {error}")
+            replies = [(reply, ("error", f"{type(error).__name__}: {error}")) for reply, _ in replies]
+
+        for reply, message in replies:
+            try:
+                try:
+                    data = ForkingPickler.dumps(message)
+                except Exception as error:
+                    message = ("error", f"Unable to return the result: {type(error).__name__}: {error}")
+                    data = ForkingPickler.dumps(message)
+                reply.send_bytes(data)
+            except Exception as error:  # e.g. the caller is gone, if this was an error nobody else knows about it
+                logger.error(f"Unable to reply to a database write: {type(error).__name__}: {error}")
+                if message[0] == "error":
+                    with failures.get_lock():
+                        failures.value += 1
+            finally:
+                reply.close()
+    conn.close()
+
+_db_writer = None
+
+def set_db_writer(writer: DBWriter):
+    # Also used as the initializer of the worker processes
+    global _db_writer
+    _db_writer = writer
+
+def get_db_writer():
+    return _db_writer
+
+def write_db(conn: sqlite3.Connection, func, *args):
+    # Routes the write through the single writer when one is set for this process, otherwise it is done directly
+    if _db_writer is not None:
+        return _db_writer.execute(func, *args)
+    return func(conn, *args)
 
 def enable_foreign_keys(conn: sqlite3.Connection):
     res = conn.execute("PRAGMA foreign_keys;")
@@ -336,108 +845,907 @@ def enable_foreign_keys(conn: sqlite3.Connection):
         conn.execute("PRAGMA foreign_keys = ON;")
 
 def create_run_info_table(conn: sqlite3.Connection, tableName: str, columns: list[str], logger: logging.Logger):
-    # Check if table exists
-    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
-    if len(res.fetchall()) == 0:  # If table does not exist
-        create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, `RunName` TEXT NOT NULL UNIQUE"
-        for col in columns:
-            colInfo = get_column_info_for_db(col)
-            if colInfo is None:
-                logger.warning(f'Unknown column "{col}", skipping it')
-                continue
-            create_table_sql += f", `{col}` {colInfo}"
-        create_table_sql += ", `Observations` TEXT);"
+    for col in columns:
+        if col not in run_info_schema:
+            logger.warning(f'Unknown column "{col}", skipping it')
 
-        conn.execute(create_table_sql)
-        #res = conn.execute(create_table_sql)
-        #print(res.fetchall())
-    else:  # If table exists, add missing columns... TODO: this currently does not work very well...
-        for col in columns:
-            colInfo = get_column_info_for_db(col)
-            if colInfo is None:
-                logger.warning(f'Unknown column "{col}", skipping it')
-                continue
-            res = conn.execute(f"SELECT * FROM pragma_table_info('{tableName}') WHERE name='{col}'")
-            if len(res.fetchall()) == 0:  # If the colun does not exist, we have to add it
-                conn.execute(f"ALTER TABLE `{tableName}` ADD `{col}` {colInfo};")
+    # All the changes are applied together, or none at all, also when not called from within a transaction
+    conn.execute("SAVEPOINT create_run_info_table;")
+    try:
+        version = conn.execute("PRAGMA user_version;").fetchall()[0][0]
+        if version > RUN_INFO_SCHEMA_VERSION:
+            raise RuntimeError(f"The database uses the run info schema version {version}, which is newer than the one of these scripts ({RUN_INFO_SCHEMA_VERSION}), please update them")
 
-def get_run_info(conn: sqlite3.Connection, tableName: str, runName: str, columns: dict[str, str]):
-    retVal = {}
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info('{tableName}');")]
+        if len(existing) == 0:  # If table does not exist
+            create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, `RunName` TEXT NOT NULL UNIQUE"
+            for col in run_info_schema:
+                create_table_sql += f", `{col}` {get_column_info_for_db(col)}"
+            create_table_sql += ", `Observations` TEXT);"
+            conn.execute(create_table_sql)
+        else:  # If table exists, add the columns missing from the registry
+            for col, (sql_type, _, _, _) in run_info_schema.items():
+                if col not in existing:
+                    logger.info(f'Adding the column "{col}" to the {tableName} table')
+                    conn.execute(f"ALTER TABLE `{tableName}` ADD `{col}` {sql_type};")
+        if version != RUN_INFO_SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {RUN_INFO_SCHEMA_VERSION};")
+
+        create_run_info_indexes(conn, tableName, logger)
+        create_run_info_change_counter(conn, tableName)
+    except:
+        conn.execute("ROLLBACK TO create_run_info_table;")
+        conn.execute("RELEASE create_run_info_table;")
+        raise
+    else:
+        conn.execute("RELEASE create_run_info_table;")
 
-    colNames = list(columns.keys())
+# Secondary indexes for the columns the runs are looked up by, the index name is prefixed with the table name and "_by_"
+# Add new indexes here, they are created (and outdated ones dropped) the next time the run info table is opened
+run_info_indexes = {
+    "name": ["name"],
+    "sample_pixel": ["sample", "pixel row", "pixel col"],
+    "type": ["type"],
+    "start": ["start"],
+    "temperature": ["temperature [C]"],
+}
 
-    query = f"SELECT `RunID`,`RunName`,`Observations`"
-    for col in colNames:
-        query += f",`{col}`"
+def create_run_info_indexes(conn: sqlite3.Connection, tableName: str, logger: logging.Logger):
+    table_columns = [row[0] for row in conn.execute(f"SELECT name FROM pragma_table_info('{tableName}');")]
+    existing = dict(conn.execute(f"SELECT name,sql FROM sqlite_master WHERE type='index' AND tbl_name='{tableName}' AND name LIKE '{tableName}\\_by\\_%' ESCAPE '\\';").fetchall())
 
-    query += f" FROM '{tableName}' WHERE `RunName`=?;"
-    res = conn.execute(query, [runName]).fetchall()
+    expected = {}
+    for suffix, columns in run_info_indexes.items():
+        missing = [col for col in columns if col not in table_columns]
+        if len(missing) > 0:
+            logger.debug(f'Not creating the index on {columns}, the columns {missing} do not exist')
+            continue
+        index_name = f"{tableName}_by_{suffix}"
+        column_str = ", ".join([f"`{col}`" for col in columns])
+        expected[index_name] = f"CREATE INDEX `{index_name}` ON `{tableName}` ({column_str})"
+
+    for index_name, index_sql in existing.items():
+        if expected.get(index_name) != index_sql:
+            logger.info(f'Dropping the outdated index {index_name}')
+            conn.execute(f"DROP INDEX `{index_name}`;")
+    for index_name, index_sql in expected.items():
+        if existing.get(index_name) != index_sql:
+            logger.info(f'Creating the index {index_name}')
+            conn.execute(index_sql + ";")
+
+# Counter of the changes to the run info table, kept by triggers, so the readers can tell whether the table changed
+# (also from another process) without being affected by the writes to the other tables
+def create_run_info_change_counter(conn: sqlite3.Connection, tableName: str):
+    counterTable = f"{tableName}Changes"
+    conn.execute(f"CREATE TABLE IF NOT EXISTS `{counterTable}` (`id` INTEGER PRIMARY KEY CHECK (`id` = 0), `changes` INTEGER NOT NULL);")
+    conn.execute(f"INSERT OR IGNORE INTO `{counterTable}`(`id`,`changes`) VALUES(0, 0);")
+    for event in ["INSERT", "UPDATE", "DELETE"]:
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS `{tableName}_count_{event.lower()}` AFTER {event} ON `{tableName}` BEGIN UPDATE `{counterTable}` SET `changes`=`changes`+1 WHERE `id`=0; END;")
+
+# Cache of the run info table, shared by all the tasks in a process. The table is bulk-loaded once into one tuple per
+# run (the column names are kept only once, per cache) and the lookups are then served from memory, in LRU order,
+# keeping at most max_runs runs. The cache is dropped whenever the run info table changes, as told by the change
+# counter of the table, so the writes to the other tables (e.g. the measurements of every run) do not affect it. For
+# databases created before the counter, it is dropped whenever the database changes: PRAGMA data_version catches the
+# commits from other connections and total_changes the writes from the connection itself. Writers also invalidate it
+# explicitly with invalidate_run_info_cache
+class RunInfoCache:
+    def __init__(self, tableName: str, max_runs: int = 20000):
+        self.tableName = tableName
+        self.max_runs = max_runs
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._columns = None
+        self._records = collections.OrderedDict()
+        self._complete = False  # True if the whole table fits in the cache, so a miss means the run does not exist
+        self._stamp = None
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def _get_stamp(self, conn: sqlite3.Connection):
+        try:
+            res = conn.execute(f"SELECT `changes` FROM `{self.tableName}Changes` WHERE `id`=0;").fetchall()
+        except sqlite3.OperationalError:  # No change counter in this database
+            res = []
+        if len(res) > 0:
+            return (id(conn), res[0][0])
+        return (id(conn), conn.execute("PRAGMA data_version;").fetchall()[0][0], conn.total_changes)
+
+    def _load(self, conn: sqlite3.Connection):
+        res = conn.execute(f"SELECT * FROM '{self.tableName}' ORDER BY `RunID` DESC LIMIT ?;", [self.max_runs + 1])
+        self._columns = {desc[0]: idx for idx, desc in enumerate(res.description)}
+        rows = res.fetchall()
+        self._complete = len(rows) <= self.max_runs
+        for row in reversed(rows[:self.max_runs]):
+            self._records[row[self._columns['RunName']]] = row
+
+    def get(self, conn: sqlite3.Connection, runName: str):
+        with self._lock:
+            stamp = self._get_stamp(conn)
+            if stamp != self._stamp:
+                self._clear()
+                self._load(conn)
+                self._stamp = stamp
+
+            row = self._records.get(runName)
+            if row is not None:
+                self._records.move_to_end(runName)
+            elif not self._complete:
+                res = conn.execute(f"SELECT * FROM '{self.tableName}' WHERE `RunName`=?;", [runName]).fetchall()
+                if len(res) == 0:
+                    return None
+                row = res[0]
+                self._records[runName] = row
+                if len(self._records) > self.max_runs:
+                    self._records.popitem(last=False)
+            else:
+                return None
+
+            return {col: row[idx] for col, idx in self._columns.items()}
+
+_run_info_caches = {}
+_run_info_caches_lock = threading.Lock()
+
+def get_run_info_cache(conn: sqlite3.Connection, tableName: str = 'RunInfo'):
+    db_file = conn.execute("PRAGMA database_list;").fetchall()[0][2]
+    with _run_info_caches_lock:
+        key = (os.getpid(), db_file, tableName)
+        if key not in _run_info_caches:
+            _run_info_caches[key] = RunInfoCache(tableName)
+        return _run_info_caches[key]
+
+def invalidate_run_info_cache(conn: sqlite3.Connection, tableName: str = 'RunInfo'):
+    get_run_info_cache(conn, tableName).invalidate()
 
-    if len(res) == 1:
-        retVal['RunID'] = res[0][0]
-        retVal['RunName'] = res[0][1]
-        retVal['Observations'] = res[0][2]
+# Returns all the columns of the run, as stored in the database, or None if the run does not exist
+def get_run_record(conn: sqlite3.Connection, tableName: str, runName: str):
+    return get_run_info_cache(conn, tableName).get(conn, runName)
 
-        for idx in range(len(colNames)):
-            if colNames[idx] == "path":
-                retVal[columns[colNames[idx]]] = Path(res[0][3 + idx])
-            elif colNames[idx] == "type":
-                retVal[columns[colNames[idx]]] = CVIV_Types(res[0][3 + idx])
+# Same as get_run_record for many runs with a single query, returns a dictionary with the runs which exist by name
+def get_run_records(conn: sqlite3.Connection, tableName: str, run_names: list[str]):
+    res = conn.execute(f"SELECT * FROM `{tableName}` WHERE `RunName` IN (SELECT value FROM json_each(?));", [json.dumps(list(run_names))])
+    columns = [desc[0] for desc in res.description]
+    return {row[columns.index('RunName')]: dict(zip(columns, row)) for row in res.fetchall()}
+
+def set_run_observations(conn: sqlite3.Connection, tableName: str, run_id: int, observations: str):
+    conn.execute(f"UPDATE `{tableName}` SET `Observations`=? WHERE `RunID`=?;", [observations, run_id])
+    invalidate_run_info_cache(conn, tableName)
+
+def get_run_info(conn: sqlite3.Connection, tableName: str, runName: str, columns: dict[str, str]):
+    retVal = {}
+
+    record = get_run_record(conn, tableName, runName)
+
+    if record is not None:
+        retVal['RunID'] = record['RunID']
+        retVal['RunName'] = record['RunName']
+        retVal['Observations'] = record['Observations']
+
+        for col in columns:
+            if col == "path":
+                retVal[columns[col]] = Path(record[col])
+            elif col == "type":
+                retVal[columns[col]] = CVIV_Types(record[col])
             else:
-                retVal[columns[colNames[idx]]] = res[0][3 + idx]
+                retVal[columns[col]] = record.get(col, None)
 
     return retVal
 
 def get_all_run_info(conn: sqlite3.Connection, tableName: str, runName: str):
-    return get_run_info(conn, tableName, runName, {
-            "path": "Path",
-            "name": "File Name",
-            "type": "Run Type",
-            "version": "Version",
-            "start": "Start Time",
-            "stop": "Stop Time",
-            "elapsed [s]": "Elapsed Time",
-            "tester": "Tester",
-            "temperature [C]": "Temperature",
-            "I meter": "I meter",
-            "I averaging": "I averaging",
-            "V source": "V source",
-            "V integration time [ms]": "V integration time",
-            "V averaging": "V averaging",
-            "compliance [A]": "Compliance",
-            "ramp up step [V]": "Ramp-up Step",
-            "ramp up delay [s]": "Ramp-up Delay",
-            "ramp down step [V]": "Ramp-down Step",
-            "ramp down delay [s]": "Ramp-down Delay",
-            "V step mode": "V Step Mode",
-            "sample": "Sample",
-            "irradiation flux [p/cm^2]": "Irradiation Flux",
-            "irradiated": "Irradiated",
-            "pixel": "Pixel",
-            "pixel row": "Pixel Row",
-            "pixel col": "Pixel Column",
-            "begin location": "Begin Location",
-            "end location": "End Location",
-            "V start [V]": "V Start",
-            "V stop [V]": "V Stop",
-            "V steps": "V Steps",
-            "SHA256": "SHA256",
-            "MD5": "MD5",
-            "comments": "Comments",
-            "LCR meter": "LCR meter",
-            "LCR frequency [Hz]": "LCR Frequency",
-            "LCR signal level [V]": "LCR Signal Level",
-            "LCR averaging": "LCR averaging",
-            "LCR open correction C [F]": "LCR Open Correction C",
-            "LCR open correction G [S]": "LCR Open Correction G",
-        })
+    return get_run_info(conn, tableName, runName, {col: info[3] for col, info in run_info_schema.items()})
+
+# Run selections are lists of terms like "sample=FBK-3 type=CV temperature<-20 start>=2023-08-01 pixel=1 2", which
+# are compiled into a parameterised WHERE clause on the run info table, so the lookups are served by its indexes
+# A term without an operator continues the value of the previous term (i.e. "pixel=1 2" is a single term)
+# Several values can be given with "," (sample=FBK-1,FBK-2) and "=" and "!=" accept the * and ? wildcards
+run_selection_aliases = {
+    "run": "RunName",
+    "id": "RunID",
+    "file": "name",
+    "temperature": "temperature [C]",
+    "frequency": "LCR frequency [Hz]",
+    "flux": "irradiation flux [p/cm^2]",
+    "row": "pixel row",
+    "col": "pixel col",
+    "observations": "Observations",
+}
+_run_selection_regex = re.compile(r'^([^<>=!]+?)\s*(<=|>=|!=|=|<|>)\s*(.*)$')
+
+def _get_run_selection_type(col: str):
+    if col == "RunID":
+        return int
+    elif col == "RunName" or col == "Observations":
+        return str
+    return run_info_schema[col][2]
+
+def _convert_run_selection_value(col: str, value: str):
+    python_type = _get_run_selection_type(col)
+    try:
+        if python_type == CVIV_Types:
+            for run_type in CVIV_Types:
+                if run_type.name.lower() == value.lower():
+                    return run_type.value
+            return CVIV_Types(int(value)).value
+        elif python_type == bool:
+            if value.lower() in ["1", "true", "yes"]:
+                return 1
+            elif value.lower() in ["0", "false", "no"]:
+                return 0
+            raise ValueError(value)
+        return python_type(value)
+    except ValueError:
+        raise RuntimeError(f'Invalid value "{value}" for the column "{col}" in the run selection')
+
+def parse_run_selection(selection: list[str]):
+    terms = []
+    for token in itertools.chain.from_iterable(shlex.split(entry) for entry in selection):
+        match = _run_selection_regex.match(token)
+        if match is None:
+            if len(terms) == 0:
+                raise RuntimeError(f'Unable to parse the run selection term "{token}", the terms are of the form column=value')
+            terms[-1][2] += " " + token
+            continue
+        terms += [[match.group(1).strip(), match.group(2), match.group(3)]]
+
+    conditions = []
+    for key, op, value in terms:
+        if key == "pixel":  # The pixel is matched on its row and column, which are part of the sample and pixel index
+            pixel = value.split()
+            if op != "=" or len(pixel) != 2:
+                raise RuntimeError(f'The pixel can only be selected as "pixel=ROW COLUMN", got "{key}{op}{value}"')
+            conditions += [("pixel row", "=", [_convert_run_selection_value("pixel row", pixel[0])])]
+            conditions += [("pixel col", "=", [_convert_run_selection_value("pixel col", pixel[1])])]
+            continue
+
+        col = run_selection_aliases.get(key, key)
+        if col not in run_info_schema and col not in ["RunID", "RunName", "Observations"]:
+            raise RuntimeError(f'Unknown column "{key}" in the run selection')
+        if op == "=" or op == "!=":
+            values = [_convert_run_selection_value(col, entry) for entry in value.split(",")]
+        else:
+            values = [_convert_run_selection_value(col, value)]
+        conditions += [(col, op, values)]
+    return conditions
+
+def compile_run_selection(conditions: list[tuple]):
+    clauses = []
+    params = []
+    for col, op, values in conditions:
+        wildcard = [value for value in values if type(value) == str and any(char in value for char in "*?[")]
+        plain = [value for value in values if value not in wildcard]
+
+        if op == "=":
+            parts = []
+            if len(plain) == 1:
+                parts += [f"`{col}` = ?"]
+            elif len(plain) > 1:
+                parts += [f"`{col}` IN ({','.join(['?']*len(plain))})"]
+            parts += [f"`{col}` GLOB ?" for value in wildcard]
+            clause = " OR ".join(parts)
+            if len(parts) > 1:
+                clause = f"({clause})"
+        elif op == "!=":
+            parts = []
+            if len(plain) > 0:
+                parts += [f"`{col}` NOT IN ({','.join(['?']*len(plain))})"]
+            parts += [f"`{col}` NOT GLOB ?" for value in wildcard]
+            clause = f"(`{col}` IS NULL OR {' AND '.join(parts)})"  # A run where the column is not set does not have any of the values
+        else:
+            clause = f"`{col}` {op} ?"
+        clauses += [clause]
+        params += plain + wildcard
+
+    if len(clauses) == 0:
+        return "", []
+    return "WHERE " + " AND ".join(clauses), params
+
+def select_runs(conn: sqlite3.Connection, tableName: str, selection: list[str], columns: list[str] = ["RunName"]):
+    where_sql, params = compile_run_selection(parse_run_selection(selection))
+    column_str = ",".join([f"`{col}`" for col in columns])
+    return conn.execute(f"SELECT {column_str} FROM `{tableName}` {where_sql} ORDER BY `RunID`;", params).fetchall()
 
 def create_run_backup_table(conn: sqlite3.Connection, tableName: str, runInfoTable: str, logger: logging.Logger):
     res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
     if len(res.fetchall()) == 0:  # If table does not exist
-        create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER PRIMARY KEY NOT NULL, `Data` BLOB NOT NULL, FOREIGN KEY (RunID) REFERENCES `{runInfoTable}` (RunID) ON UPDATE CASCADE);"
+        # The raw file is referenced by its SHA256 in the backup store, Data is only filled if a copy is also kept in the database
+        # Codec is the compression used for Data (NULL if not compressed) and Size is the size of the uncompressed file
+        create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER PRIMARY KEY NOT NULL, `SHA256` TEXT NOT NULL, `Data` BLOB, `Codec` TEXT, `Size` INTEGER, FOREIGN KEY (RunID) REFERENCES `{runInfoTable}` (RunID) ON UPDATE CASCADE);"
+        conn.execute(create_table_sql)
+    elif is_legacy_run_backup_table(conn, tableName):
+        raise RuntimeError(f"The {tableName} table uses the old layout, where every run is stored as a BLOB. Please run migrate_backup.py on the database first")
+    else:
+        for col, colInfo in [("Codec", "TEXT"), ("Size", "INTEGER")]:
+            res = conn.execute(f"SELECT * FROM pragma_table_info('{tableName}') WHERE name='{col}'")
+            if len(res.fetchall()) == 0:
+                conn.execute(f"ALTER TABLE `{tableName}` ADD `{col}` {colInfo};")
+
+def is_legacy_run_backup_table(conn: sqlite3.Connection, tableName: str):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:  # A table which does not exist yet will be created with the new layout
+        return False
+    res = conn.execute(f"SELECT name FROM pragma_table_info('{tableName}') WHERE name='SHA256';")
+    return len(res.fetchall()) == 0
+
+def get_run_file_extension(run_type: CVIV_Types):
+    if run_type == CVIV_Types.IV or run_type == CVIV_Types.IV_Two_Probes:
+        return 'iv'
+    elif run_type == CVIV_Types.CV:
+        return 'cv'
+    return 'dat'
+
+# The backup store keeps a single copy of each raw file, named after its SHA256, so identical content is never stored twice
+def get_backup_store_path(backup_path: Path, sha256: str):
+    return backup_path / "store" / sha256[:2] / sha256
+
+def add_to_backup_store(backup_path: Path, source: Path, sha256: str):
+    store_path = get_backup_store_path(backup_path, sha256)
+    if store_path.exists():
+        return store_path
+    if split_archive_path(source)[1] is not None:  # Archive members can only be copied
+        return write_to_backup_store(backup_path, iter_file_chunks(source), sha256)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Hardlink where possible, so the backup does not cost any extra disk space or writes
+    try:
+        os.link(source, store_path)
+        return store_path
+    except FileExistsError:
+        return store_path
+    except OSError:
+        pass
+
+    tmp_path = store_path.with_name(store_path.name + f".{os.getpid()}.tmp")
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, store_path)
+    return store_path
+
+def write_to_backup_store(backup_path: Path, chunks, sha256: str):
+    store_path = get_backup_store_path(backup_path, sha256)
+    if store_path.exists():
+        return store_path
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = store_path.with_name(store_path.name + f".{os.getpid()}.tmp")
+    with tmp_path.open("wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(tmp_path, store_path)
+    return store_path
+
+BLOB_CHUNK_SIZE = 1048576
+BLOB_CODECS = ["none", "zlib", "lzma"]
+
+def iter_file_chunks(file_path: Path, chunk_size: int = BLOB_CHUNK_SIZE):
+    with open_cviv_file(file_path) as file:
+        yield from iter_stream_chunks(file, chunk_size)
+
+def iter_stream_chunks(file, chunk_size: int = BLOB_CHUNK_SIZE):
+    while chunk := file.read(chunk_size):
+        yield chunk
+
+def _get_blob_compressor(codec: str):
+    if codec is None or codec == "none":
+        return None
+    elif codec == "zlib":
+        return zlib.compressobj(6)
+    elif codec == "lzma":
+        return lzma.LZMACompressor()
+    raise RuntimeError(f"Unknown BLOB codec: {codec}")
+
+def _get_blob_decompressor(codec: str):
+    if codec is None or codec == "none":
+        return None
+    elif codec == "zlib":
+        return zlib.decompressobj()
+    elif codec == "lzma":
+        return lzma.LZMADecompressor()
+    raise RuntimeError(f"Unknown BLOB codec: {codec}")
+
+# Incremental BLOB I/O (Connection.blobopen) is only available from Python 3.11, older versions write the BLOB with a
+# single bound parameter and read it in chunks with substr, which is slower and holds the whole BLOB in memory on writes
+_blobopen_supported = hasattr(sqlite3.Connection, "blobopen")
+
+# Yields the bytes [begin, end) of the Data column of a backup row in chunks (up to the end of the BLOB if end is None)
+def _iter_blob_chunks(conn: sqlite3.Connection, tableName: str, run_id: int, begin: int = 0, end: int = None):
+    if _blobopen_supported:
+        with conn.blobopen(tableName, "Data", run_id, readonly=True) as blob:
+            blob.seek(begin)
+            offset = begin
+            while end is None or offset < end:
+                chunk = blob.read(BLOB_CHUNK_SIZE if end is None else min(BLOB_CHUNK_SIZE, end - offset))
+                if len(chunk) == 0:
+                    break
+                offset += len(chunk)
+                yield chunk
+        return
+
+    offset = begin
+    while end is None or offset < end:
+        size = BLOB_CHUNK_SIZE if end is None else min(BLOB_CHUNK_SIZE, end - offset)
+        chunk = conn.execute(f"SELECT substr(`Data`, ?, ?) FROM `{tableName}` WHERE `RunID`=?;", [offset + 1, size, run_id]).fetchall()[0][0]
+        if chunk is None or len(chunk) == 0:
+            break
+        offset += len(chunk)
+        yield chunk
+
+# Stores the chunks, compressed with the codec, in the Data column of an existing backup row. The compressed data is
+# spooled first, so its size is known, and then streamed into the BLOB, so the file is never fully held in memory
+def write_backup_blob(conn: sqlite3.Connection, tableName: str, run_id: int, chunks, codec: str = "zlib"):
+    compressor = _get_blob_compressor(codec)
+    if compressor is None:
+        codec = None
+
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=16*BLOB_CHUNK_SIZE) as spool:
+        for chunk in chunks:
+            size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            spool.write(chunk)
+        if compressor is not None:
+            spool.write(compressor.flush())
+
+        stored_size = spool.tell()
+        spool.seek(0)
+        if not _blobopen_supported:
+            conn.execute(f"UPDATE `{tableName}` SET `Data`=?,`Codec`=?,`Size`=? WHERE `RunID`=?;", [spool.read(), codec, size, run_id])
+            return
+        conn.execute(f"UPDATE `{tableName}` SET `Data`=zeroblob(?),`Codec`=?,`Size`=? WHERE `RunID`=?;", [stored_size, codec, size, run_id])
+        if stored_size > 0:
+            with conn.blobopen(tableName, "Data", run_id) as blob:
+                while chunk := spool.read(BLOB_CHUNK_SIZE):
+                    blob.write(chunk)
+
+# Yields the uncompressed content of a backup BLOB in chunks, streamed out of the database
+def iter_backup_blob(conn: sqlite3.Connection, tableName: str, run_id: int, codec: str = None):
+    decompressor = _get_blob_decompressor(codec)
+    for chunk in _iter_blob_chunks(conn, tableName, run_id):
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        if len(chunk) > 0:
+            yield chunk
+    if codec == "zlib":
+        chunk = decompressor.flush()
+        if len(chunk) > 0:
+            yield chunk
+
+# Returns whether there is a BLOB for the run and the codec it was compressed with, the old layout of the backup table
+# has no Codec column and only holds uncompressed data
+def get_backup_blob_codec(conn: sqlite3.Connection, tableName: str, run_id: int):
+    codec_column = "NULL" if is_legacy_run_backup_table(conn, tableName) else "`Codec`"
+    res = conn.execute(f"SELECT `Data` IS NOT NULL,{codec_column} FROM `{tableName}` WHERE `RunID`=?;", [run_id]).fetchall()
+    if len(res) == 0 or not res[0][0]:
+        return False, None
+    return True, res[0][1]
+
+def restore_from_backup_blob(conn: sqlite3.Connection, tableName: str, run_id: int, backup_path: Path, sha256: str):
+    has_blob, codec = get_backup_blob_codec(conn, tableName, run_id)
+    if not has_blob:
+        return None
+    return write_to_backup_store(backup_path, iter_backup_blob(conn, tableName, run_id, codec), sha256)
+
+# The runs, out of run_ids, with a copy of the run file kept in the backup table
+def get_runs_with_backup_blob(conn: sqlite3.Connection, tableName: str, run_ids: list[int]):
+    res = conn.execute(f"SELECT `RunID` FROM `{tableName}` WHERE `Data` IS NOT NULL AND `RunID` IN (SELECT value FROM json_each(?));", [json.dumps(list(run_ids))])
+    return {row[0] for row in res.fetchall()}
+
+# Returns the bytes [begin, end) of the run file kept in a backup BLOB (up to the end of the file if end is None), or
+# None if there is no BLOB for the run. An uncompressed BLOB is read only over that range, a compressed one is only
+# decompressed up to end
+def read_backup_blob(conn: sqlite3.Connection, tableName: str, run_id: int, begin: int = 0, end: int = None):
+    has_blob, codec = get_backup_blob_codec(conn, tableName, run_id)
+    if not has_blob:
+        return None
+
+    if codec is None or codec == "none":
+        return b"".join(_iter_blob_chunks(conn, tableName, run_id, begin, end))
+
+    content = bytearray()
+    chunks = iter_backup_blob(conn, tableName, run_id, codec)
+    for chunk in chunks:
+        content += chunk
+        if end is not None and len(content) >= end:
+            break
+    chunks.close()
+    return bytes(memoryview(content)[begin:end])
+
+# Parses the measurements of a run straight from its backup BLOB, without writing the run file out. With the byte
+# offsets of the data block only the block is read, otherwise the whole file is parsed in memory. Returns None if
+# there is no BLOB for the run
+def parse_backup_blob(conn: sqlite3.Connection, tableName: str, run_info: dict):
+    run_type = CVIV_Types(run_info['type'])
+    cols = get_data_columns(run_type)
+    if cols is None:
+        raise RuntimeError(f"Columns are not defined for the run type {run_type}")
+    begin_location = run_info['begin location']
+    end_location = run_info['end location']
+    begin_offset = run_info.get('begin offset')
+    end_offset = run_info.get('end offset')
+
+    if begin_offset is not None and end_offset is not None:
+        block = read_backup_blob(conn, tableName, run_info['RunID'], begin_offset, end_offset)
+        if block is None:
+            return None
+        data = parse_data_block(block, cols, end_location - begin_location - 1)
+        if data is not None:
+            return data
+
+    content = read_backup_blob(conn, tableName, run_info['RunID'])
+    if content is None:
+        return None
+    return parse_run_data(io.BytesIO(content), run_type, begin_location, end_location)
+
+# Looks for a copy of the run file: the original file (possibly inside an archive), then the backup store and finally
+# the backup files named after the run, as created by older versions of load_runs. Returns None if none of them exist
+def find_run_file(run_file_path: Path, run_name: str, run_type: CVIV_Types, sha256: str, backup_path: Path):
+    candidates = [
+        run_file_path,
+        get_backup_store_path(backup_path, sha256),
+        backup_path / (run_name + "." + get_run_file_extension(run_type)),
+    ]
+    for candidate in candidates:
+        if run_file_exists(candidate):
+            return candidate
+    return None
+
+def get_data_columns(run_type: CVIV_Types):
+    # TODO: Missing standard IV
+    if run_type == CVIV_Types.IV_Two_Probes:
+        return ["Bias Voltage [V]", "Total Current [A]", "Pad Current [A]"]
+    elif run_type == CVIV_Types.CV:
+        return ["Voltage [V]", "Capacitance [F]", "Conductivity [S]", "Bias Voltage [V]", "Pad Current [A]"]
+    return None
+
+# The measurements of each run are kept in the database as one float64 array per column, so the text file only has
+# to be parsed once, when the run is loaded, and the tasks can then read just the columns they need
+def create_run_data_table(conn: sqlite3.Connection, tableName: str, runInfoTable: str, logger: logging.Logger):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:  # If table does not exist
+        create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER NOT NULL, `column` TEXT NOT NULL, `Data` BLOB NOT NULL, PRIMARY KEY (`RunID`, `column`), FOREIGN KEY (RunID) REFERENCES `{runInfoTable}` (RunID) ON UPDATE CASCADE);"
         conn.execute(create_table_sql)
 
+def parse_run_data(file, run_type: CVIV_Types, begin_location: int, end_location: int, begin_offset: int = None, end_offset: int = None):
+    cols = get_data_columns(run_type)
+    if cols is None:
+        raise RuntimeError(f"Columns are not defined for the run type {run_type}")
+
+    if begin_offset is not None and end_offset is not None:
+        data = read_data_block(file, cols, begin_offset, end_offset, end_location - begin_location - 1)
+        if data is not None:
+            return data
+        file.seek(0)  # Not a plain numeric block, left for pandas to deal with
+
+    df = pandas.read_csv(
+                        file,
+                        sep = "\t",
+                        names = cols,
+                        skiprows = begin_location + 1,
+                        nrows = end_location - begin_location - 1,
+                         )
+    return {col: df[col].to_numpy(dtype=numpy.float64) for col in cols}
+
+def read_data_block(file, cols: list[str], begin_offset: int, end_offset: int, num_rows: int):
+    # Jumps straight to the data block with the byte offsets recorded when the run was loaded, so the header is not
+    # tokenised at all, and parses the whole block at once with the arrow CSV reader. Returns None if the block is
+    # not a table of num_rows rows of the expected columns, in which case the line based parser has to deal with it
+    try:
+        file.seek(begin_offset)
+    except (io.UnsupportedOperation, OSError):  # Stream, e.g. a member of a compressed tarball
+        file.read(begin_offset)
+    block = file.read(end_offset - begin_offset)
+    if len(block) != end_offset - begin_offset:
+        return None
+    return parse_data_block(block, cols, num_rows)
+
+def parse_data_block(block: bytes, cols: list[str], num_rows: int):
+    try:
+        table = pyarrow.csv.read_csv(
+                                        pyarrow.py_buffer(block),
+                                        read_options = pyarrow.csv.ReadOptions(column_names=cols),
+                                        parse_options = pyarrow.csv.ParseOptions(delimiter="\t"),
+                                        convert_options = pyarrow.csv.ConvertOptions(column_types={col: pyarrow.float64() for col in cols}),
+                                    )
+    except pyarrow.ArrowInvalid:
+        return None
+    if table.num_rows != num_rows:
+        return None
+    return {col: table.column(col).to_numpy() for col in cols}
+
+def store_run_data(conn: sqlite3.Connection, tableName: str, run_id: int, data: dict[str, numpy.ndarray]):
+    values = [(run_id, col, numpy.ascontiguousarray(array, dtype='<f8').tobytes()) for col, array in data.items()]
+    conn.execute(f"DELETE FROM `{tableName}` WHERE `RunID`=?;", [run_id])
+    conn.executemany(f"INSERT INTO `{tableName}`(`RunID`,`column`,`Data`) VALUES(?, ?, ?);", values)
+
+# Returns the arrays of the requested columns (all if None), in the order they are in the run file, or None if the
+# measurements of the run are not in the database
+def load_run_data(conn: sqlite3.Connection, tableName: str, run_id: int, columns: list[str] = None):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:
+        return None
+
+    query = f"SELECT `column`,`Data` FROM `{tableName}` WHERE `RunID`=?"
+    params = [run_id]
+    if columns is not None:
+        query += " AND `column` IN (" + ",".join(["?"]*len(columns)) + ")"
+        params += columns
+    res = conn.execute(query + " ORDER BY rowid;", params).fetchall()
+    if len(res) == 0:
+        return None
+    return {col: numpy.frombuffer(blob, dtype='<f8') for col, blob in res}
+
+# The runs, out of run_ids, whose measurements are in the database
+def get_runs_with_data(conn: sqlite3.Connection, tableName: str, run_ids: list[int]):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:
+        return set()
+    res = conn.execute(f"SELECT DISTINCT `RunID` FROM `{tableName}` WHERE `RunID` IN (SELECT value FROM json_each(?));", [json.dumps(list(run_ids))])
+    return {row[0] for row in res.fetchall()}
+
+# Steps of the bias voltage smaller than this are taken as a repeated setpoint (i.e. readback noise) and do not
+# change the sweep direction
+voltage_step_tolerance = 0.05  # V
+# A leading sweep whose typical step is this many times larger than the finest sweep of the run is a coarse pre-sweep
+coarse_step_ratio = 2
+
+# Splits a bias voltage sequence into sweeps, with numpy over the whole sequence. Returns, for each point, the sweep
+# direction (+1, -1, or 0 if the voltage never changes), the index of the sweep (segment) and whether the sweep is a
+# coarse pre-sweep. A segment is a monotonic stretch of the voltage, so a linear run has a single segment and a linear
+# hysteresis run one per direction, while repeated setpoints stay within the segment of the following step
+def derive_sweep_segments(voltage: numpy.ndarray):
+    num_points = len(voltage)
+
+    # Direction of the step into each point, the first point takes the direction of the step out of it
+    step = numpy.zeros(num_points)
+    step[1:] = numpy.diff(voltage)
+    if num_points > 1:
+        step[0] = step[1]
+    direction = numpy.where(numpy.abs(step) > voltage_step_tolerance, numpy.sign(step), 0)
+
+    # Repeated setpoints take the direction of the next real step, and any at the very end that of the previous one
+    positions = numpy.arange(num_points)
+    next_index = numpy.minimum.accumulate(numpy.where(direction != 0, positions, num_points)[::-1])[::-1]
+    previous_index = numpy.maximum.accumulate(numpy.where(direction != 0, positions, -1))
+    fill_index = numpy.where(next_index < num_points, next_index, previous_index)
+    direction = numpy.where(fill_index >= 0, direction[fill_index], 0)
+
+    segment = numpy.zeros(num_points, dtype=numpy.int64)
+    segment[1:] = numpy.cumsum(direction[1:] != direction[:-1])
+
+    # Typical (median) step of each segment, the step into the first point of a segment is across the turning point
+    first_in_segment = numpy.ones(num_points, dtype=bool)
+    first_in_segment[1:] = segment[1:] != segment[:-1]
+    segment_step = pandas.Series(numpy.where(first_in_segment | (direction == 0), numpy.nan, numpy.abs(step))).groupby(segment).median().to_numpy()
+    is_coarse = segment_step > coarse_step_ratio * numpy.nanmin(segment_step, initial=numpy.inf)
+    is_coarse = numpy.logical_and.accumulate(is_coarse)  # Only the leading segments, before the first fine one
+
+    return direction, segment, is_coarse[segment]
+
+def get_segment_labels(direction: numpy.ndarray, is_coarse: numpy.ndarray):
+    labels = numpy.where(is_coarse, "coarse", "fine").astype(object)
+    return labels + numpy.where(direction > 0, " up", numpy.where(direction < 0, " down", ""))
+
+# The voltage programs run by the station, one setpoint per line, as in config/*.txt. The setpoints of a run in
+# "from file" mode follow one of these, so the sweeps of the run can be taken from the program instead of being
+# guessed from the measured voltages
+class SweepProfile:
+    def __init__(self, name: str, setpoints: numpy.ndarray):
+        self.name = name
+        self.setpoints = setpoints
+        self.direction, self.segment, self.is_coarse = derive_sweep_segments(setpoints)
+        self.labels = get_segment_labels(self.direction, self.is_coarse)
+
+sweep_profiles_path = Path(__file__).resolve().parent.parent / "config"
+# The measured bias voltage has to be this close to the setpoint at every point for a run to match a profile, it is
+# below half the finest step of the programs so two programs differing by a single step can not both match
+sweep_profile_tolerance = 0.2  # V
+
+_sweep_profiles = {}
+_sweep_profiles_lock = threading.Lock()
+
+# Returns the profiles of the directory (config/ by default), which are only parsed the first time, together with the
+# setpoints of all of them as a single array padded with NaN, so a run can be aligned with all the profiles at once
+def get_sweep_profiles(profiles_path: Path = None):
+    if profiles_path is None:
+        profiles_path = sweep_profiles_path
+    key = (os.getpid(), str(profiles_path))
+    with _sweep_profiles_lock:
+        if key not in _sweep_profiles:
+            profiles = []
+            if profiles_path.is_dir():
+                for file_path in sorted(profiles_path.glob("*.txt")):
+                    setpoints = numpy.loadtxt(file_path, dtype=numpy.float64, ndmin=1)
+                    profiles += [SweepProfile(file_path.stem, setpoints)]
+            profiles.sort(key=lambda profile: len(profile.setpoints))
+
+            setpoints = numpy.full((len(profiles), max([len(profile.setpoints) for profile in profiles], default=0)), numpy.nan)
+            for idx, profile in enumerate(profiles):
+                setpoints[idx, :len(profile.setpoints)] = profile.setpoints
+            _sweep_profiles[key] = (profiles, setpoints)
+        return _sweep_profiles[key]
+
+# Finds the profile followed by the measured bias voltage, the run may have been stopped before the end of the program
+# (e.g. when the compliance was hit). A profile of the same length as the run is preferred, then the shortest one.
+# Returns None if the run does not follow any of the profiles
+def match_sweep_profile(voltage: numpy.ndarray, profiles_path: Path = None):
+    profiles, setpoints = get_sweep_profiles(profiles_path)
+    num_points = len(voltage)
+    if num_points == 0 or num_points > setpoints.shape[1]:
+        return None
+
+    # The profiles shorter than the run have NaN there, so they never match
+    deviation = numpy.abs(setpoints[:, :num_points] - voltage).max(axis=1)
+    matches = numpy.flatnonzero(deviation <= sweep_profile_tolerance)
+    if len(matches) == 0:
+        return None
+    for idx in matches:
+        if len(profiles[idx].setpoints) == num_points:
+            return profiles[idx]
+    return profiles[matches[0]]
+
+# Computes the derived columns of the run dataframe in place: InverseCSquare for CV runs, and for every point the sweep
+# direction, the segment, whether it is part of a coarse pre-sweep and a label for the segment. If the run follows one
+# of the sweep profiles these come from the profile, and Setpoint is the index of the point in the program, otherwise
+# they are derived from the measured voltages and Setpoint is -1
+def derive_run_columns(df: pandas.DataFrame, run_type: CVIV_Types):
+    if run_type == CVIV_Types.CV and "Capacitance [F]" in df.columns:
+        df["InverseCSquare"] = 1/(df["Capacitance [F]"].to_numpy()**2)
+
+    voltage = df["Bias Voltage [V]"].to_numpy()
+    num_points = len(voltage)
+
+    profile = match_sweep_profile(voltage)
+    if profile is not None:
+        direction = profile.direction[:num_points]
+        segment = profile.segment[:num_points]
+        is_coarse = profile.is_coarse[:num_points]
+        labels = profile.labels[:num_points]
+        setpoint = numpy.arange(num_points, dtype=numpy.int64)
+    else:
+        direction, segment, is_coarse = derive_sweep_segments(voltage)
+        labels = get_segment_labels(direction, is_coarse)
+        setpoint = numpy.full(num_points, -1, dtype=numpy.int64)
+
+    df["Ascending"] = direction > 0
+    df["Descending"] = direction < 0
+    df["Segment"] = segment
+    df["Is Coarse"] = is_coarse
+    df["Setpoint"] = setpoint
+    df["Segment Label"] = labels
+
+    return df
+
+def make_run_dataframe(run_type: CVIV_Types, data: dict[str, numpy.ndarray]):
+    df = pandas.DataFrame(data)
+
+    # The voltages and currents are measured with the opposite sign
+    flip_columns = [col for col in df.columns if col not in ["Capacitance [F]", "Conductivity [S]", "Legend"]]
+    df[flip_columns] = -df[flip_columns].to_numpy()
+
+    return derive_run_columns(df, run_type)
+
+# Builds the run dataframe, as saved by load_df, straight from the measurements in the database. Only the requested
+# columns are read, plus the bias voltage which is always needed. Returns None if the measurements are not stored
+def get_run_dataframe(conn: sqlite3.Connection, run_info: dict, columns: list[str] = None, tableName: str = 'RunData'):
+    if columns is not None and "Bias Voltage [V]" not in columns:
+        columns = columns + ["Bias Voltage [V]"]
+    data = load_run_data(conn, tableName, run_info['RunID'], columns)
+    if data is None:
+        return None
+    return make_run_dataframe(CVIV_Types(run_info['type']), data)
+
+# The run dataframe saved by load_df in the run directory, as parquet with an explicit schema: the measurements as
+# float64 and the flags as bool. Runs processed by older versions only have it as data.csv
+run_dataframe_flags = ["Ascending", "Descending", "Is Coarse"]
+run_dataframe_sweep_columns = ["Segment", "Setpoint", "Segment Label"]
+
+def get_run_dataframe_schema(run_type: CVIV_Types):
+    columns = list(get_data_columns(run_type))
+    if run_type == CVIV_Types.CV:
+        columns += ["InverseCSquare"]
+    return pyarrow.schema([(col, pyarrow.float64()) for col in columns] + [(col, pyarrow.bool_()) for col in run_dataframe_flags] + [("Segment", pyarrow.int64()), ("Setpoint", pyarrow.int64()), ("Segment Label", pyarrow.string())])
+
+def save_run_dataframe(df: pandas.DataFrame, run_type: CVIV_Types, run_path: Path, write_csv: bool = False):
+    table = pyarrow.Table.from_pandas(df, schema=get_run_dataframe_schema(run_type), preserve_index=False)
+    pyarrow.parquet.write_table(table, run_path / "data.parquet", compression="zstd")
+    if write_csv:
+        df.to_csv(run_path / "data.csv", index=False)
+
+def read_run_dataframe(run_path: Path, columns: list[str] = None):
+    # Only the requested columns are read, plus the bias voltage, the flags and the sweep columns which are always needed
+    # and, like in get_run_dataframe, InverseCSquare along with the capacitance. Files saved by older versions do not
+    # have all the sweep columns
+    if columns is not None:
+        if "Capacitance [F]" in columns:
+            columns = columns + ["InverseCSquare"]
+        columns = list(dict.fromkeys(columns + ["Bias Voltage [V]"] + run_dataframe_flags + run_dataframe_sweep_columns))
+    if (run_path / "data.parquet").exists():
+        if columns is not None:
+            available = pyarrow.parquet.read_schema(run_path / "data.parquet").names
+            columns = [col for col in columns if col in available]
+        return pandas.read_parquet(run_path / "data.parquet", columns=columns)
+    if columns is None:
+        return pandas.read_csv(run_path / "data.csv")
+    return pandas.read_csv(run_path / "data.csv", usecols=lambda col: col in columns)
+
+# Version of the CV parameter extraction in extract_parameters.py, bump it whenever the algorithm changes so the
+# parameters extracted by different versions can be told apart in the database
+CV_PARAMETERS_VERSION = 1
+cv_parameters_columns = ["tag1", "tag2", "gainLayerDepletionVoltage", "fullDepletionVoltage"]
+
+def create_cv_parameters_table(conn: sqlite3.Connection, tableName: str, runInfoTable: str, logger: logging.Logger):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:  # If table does not exist
+        # One row per run, data subset (tag1) and algorithm version, the index serves the trend queries over many runs
+        create_table_sql = f"CREATE TABLE `{tableName}` (`RunID` INTEGER NOT NULL, `version` INTEGER NOT NULL, `tag1` TEXT NOT NULL, `tag2` TEXT, `gainLayerDepletionVoltage` REAL, `fullDepletionVoltage` REAL, PRIMARY KEY (`RunID`, `version`, `tag1`), FOREIGN KEY (RunID) REFERENCES `{runInfoTable}` (RunID) ON UPDATE CASCADE);"
+        conn.execute(create_table_sql)
+        conn.execute(f"CREATE INDEX `{tableName}_by_tag` ON `{tableName}` (`version`, `tag1`);")
+    create_cv_parameters_change_stamp(conn, tableName)
+
+def create_cv_parameters_change_stamp(conn: sqlite3.Connection, tableName: str):
+    # Every inserted or updated row is stamped with the next value of a counter, so the exports can find the parameters
+    # changed since the previous one. The rowid can not be used for this, SQLite gives the rowids of the rows deleted by
+    # store_cv_parameters to the rows inserted after them
+    counterTable = f"{tableName}Changes"
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info('{tableName}');")]
+    if "changeID" not in columns:  # Tables created before the stamp, their rows are left unstamped
+        conn.execute(f"ALTER TABLE `{tableName}` ADD COLUMN `changeID` INTEGER;")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS `{tableName}_by_change` ON `{tableName}` (`changeID`);")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS `{counterTable}` (`id` INTEGER PRIMARY KEY CHECK (`id` = 0), `changes` INTEGER NOT NULL);")
+    conn.execute(f"INSERT OR IGNORE INTO `{counterTable}`(`id`,`changes`) VALUES(0, 0);")
+    stamp_sql = f"UPDATE `{counterTable}` SET `changes`=`changes`+1 WHERE `id`=0; UPDATE `{tableName}` SET `changeID`=(SELECT `changes` FROM `{counterTable}` WHERE `id`=0) WHERE `rowid`=NEW.`rowid`;"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS `{tableName}_stamp_insert` AFTER INSERT ON `{tableName}` BEGIN {stamp_sql} END;")
+    value_columns = ",".join([f"`{col}`" for col in ["RunID"] + cv_parameters_columns])
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS `{tableName}_stamp_update` AFTER UPDATE OF {value_columns} ON `{tableName}` BEGIN {stamp_sql} END;")
+
+def store_cv_parameters(conn: sqlite3.Connection, tableName: str, run_id: int, params: pandas.DataFrame, version: int = CV_PARAMETERS_VERSION):
+    conn.execute(f"DELETE FROM `{tableName}` WHERE `RunID`=? AND `version`=?;", [run_id, version])
+    rows = [[run_id, version] + [None if pandas.isna(value) else value for value in row] for row in params[cv_parameters_columns].itertuples(index=False)]
+    column_str = ",".join([f"`{col}`" for col in ["RunID", "version"] + cv_parameters_columns])
+    conn.executemany(f"INSERT INTO `{tableName}`({column_str}) VALUES({','.join(['?']*(len(cv_parameters_columns) + 2))});", rows)
+
+def get_cv_parameters(conn: sqlite3.Connection, tableName: str, runInfoTable: str, run_names: list[str], version: int = CV_PARAMETERS_VERSION):
+    # The parameters of all the runs with a single query, returned as a dataframe with the RunName of each row
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:
+        return pandas.DataFrame(columns=["RunName"] + cv_parameters_columns)
+
+    column_str = ",".join([f"p.`{col}`" for col in cv_parameters_columns])
+    # CROSS JOIN keeps the run info table as the outer loop, so the runs are looked up by name and their parameters by primary key
+    query = f"SELECT r.`RunName`,{column_str} FROM `{runInfoTable}` r CROSS JOIN `{tableName}` p ON p.`RunID` = r.`RunID` WHERE p.`version`=? AND r.`RunName` IN (SELECT value FROM json_each(?)) ORDER BY p.`rowid`;"
+    return pandas.read_sql_query(query, conn, params=[version, json.dumps(list(run_names))])
+
+def create_scan_index_table(conn: sqlite3.Connection, tableName: str, logger: logging.Logger):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{tableName}';")
+    if len(res.fetchall()) == 0:  # If table does not exist
+        create_table_sql = f"CREATE TABLE `{tableName}` (`path` TEXT PRIMARY KEY NOT NULL, `size` INTEGER NOT NULL, `mtime` INTEGER NOT NULL, `inode` INTEGER NOT NULL, `is cviv` INTEGER NOT NULL, `SHA256` TEXT);"
+        conn.execute(create_table_sql)
+
+def load_scan_index(conn: sqlite3.Connection, tableName: str, runInfoTable: str):
+    res = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ('{tableName}', '{runInfoTable}');")
+    if len(res.fetchall()) != 2:
+        return {}
+
+    # CVIV runs are only considered as known if they are still present in the run info table
+    query = f"SELECT s.`path`,s.`size`,s.`mtime`,s.`inode` FROM `{tableName}` s LEFT JOIN `{runInfoTable}` r ON s.`SHA256` = r.`SHA256` WHERE s.`is cviv` = 0 OR r.`RunID` IS NOT NULL;"
+    return {row[0]: (row[1], row[2], row[3]) for row in conn.execute(query)}
+
+def update_scan_index(conn: sqlite3.Connection, tableName: str, scanned_files: dict[str, tuple]):
+    values = []
+    for path, (size, mtime, inode, sha) in scanned_files.items():
+        if sha is None:  # Files with errors are not indexed so they are retried on the next scan
+            continue
+        if sha is False:
+            values += [(path, size, mtime, inode, 0, None)]
+        else:
+            values += [(path, size, mtime, inode, 1, sha)]
+
+    insert_sql = f"INSERT OR REPLACE INTO `{tableName}`(`path`,`size`,`mtime`,`inode`,`is cviv`,`SHA256`) VALUES(?, ?, ?, ?, ?, ?);"
+    conn.executemany(insert_sql, values)
+
 def make_line_plot(
                     data_df: pandas.DataFrame,
                     file_path: Path,
@@ -0,0 +1,273 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from pathlib import Path
+import logging
+import hashlib
+import threading
+import concurrent.futures
+import os
+import pandas
+
+import lip_pps_run_manager as RM
+
+import utilities
+
+def hash_chunks(chunks):
+    # hashlib releases the GIL while hashing large buffers, so several threads can hash in parallel
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    for chunk in chunks:
+        sha256.update(chunk)
+        md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest()
+
+def verify_backup_file(run: dict, backup_path: Path, required: bool = True):
+    store_path = utilities.get_backup_store_path(backup_path, run['SHA256'])
+    legacy_path = backup_path / (run['RunName'] + "." + utilities.get_run_file_extension(utilities.CVIV_Types(run['type'])))
+
+    if store_path.is_file():
+        file_path = store_path
+    elif legacy_path.is_file():
+        file_path = legacy_path
+    elif required:
+        return {'RunID': run['RunID'], 'RunName': run['RunName'], 'location': 'file', 'path': str(store_path), 'status': 'missing'}
+    else:  # The run is only kept in the database (e.g. loaded with --backupMode database)
+        return None
+
+    sha256, md5 = hash_chunks(utilities.iter_file_chunks(file_path))
+    status = 'ok'
+    if sha256 != run['SHA256'] or md5 != run['MD5']:
+        status = 'mismatch'
+    return {'RunID': run['RunID'], 'RunName': run['RunName'], 'location': 'file', 'path': str(file_path), 'status': status}
+
+def verify_backup_blob(run: dict, get_connection, tableName: str):
+    sha256, md5 = hash_chunks(utilities.iter_backup_blob(get_connection(), tableName, run['RunID'], run['Codec']))
+    status = 'ok'
+    if sha256 != run['SHA256'] or md5 != run['MD5']:
+        status = 'mismatch'
+    return {'RunID': run['RunID'], 'RunName': run['RunName'], 'location': 'database', 'path': None, 'status': status}
+
+def restore_backup_file(run: dict, get_connection, tableName: str, backup_path: Path):
+    store_path = utilities.get_backup_store_path(backup_path, run['SHA256'])
+    if store_path.is_file():  # A corrupted copy, unlinking it does not touch the original file if it is a hardlink
+        store_path.unlink()
+    utilities.restore_from_backup_blob(get_connection(), tableName, run['RunID'], backup_path, run['SHA256'])
+    return {'RunID': run['RunID'], 'RunName': run['RunName'], 'location': 'file', 'path': str(store_path), 'status': 'restored'}
+
+def verify_backups_task(
+                        Maeve: RM.RunManager,
+                        db_path: Path,
+                        backup_path: Path,
+                        logger: logging.Logger,
+                        workers: int = None,
+                        restore: bool = False,
+                        ):
+    if workers is None or workers < 1:
+        workers = os.cpu_count()
+
+    with Maeve.handle_task("verify_backups", drop_old_data=True) as Teddy:
+        runInfoTable = 'RunInfo'
+        runBackupTable = 'runBackup'
+
+        with utilities.get_db_connection(db_path) as sql_conn:
+            utilities.enable_foreign_keys(sql_conn)
+
+            if utilities.is_legacy_run_backup_table(sql_conn, runBackupTable):
+                # The old layout keeps every run, uncompressed, in the database
+                blob_query = f"SELECT b.`RunID`,NULL,r.`RunID`,1 FROM `{runBackupTable}` b LEFT JOIN `{runInfoTable}` r ON b.`RunID` = r.`RunID`;"
+            else:
+                blob_query = f"SELECT b.`RunID`,b.`Codec`,r.`RunID`,b.`SHA256` = r.`SHA256` FROM `{runBackupTable}` b LEFT JOIN `{runInfoTable}` r ON b.`RunID` = r.`RunID` WHERE b.`Data` IS NOT NULL;"
+
+            runs = {}
+            for run_id, run_name, run_type, sha256, md5 in sql_conn.execute(f"SELECT `RunID`,`RunName`,`type`,`SHA256`,`MD5` FROM `{runInfoTable}`;"):
+                runs[run_id] = {'RunID': run_id, 'RunName': run_name, 'type': run_type, 'SHA256': sha256, 'MD5': md5, 'Codec': None}
+
+            report = []
+            blob_runs = []
+            for run_id, codec, info_run_id, matches in sql_conn.execute(blob_query).fetchall():
+                if info_run_id is None:
+                    report += [{'RunID': run_id, 'RunName': None, 'location': 'database', 'path': None, 'status': 'orphan'}]
+                elif matches == 0:
+                    report += [{'RunID': run_id, 'RunName': runs[run_id]['RunName'], 'location': 'database', 'path': None, 'status': 'wrong hash reference'}]
+                else:
+                    runs[run_id]['Codec'] = codec
+                    blob_runs += [runs[run_id]]
+
+        # Every thread reads the BLOBs through its own connection, sqlite connections can not be shared between threads
+        local = threading.local()
+        connections = []
+        connections_lock = threading.Lock()
+        def get_connection():
+            if not hasattr(local, 'conn'):
+                local.conn = utilities.open_db_connection(db_path, check_same_thread=False)  # Only closed by the main thread
+                with connections_lock:
+                    connections.append(local.conn)
+            return local.conn
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                # A backup file is only expected for the runs without a copy in the database, the others are checked if they have one
+                blob_run_ids = set(run['RunID'] for run in blob_runs)
+                futures = [executor.submit(verify_backup_file, run, backup_path, run['RunID'] not in blob_run_ids) for run in runs.values()]
+                futures += [executor.submit(verify_backup_blob, run, get_connection, runBackupTable) for run in blob_runs]
+                results = [result for result in (future.result() for future in futures) if result is not None]
+                report += results
+
+                if restore:
+                    # Bulk restore the missing or corrupted backup files, but only from BLOBs which were just verified
+                    good_blobs = set(result['RunID'] for result in results if result['location'] == 'database' and result['status'] == 'ok')
+                    to_restore = [runs[result['RunID']] for result in results if result['location'] == 'file' and result['status'] != 'ok' and result['RunID'] in good_blobs]
+                    futures = [executor.submit(restore_backup_file, run, get_connection, runBackupTable, backup_path) for run in to_restore]
+                    report += [future.result() for future in futures]
+        finally:
+            for conn in connections:
+                conn.close()
+
+        # Files in the backup store which do not belong to any run
+        known_hashes = set(run['SHA256'] for run in runs.values())
+        store_path = backup_path / "store"
+        if store_path.is_dir():
+            for entry in utilities.walk_input_files(store_path, exclude=["*.tmp"]):
+                if entry.name not in known_hashes:
+                    report += [{'RunID': None, 'RunName': None, 'location': 'file', 'path': entry.path, 'status': 'orphan'}]
+
+        report_df = pandas.DataFrame(report, columns=['RunID', 'RunName', 'location', 'path', 'status'])
+        report_df['RunID'] = report_df['RunID'].astype('Int64')
+        report_df.to_csv(Teddy.task_path / "verify_report.csv", index=False)
+
+        summary = report_df.groupby(['location', 'status']).size()
+        for (location, status), count in summary.items():
+            if status == 'ok' or status == 'restored':
+                logger.info(f"{count} {location} backups {status}")
+            else:
+                logger.warning(f"{count} {location} backups {status}, see the report in {Teddy.task_path}")
+
+        return report_df
+
+def script_main(
+                db_path: Path,
+                backup_path: Path,
+                workers: int = None,
+                restore: bool = False,
+                ):
+    logger = logging.getLogger('verify_backups')
+
+    run_path = db_path.parent / "VerifyBackups"
+
+    with RM.RunManager(run_path.resolve()) as Maeve:
+        Maeve.create_run(raise_error=False)
+
+        verify_backups_task(Maeve, db_path, backup_path, logger, workers=workers, restore=restore)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='verify_backups.py',
+                    description='This script checks that the backup files and the copies of the run files kept in the database still match the hashes recorded for each run',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-d',
+        '--dbPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the database directory, where the run database is placed. Default: ./data',
+        default = "./data",
+        dest = 'db_path',
+    )
+    parser.add_argument(
+        '-b',
+        '--backupPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the data backup directory. If not set, a sub-directory in the database directory is assumed.',
+        #required = True,
+        dest = 'backup_path',
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        metavar = 'N',
+        type = int,
+        help = 'Number of threads used to hash the backups. Default: one per CPU core',
+        dest = 'workers',
+    )
+    parser.add_argument(
+        '--restore',
+        action = 'store_true',
+        help = 'Recreate the corrupted backup files from the copies kept in the database, if these are intact',
+        dest = 'restore',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    db_path: Path = args.db_path
+    if not db_path.exists():
+        raise RuntimeError("The database path does not exist")
+    db_path = db_path.absolute()
+    db_path = db_path / "run_db.sqlite"
+    if not db_path.exists() or not db_path.is_file():
+        raise RuntimeError("The database file does not exist")
+
+    backup_path: Path = args.backup_path
+    # If the backup path is not set:
+    if backup_path is None:
+        backup_path = db_path.parent / 'backup'
+    backup_path = backup_path.absolute()
+
+    script_main(db_path, backup_path, args.workers, args.restore)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+#############################################################################
+# zlib License
+#
+# (C) 2023 Cristóvão Beirão da Cruz e Silva <cbeiraod@cern.ch>
+#
+# This software is provided 'as-is', without any express or implied
+# warranty.  In no event will the authors be held liable for any damages
+# arising from the use of this software.
+#
+# Permission is granted to anyone to use this software for any purpose,
+# including commercial applications, and to alter it and redistribute it
+# freely, subject to the following restrictions:
+#
+# 1. The origin of this software must not be misrepresented; you must not
+#    claim that you wrote the original software. If you use this software
+#    in a product, an acknowledgment in the product documentation would be
+#    appreciated but is not required.
+# 2. Altered source versions must be plainly marked as such, and must not be
+#    misrepresented as being the original software.
+# 3. This notice may not be removed or altered from any source distribution.
+#############################################################################
+
+from pathlib import Path
+import logging
+import sqlite3
+import time
+import concurrent.futures
+
+import utilities
+
+from load_runs import ingest_runs
+from process_all_runs import process_run
+
+# Takes a stat-only snapshot of the input directory, no file is opened
+def take_snapshot(
+                  input_path: Path,
+                  max_depth: int = None,
+                  include: list[str] = None,
+                  exclude: list[str] = None,
+                  recursive: bool = False,
+                 ):
+    snapshot = {}
+    for entry in utilities.walk_run_files(input_path, recursive=recursive, max_depth=max_depth, include=include, exclude=exclude):
+        try:
+            file_stat = entry.stat()
+        except OSError:  # The file was removed in the meantime
+            continue
+        snapshot[str(Path(entry.path))] = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+    return snapshot
+
+# Loads a single file into the database, in its own transaction so a problematic file does not block the others.
+# Returns the list of new runs, as returned by ingest_runs
+def ingest_file(
+                sql_conn: sqlite3.Connection,
+                file_path: Path,
+                file_key: tuple,
+                backup_path: Path,
+                logger: logging.Logger,
+                backup_mode: str = "store",
+                blob_codec: str = "zlib",
+                ):
+    # Archives may hold several runs, plain files at most one
+    file_path, file_results = utilities.scan_input_file(file_path, logger.name)
+    run_list = []
+    status = False
+    for file, metadata, error in file_results:
+        if error is not None:
+            raise RuntimeError(f'Unable to process the file {file}: {error}')
+        if metadata is None:
+            continue
+        if file == file_path:
+            status = metadata['SHA256']
+        run_list += [metadata]
+    run_list = sorted(run_list, key=lambda d: (d['start'], d['path']))
+
+    if utilities.get_db_writer() is not None:  # The single writer applies it within a transaction of its own
+        return utilities.write_db(sql_conn, write_file_runs, file_path, file_key, status, run_list, backup_path, logger, backup_mode, blob_codec)
+
+    res = sql_conn.execute("BEGIN TRANSACTION;")
+    try:
+        new_runs = write_file_runs(sql_conn, file_path, file_key, status, run_list, backup_path, logger, backup_mode, blob_codec)
+    except:
+        res = sql_conn.execute("ROLLBACK TRANSACTION;")
+        raise
+    else:
+        res = sql_conn.execute("COMMIT TRANSACTION;")
+
+    return new_runs
+
+def write_file_runs(
+                    sql_conn: sqlite3.Connection,
+                    file_path: Path,
+                    file_key: tuple,
+                    status,
+                    run_list: list[dict],
+                    backup_path: Path,
+                    logger: logging.Logger,
+                    backup_mode: str = "store",
+                    blob_codec: str = "zlib",
+                    ):
+    runInfoTable = 'RunInfo'
+    scanIndexTable = 'ScanIndex'
+
+    new_runs = []
+    utilities.create_scan_index_table(sql_conn, scanIndexTable, logger)
+    if len(run_list) > 0:
+        columns = []
+        for metadata in run_list:
+            columns += [key for key in metadata if key not in columns]
+        utilities.create_run_info_table(sql_conn, runInfoTable, columns, logger)
+        utilities.create_run_backup_table(sql_conn, 'runBackup', runInfoTable, logger)
+        utilities.create_run_data_table(sql_conn, 'RunData', runInfoTable, logger)
+
+        new_runs = ingest_runs(sql_conn, runInfoTable, 'runBackup', run_list, backup_path, logger, backup_mode=backup_mode, blob_codec=blob_codec)
+
+    utilities.update_scan_index(sql_conn, scanIndexTable, {str(file_path): file_key + (status, )})
+    return new_runs
+
+def script_main(
+                data_path: Path,
+                backup_path: Path,
+                input_path: Path,
+                output_path: Path,
+                interval: float = 2,
+                max_depth: int = None,
+                include: list[str] = None,
+                exclude: list[str] = None,
+                backup_mode: str = "store",
+                blob_codec: str = "zlib",
+                font_size: int = 18,
+                once: bool = False,
+                workers: int = 1,
+                recursive: bool = False,
+                ):
+    logger = logging.getLogger('watch_runs')
+
+    db_path = data_path / 'run_db.sqlite'
+    if workers is None or workers <= 1:
+        watch(db_path, backup_path, input_path, output_path, logger, interval, max_depth, include, exclude, backup_mode, blob_codec, font_size, once, recursive=recursive)
+        return
+
+    # The new runs are processed in parallel while the watch goes on, with all the database writes, including the
+    # loading of the new runs, going through a single writer process
+    with utilities.DBWriter(db_path) as writer:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=utilities.set_db_writer, initargs=(writer,)) as executor:
+            utilities.set_db_writer(writer)
+            try:
+                watch(db_path, backup_path, input_path, output_path, logger, interval, max_depth, include, exclude, backup_mode, blob_codec, font_size, once, executor, recursive=recursive)
+            finally:
+                utilities.set_db_writer(None)
+
+def watch(
+          db_path: Path,
+          backup_path: Path,
+          input_path: Path,
+          output_path: Path,
+          logger: logging.Logger,
+          interval: float,
+          max_depth: int,
+          include: list[str],
+          exclude: list[str],
+          backup_mode: str,
+          blob_codec: str,
+          font_size: int,
+          once: bool,
+          executor: concurrent.futures.Executor = None,
+          recursive: bool = False,
+          ):
+    pending = {}
+    def check_pending(wait: bool = False):
+        done = list(pending.keys())
+        if not wait:
+            done = [future for future in done if future.done()]
+        for future in done:
+            run_name = pending.pop(future)
+            try:
+                future.result()
+            except Exception as error:
+                logger.error(f'Unable to process run {run_name}: {type(error).__name__}: {error}')
+
+    with utilities.get_db_connection(db_path) as sql_conn:
+        utilities.enable_foreign_keys(sql_conn)
+
+        # Files already known from previous loads (with load_runs or a previous watch) are the starting snapshot
+        snapshot = utilities.load_scan_index(sql_conn, 'ScanIndex', 'RunInfo')
+        logger.info(f"Watching {input_path} for new runs, {len(snapshot)} files already known")
+
+        while True:
+            poll_start = time.monotonic()
+            current = take_snapshot(input_path, max_depth=max_depth, include=include, exclude=exclude, recursive=recursive)
+
+            changed = [path for path, file_key in current.items() if snapshot.get(path) != file_key]
+            for path in changed:
+                file_path = Path(path)
+                file_key = current[path]
+                try:
+                    if file_path.suffix in [".iv", ".cv", ".txt"] and not utilities.has_end_marker(file_path):
+                        # Still being written, it is looked at again once its size or modification time change
+                        logger.debug(f"The file {file_path} is not complete yet")
+                        snapshot[path] = file_key
+                        continue
+                    new_runs = ingest_file(sql_conn, file_path, file_key, backup_path, logger, backup_mode=backup_mode, blob_codec=blob_codec)
+                except Exception as error:
+                    # The file is only retried once it changes, so a bad file does not flood the log
+                    logger.error(f'Unable to load the file {file_path}: {type(error).__name__}: {error}')
+                    snapshot[path] = file_key
+                    continue
+                snapshot[path] = file_key
+
+                for run_id, run_name, runInfo in new_runs:
+                    logger.info(f"Processing new run {run_name} from {file_path}")
+                    if executor is not None:
+                        pending[executor.submit(process_run, db_path, backup_path, output_path, run_name, False, font_size)] = run_name
+                        continue
+                    try:
+                        process_run(db_path, backup_path, output_path, run_name, font_size=font_size)
+                    except Exception as error:
+                        logger.error(f'Unable to process run {run_name}: {type(error).__name__}: {error}')
+            check_pending()
+
+            # Forget removed files, so they are picked up again if they come back
+            for path in [path for path in snapshot if path not in current]:
+                del snapshot[path]
+
+            if once:
+                check_pending(wait=True)
+                break
+            time.sleep(max(0, interval - (time.monotonic() - poll_start)))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                    prog='watch_runs.py',
+                    description='This script watches the input directory, loading new runs into the run database as soon as they are complete and processing them in order to create the basic plots',
+                    #epilog='Text at the bottom of help'
+                    )
+
+    parser.add_argument(
+        '-d',
+        '--dataPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the data directory, where the run database is placed. Default: ./data',
+        default = "./data",
+        dest = 'data_path',
+    )
+    parser.add_argument(
+        '-b',
+        '--backupPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the data backup directory. If not set, a sub-directory will be created in the data directory.',
+        #required = True,
+        dest = 'backup_path',
+    )
+    parser.add_argument(
+        '-i',
+        '--inputPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the data input directory.',
+        required = True,
+        dest = 'input_path',
+    )
+    parser.add_argument(
+        '-o',
+        '--outputPath',
+        metavar = 'PATH',
+        type = Path,
+        help = 'Path to the output directory where to store the run directories with the output.',
+        required = True,
+        dest = 'output_path',
+    )
+    parser.add_argument(
+        '-t',
+        '--interval',
+        metavar = 'SECONDS',
+        type = float,
+        help = 'Time between consecutive polls of the input directory. Default: 2',
+        default = 2,
+        dest = 'interval',
+    )
+    parser.add_argument(
+        '--once',
+        action = 'store_true',
+        help = 'Poll the input directory a single time and exit',
+        dest = 'once',
+    )
+    parser.add_argument(
+        '-j',
+        '--workers',
+        metavar = 'N',
+        type = int,
+        help = 'Number of new runs to process in parallel, the database writes then go through a single writer process. Default: 1',
+        default = 1,
+        dest = 'workers',
+    )
+    parser.add_argument(
+        '--backupMode',
+        type = str,
+        help = 'Where to keep the backup of the raw run files: in the content-addressed backup store in the backup directory (hardlinked to the original where possible), as a BLOB in the database or both. Default: store',
+        choices = ["store", "database", "both"],
+        default = "store",
+        dest = 'backup_mode',
+    )
+    parser.add_argument(
+        '--blobCodec',
+        type = str,
+        help = 'Compression to use for the run files kept in the database. Default: zlib',
+        choices = utilities.BLOB_CODECS,
+        default = "zlib",
+        dest = 'blob_codec',
+    )
+    parser.add_argument(
+        '--maxDepth',
+        metavar = 'DEPTH',
+        type = int,
+        help = 'Maximum number of directory levels to descend into below the input directory, implies --recursive. Default: no limit',
+        dest = 'max_depth',
+    )
+    parser.add_argument(
+        '--recursive',
+        help = 'Search the whole input directory tree for runs, including the files directly in the input directory. By default only the files in the sub-directories of the input directory are considered',
+        action = 'store_true',
+        dest = 'recursive',
+    )
+    parser.add_argument(
+        '--include',
+        metavar = 'GLOB',
+        type = str,
+        nargs = '+',
+        help = 'Only consider files matching one of these patterns. Patterns with a "/" are matched against the path relative to the input directory, otherwise against the file name',
+        dest = 'include',
+    )
+    parser.add_argument(
+        '--exclude',
+        metavar = 'GLOB',
+        type = str,
+        nargs = '+',
+        help = 'Skip files and directories matching one of these patterns. Patterns with a "/" are matched against the path relative to the input directory, otherwise against the name',
+        dest = 'exclude',
+    )
+    parser.add_argument(
+        '-f',
+        '--fontSize',
+        metavar = 'SIZE',
+        type = int,
+        help = 'Font size to use in the plots. Default: 18',
+        default = 18,
+        dest = 'font_size',
+    )
+    parser.add_argument(
+        '-l',
+        '--log-level',
+        help = 'Set the logging level. Default: WARNING',
+        choices = ["CRITICAL","ERROR","WARNING","INFO","DEBUG","NOTSET"],
+        default = "WARNING",
+        dest = 'log_level',
+    )
+    parser.add_argument(
+        '--log-file',
+        help = 'If set, the full log will be saved to a file (i.e. the log level is ignored)',
+        action = 'store_true',
+        dest = 'log_file',
+    )
+
+    args = parser.parse_args()
+
+    if args.log_file:
+        logging.basicConfig(filename='logging.log', filemode='w', encoding='utf-8', level=logging.NOTSET)
+    else:
+        if args.log_level == "CRITICAL":
+            logging.basicConfig(level=50)
+        elif args.log_level == "ERROR":
+            logging.basicConfig(level=40)
+        elif args.log_level == "WARNING":
+            logging.basicConfig(level=30)
+        elif args.log_level == "INFO":
+            logging.basicConfig(level=20)
+        elif args.log_level == "DEBUG":
+            logging.basicConfig(level=10)
+        elif args.log_level == "NOTSET":
+            logging.basicConfig(level=0)
+
+    data_path: Path = args.data_path
+    if not data_path.exists():
+        data_path.mkdir()
+    data_path = data_path.absolute()
+
+    backup_path: Path = args.backup_path
+    # If the backup path is not set:
+    if backup_path is None:
+        backup_path = data_path / 'backup'
+    if not backup_path.exists():
+        backup_path.mkdir()
+    backup_path = backup_path.absolute()
+
+    input_path: Path = args.input_path
+    if not input_path.exists() or not input_path.is_dir():
+        logging.error("You must define a valid data input path")
+        exit(1)
+    input_path = input_path.absolute()
+
+    output_path: Path = args.output_path
+    if not output_path.exists() or not output_path.is_dir():
+        logging.error("You must define a valid data output path")
+        exit(1)
+    output_path = output_path.absolute()
+
+    try:
+        script_main(
+                    data_path,
+                    backup_path,
+                    input_path,
+                    output_path,
+                    interval = args.interval,
+                    max_depth = args.max_depth,
+                    include = args.include,
+                    exclude = args.exclude,
+                    backup_mode = args.backup_mode,
+                    blob_codec = args.blob_codec,
+                    font_size = args.font_size,
+                    once = args.once,
+                    workers = args.workers,
+                    recursive = args.recursive or args.max_depth is not None,
+                   )
+    except KeyboardInterrupt:
+        logging.getLogger('watch_runs').info("Stopped watching")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import utilities
+
+
+# The backup BLOBs are written and read incrementally where blobopen is available, and with plain queries otherwise
+@pytest.mark.parametrize("blobopen", [True, False])
+@pytest.mark.parametrize("codec", utilities.BLOB_CODECS)
+def test_backup_blob_round_trip(monkeypatch, blobopen, codec):
+    if blobopen and not hasattr(sqlite3.Connection, "blobopen"):
+        pytest.skip("blobopen needs Python 3.11")
+    monkeypatch.setattr(utilities, "_blobopen_supported", blobopen)
+    monkeypatch.setattr(utilities, "BLOB_CHUNK_SIZE", 1000)  # So the content spans several chunks
+
+    conn = sqlite3.connect(":memory:")
+    utilities.create_run_backup_table(conn, "runBackup", "RunInfo", logging.getLogger("test_backup_blob"))
+    conn.execute("INSERT INTO `runBackup`(`RunID`,`SHA256`) VALUES(1, 'sha');")
+    content = b"".join(f"line {idx}\n".encode() for idx in range(1000))
+
+    utilities.write_backup_blob(conn, "runBackup", 1, [content[:3000], content[3000:]], codec)
+
+    assert utilities.get_backup_blob_codec(conn, "runBackup", 1) == (True, None if codec == "none" else codec)
+    assert b"".join(utilities.iter_backup_blob(conn, "runBackup", 1, None if codec == "none" else codec)) == content
+    assert utilities.read_backup_blob(conn, "runBackup", 1) == content
+    assert utilities.read_backup_blob(conn, "runBackup", 1, 2500, 4200) == content[2500:4200]
+    assert utilities.read_backup_blob(conn, "runBackup", 1, 7000) == content[7000:]
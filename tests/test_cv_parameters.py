@@ -0,0 +1,44 @@
+import logging
+import sys
+from pathlib import Path
+
+import pandas
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import benchmark_run_db
+import utilities
+from test_run_selection import make_run_db
+
+
+def make_parameters(values: dict[str, float]):
+    return pandas.DataFrame({
+        "tag1": list(values.keys()),
+        "tag2": [None]*len(values),
+        "gainLayerDepletionVoltage": [25.0]*len(values),
+        "fullDepletionVoltage": list(values.values()),
+    })
+
+
+def get_parameters(conn, version: int = utilities.CV_PARAMETERS_VERSION):
+    params = utilities.get_cv_parameters(conn, "CVParameters", "RunInfo", ["CVIV-Run0000", "CVIV-Run0001"], version)
+    return sorted(zip(params["RunName"], params["tag1"], params["fullDepletionVoltage"]))
+
+
+# Extracting the parameters of a run again replaces all of its previous parameters of the same version
+def test_store_cv_parameters_reextraction():
+    conn = make_run_db(benchmark_run_db.make_synthetic_runs(2))
+    utilities.create_cv_parameters_table(conn, "CVParameters", "RunInfo", logging.getLogger("test_cv_parameters"))
+
+    assert get_parameters(conn) == []
+    utilities.store_cv_parameters(conn, "CVParameters", 1, make_parameters({"all": 3.0, "fine up": 4.0}))
+    utilities.store_cv_parameters(conn, "CVParameters", 2, make_parameters({"all": 5.0}))
+    utilities.store_cv_parameters(conn, "CVParameters", 1, make_parameters({"all": 4.0}), version=0)
+    first_changes = dict(conn.execute("SELECT `tag1`,`changeID` FROM `CVParameters` WHERE `RunID`=1 AND `version`=1;").fetchall())
+
+    utilities.store_cv_parameters(conn, "CVParameters", 1, make_parameters({"all": 30.0}))
+
+    assert get_parameters(conn) == [("CVIV-Run0000", "all", 30.0), ("CVIV-Run0001", "all", 5.0)]
+    assert get_parameters(conn, version=0) == [("CVIV-Run0000", "all", 4.0)]
+    new_change = conn.execute("SELECT `changeID` FROM `CVParameters` WHERE `RunID`=1 AND `version`=1;").fetchall()
+    assert new_change[0][0] > max(first_changes.values())
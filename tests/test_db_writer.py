@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import utilities
+
+
+def create_table(conn):
+    conn.execute("CREATE TABLE `Test`(`value` INTEGER NOT NULL);")
+
+
+def insert_value(conn, value):
+    conn.execute("INSERT INTO `Test`(`value`) VALUES(?);", [value])
+    return value
+
+
+def call_argument(conn, func):
+    return func()
+
+
+# A write that can not be pickled has to fail in the caller instead of waiting forever for a reply
+def test_unpicklable_write_raises(tmp_path):
+    writer = utilities.DBWriter(tmp_path / "run_db.sqlite").start()
+    try:
+        writer.execute(create_table)
+        with pytest.raises(Exception):
+            writer.execute(call_argument, lambda: 1)
+        assert writer.execute(insert_value, 1) == 1
+    finally:
+        writer.stop()
+
+
+# A failed write reported to the caller must not be reported again when stopping the writer
+def test_reported_write_error_not_raised_on_stop(tmp_path):
+    writer = utilities.DBWriter(tmp_path / "run_db.sqlite").start()
+    writer.execute(create_table)
+    with pytest.raises(RuntimeError, match="NOT NULL"):
+        writer.execute(insert_value, None)
+    writer.stop()
+
+
+def test_dead_writer_raises(tmp_path):
+    writer = utilities.DBWriter(tmp_path / "missing" / "run_db.sqlite").start()
+    with pytest.raises(RuntimeError, match="no longer running"):
+        writer.execute(insert_value, 1, poll_interval=0.1)
+    with pytest.raises(RuntimeError, match="exited with code"):
+        writer.stop()
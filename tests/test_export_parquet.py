@@ -0,0 +1,52 @@
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+import pandas
+import pyarrow.dataset
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import benchmark_run_db
+import export_parquet
+import utilities
+
+
+def make_parameters(full_depletion: list[float]):
+    return pandas.DataFrame({
+        "tag1": [f"segment {idx}" for idx in range(len(full_depletion))],
+        "tag2": [None]*len(full_depletion),
+        "gainLayerDepletionVoltage": [25.0]*len(full_depletion),
+        "fullDepletionVoltage": full_depletion,
+    })
+
+
+def read_latest_parameters(parameters_path: Path):
+    table = pyarrow.dataset.dataset(parameters_path, format="parquet", partitioning="hive").to_table().to_pandas()
+    latest = table.sort_values("exportPass").groupby(["RunID", "version", "tag1"]).tail(1)
+    return sorted(latest["fullDepletionVoltage"])
+
+
+# Parameters extracted again replace the rows of the previous extraction, the next export has to pick them up
+def test_export_reextracted_parameters(tmp_path):
+    db_path = tmp_path / "run_db.sqlite"
+    output_path = tmp_path / "export"
+    logger = logging.getLogger("test_export_parquet")
+    with sqlite3.connect(db_path) as conn:
+        runs = benchmark_run_db.make_synthetic_runs(1)
+        columns = [col for col in runs[0].keys() if col != "RunName"]
+        utilities.create_run_info_table(conn, "RunInfo", columns, logger)
+        values = [runs[0]["RunName"]] + utilities.convert_run_info_values(runs, columns)[0]
+        conn.execute(f"INSERT INTO `RunInfo`(`RunName`,{','.join([f'`{col}`' for col in columns])}) VALUES({','.join(['?']*len(values))});", values)
+        utilities.create_cv_parameters_table(conn, "CVParameters", "RunInfo", logger)
+        utilities.store_cv_parameters(conn, "CVParameters", 1, make_parameters([3.0, 4.0]))
+
+    export_parquet.script_main(db_path, output_path)
+    assert read_latest_parameters(output_path / "cv_parameters") == [3.0, 4.0]
+
+    with sqlite3.connect(db_path) as conn:
+        utilities.store_cv_parameters(conn, "CVParameters", 1, make_parameters([30.0, 40.0]))
+
+    export_parquet.script_main(db_path, output_path)
+    assert read_latest_parameters(output_path / "cv_parameters") == [30.0, 40.0]
@@ -0,0 +1,101 @@
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import load_runs
+import utilities
+
+
+def make_cv_run(start: str, sample_comment: list[str]):
+    header = [
+        "CV measurement",
+        ":Program Version", "1.2",
+        ":start", start,
+        ":stop", start,
+        ":elapsed[s]", "60",
+        ":tester", "tester",
+        ":temperature[C]", "-20",
+        ":Instruments",
+        "V source: Keithley 2410",
+        "integration time [ms]: 20",
+        "averaging: 5",
+        "compliance [A]: 1e-05",
+        "LCR meter: Agilent E4980A",
+        "frequency [Hz] 1000",
+        "signal level [mV] 100",
+        "averaging: 4",
+        ":step mode", "linear",
+        ":set voltage start [V], voltage stop [V], number of steps", "0, 2, 3",
+        ":Sample", "FBK-0",
+        ":Sample_comment",
+    ] + sample_comment + [
+        ":Irradiation(Location,Fluence/Dose,Units,Particle,Date)", "none",
+        "BEGIN",
+        "-0.0005\t1.0e-10\t1.0e-13\t-0.0005\t-1.0e-09",
+        "-1.0005\t9.0e-11\t9.0e-14\t-1.0005\t-2.0e-09",
+        "-2.0005\t8.0e-11\t8.0e-14\t-2.0005\t-3.0e-09",
+        "END",
+    ]
+    return "\n".join(header) + "\n"
+
+
+# A run whose Sample_comment does not say whether the sample is irradiated has to load on a fresh database
+def test_load_run_without_irradiation_comment(tmp_path):
+    input_path = tmp_path / "input"
+    data_path = tmp_path / "data"
+    (input_path / "day0").mkdir(parents=True)
+    data_path.mkdir()
+    (input_path / "day0" / "run_0.cv").write_text(make_cv_run("01/09/2023 10:00:00", ["pixel 1 0"]))
+    (input_path / "day0" / "run_1.cv").write_text(make_cv_run("01/09/2023 11:00:00", ["pixel 1 1", "PPS pre-irrad"]))
+
+    load_runs.script_main(data_path / "Load_Runs", data_path, data_path / "backup", input_path, workers=1)
+
+    with sqlite3.connect(data_path / "run_db.sqlite") as conn:
+        rows = conn.execute("SELECT `name`,`irradiation flux [p/cm^2]`,`irradiated` FROM `RunInfo` ORDER BY `RunID`;").fetchall()
+    assert rows == [("run_0.cv", None, None), ("run_1.cv", 0.0, 0)]
+
+
+# The new runs are inserted together, each has to get its own run name, RunID and backup row, and loading the same
+# runs again must not add anything
+def test_load_runs_batch(tmp_path):
+    input_path = tmp_path / "input"
+    data_path = tmp_path / "data"
+    (input_path / "day0").mkdir(parents=True)
+    (input_path / "day1").mkdir(parents=True)
+    data_path.mkdir()
+    for idx in range(3):
+        (input_path / "day0" / f"run_{idx}.cv").write_text(make_cv_run(f"01/09/2023 1{idx}:00:00", [f"pixel 1 {idx}"]))
+    load_runs.script_main(data_path / "Load_Runs", data_path, data_path / "backup", input_path, workers=1)
+
+    (input_path / "day1" / "run_3.cv").write_text(make_cv_run("02/09/2023 10:00:00", ["pixel 2 0"]))
+    load_runs.script_main(data_path / "Load_Runs", data_path, data_path / "backup", input_path, workers=1)
+
+    with sqlite3.connect(data_path / "run_db.sqlite") as conn:
+        runs = conn.execute("SELECT r.`RunID`,r.`RunName`,r.`name`,r.`pixel col`,b.`SHA256` = r.`SHA256` FROM `RunInfo` r JOIN `runBackup` b ON b.`RunID` = r.`RunID` ORDER BY r.`RunID`;").fetchall()
+    assert runs == [
+        (1, "CVIV-Run0000", "run_0.cv", 0, 1),
+        (2, "CVIV-Run0001", "run_1.cv", 1, 1),
+        (3, "CVIV-Run0002", "run_2.cv", 2, 1),
+        (4, "CVIV-Run0003", "run_3.cv", 0, 1),
+    ]
+
+
+# Two runs of a batch with the same file name but a different content can not both be loaded
+def test_load_runs_name_collision(tmp_path):
+    sql_conn = sqlite3.connect(":memory:")
+    logger = logging.getLogger("test_load_runs")
+    utilities.create_run_info_table(sql_conn, "RunInfo", list(utilities.run_info_schema.keys()), logger)
+    utilities.create_run_backup_table(sql_conn, "runBackup", "RunInfo", logger)
+    run_list = []
+    for idx in range(2):
+        (tmp_path / f"day{idx}").mkdir()
+        file_path = tmp_path / f"day{idx}" / "run.cv"
+        file_path.write_text(make_cv_run(f"01/09/2023 1{idx}:00:00", ["pixel 1 0"]))
+        run_list += [utilities.get_cviv_metadata(file_path, logger)]
+    with pytest.raises(RuntimeError, match="matching measurement name"):
+        load_runs.ingest_runs(sql_conn, "RunInfo", "runBackup", run_list, tmp_path / "backup", logger)
@@ -0,0 +1,36 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import migrate_backup
+import utilities
+from test_verify_backups import load_test_runs
+
+
+def test_migrate_fresh_database(tmp_path):
+    db_path = tmp_path / "run_db.sqlite"
+    sqlite3.connect(db_path).close()
+
+    migrate_backup.script_main(db_path, tmp_path / "backup")
+
+    with sqlite3.connect(db_path) as conn:
+        assert not utilities.is_legacy_run_backup_table(conn, "runBackup")
+        assert conn.execute("SELECT COUNT(*) FROM `runBackup`;").fetchall()[0][0] == 0
+
+
+# A BLOB which does not belong to any run is moved to the backup store and its row removed
+def test_migrate_orphaned_backup(tmp_path):
+    db_path, backup_path = load_test_runs(tmp_path, "database")
+    with sqlite3.connect(db_path) as conn:
+        orphan_id, orphan_sha256 = conn.execute("SELECT `RunID`,`SHA256` FROM `RunInfo` ORDER BY `RunID` LIMIT 1;").fetchall()[0]
+        conn.execute("DELETE FROM `RunInfo` WHERE `RunID`=?;", [orphan_id])
+
+    migrate_backup.script_main(db_path, backup_path)
+
+    with sqlite3.connect(db_path) as conn:
+        backups = conn.execute("SELECT `RunID`,`Data` IS NULL FROM `runBackup` ORDER BY `RunID`;").fetchall()
+    assert orphan_id not in [run_id for run_id, _ in backups]
+    assert all(moved for _, moved in backups)
+    assert utilities.get_backup_store_path(backup_path, orphan_sha256).is_file()
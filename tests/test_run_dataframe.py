@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import numpy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import utilities
+
+
+def make_cv_data(voltage: list[float]):
+    num_points = len(voltage)
+    return {
+        "Voltage [V]": -numpy.array(voltage, dtype=float),
+        "Capacitance [F]": numpy.linspace(2e-10, 1e-10, num_points),
+        "Conductivity [S]": numpy.full(num_points, 1e-9),
+        "Bias Voltage [V]": -numpy.array(voltage, dtype=float),
+        "Pad Current [A]": numpy.full(num_points, -1e-9),
+    }
+
+
+# A run which does not follow any program gets its sweeps from the measured voltages
+def test_make_run_dataframe_derived_sweeps():
+    data = make_cv_data([0, 1, 2, 1, 0])
+    df = utilities.make_run_dataframe(utilities.CVIV_Types.CV, data)
+
+    assert df["Bias Voltage [V]"].tolist() == [0, 1, 2, 1, 0]
+    assert df["Pad Current [A]"].tolist() == [1e-9]*5
+    assert numpy.array_equal(df["Capacitance [F]"].to_numpy(), data["Capacitance [F]"])
+    assert numpy.allclose(df["InverseCSquare"].to_numpy(), 1/data["Capacitance [F]"]**2)
+    assert df["Ascending"].tolist() == [True, True, True, False, False]
+    assert df["Descending"].tolist() == [False, False, False, True, True]
+    assert df["Segment"].tolist() == [0, 0, 0, 1, 1]
+    assert df["Setpoint"].tolist() == [-1]*5
+    assert df["Segment Label"].tolist() == ["fine up"]*3 + ["fine down"]*2
+
+
+# A run following one of the programs in config/ takes its sweeps from the program
+def test_make_run_dataframe_profile_sweeps():
+    setpoints = numpy.loadtxt(utilities.sweep_profiles_path / "PPS-FBK-LGAD-CV.txt")
+    df = utilities.make_run_dataframe(utilities.CVIV_Types.CV, make_cv_data(setpoints[:8] + 0.05))
+    profile = utilities.match_sweep_profile(setpoints[:8])
+
+    assert df["Setpoint"].tolist() == list(range(8))
+    assert df["Segment"].tolist() == profile.segment[:8].tolist()
+    assert df["Segment Label"].tolist() == profile.labels[:8].tolist()
+    assert df["Ascending"].all()
@@ -0,0 +1,75 @@
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import benchmark_run_db
+import utilities
+
+
+def make_run_db(db_path: Path, num_runs: int):
+    runs = benchmark_run_db.make_synthetic_runs(num_runs)
+    columns = [col for col in runs[0].keys() if col != "RunName"]
+    with sqlite3.connect(db_path) as conn:
+        utilities.create_run_info_table(conn, "RunInfo", columns, logging.getLogger("test_run_info_cache"))
+        values = [[run["RunName"]] + row for run, row in zip(runs, utilities.convert_run_info_values(runs, columns))]
+        conn.executemany(f"INSERT INTO `RunInfo`(`RunName`,{','.join([f'`{col}`' for col in columns])}) VALUES({','.join(['?']*(len(columns) + 1))});", values)
+        conn.execute("CREATE TABLE `Other` (`value` INTEGER);")
+    conn.close()
+
+
+class CountingCache(utilities.RunInfoCache):
+    loads = 0
+
+    def _load(self, conn):
+        self.loads += 1
+        super()._load(conn)
+
+
+def test_run_info_cache_invalidation(tmp_path):
+    db_path = tmp_path / "run_db.sqlite"
+    make_run_db(db_path, 10)
+    conn = sqlite3.connect(db_path)
+    other_conn = sqlite3.connect(db_path)
+    cache = CountingCache("RunInfo")
+
+    assert cache.get(conn, "CVIV-Run0003")["name"].startswith("run_3.")
+    assert cache.get(conn, "CVIV-Run9999") is None
+    assert cache.loads == 1
+
+    # Writes to the other tables, from this or another connection, keep the cache
+    with conn:
+        conn.execute("INSERT INTO `Other` VALUES(1);")
+    with other_conn:
+        other_conn.execute("INSERT INTO `Other` VALUES(2);")
+    assert cache.get(conn, "CVIV-Run0003")["Observations"] is None
+    assert cache.loads == 1
+
+    # Changes to the run info table, from either connection, are seen on the next lookup
+    with other_conn:
+        utilities.set_run_observations(other_conn, "RunInfo", 4, "from the other connection")
+    assert cache.get(conn, "CVIV-Run0003")["Observations"] == "from the other connection"
+    with conn:
+        conn.execute("UPDATE `RunInfo` SET `Observations`='from this connection' WHERE `RunID`=4;")
+    assert cache.get(conn, "CVIV-Run0003")["Observations"] == "from this connection"
+    assert cache.loads == 3
+
+    conn.close()
+    other_conn.close()
+
+
+# A table larger than the cache keeps the most recently used runs and looks the others up in the database
+def test_run_info_cache_partial(tmp_path):
+    db_path = tmp_path / "run_db.sqlite"
+    make_run_db(db_path, 10)
+    conn = sqlite3.connect(db_path)
+    cache = CountingCache("RunInfo", max_runs=4)
+
+    assert [cache.get(conn, f"CVIV-Run{idx:04d}")["RunID"] for idx in [9, 0, 1]] == [10, 1, 2]
+    assert list(cache._records.keys()) == ["CVIV-Run0008", "CVIV-Run0009", "CVIV-Run0000", "CVIV-Run0001"]
+    assert cache.get(conn, "CVIV-Run9999") is None
+    assert cache.loads == 1
+
+    conn.close()
@@ -0,0 +1,56 @@
+import logging
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import benchmark_run_db
+import utilities
+
+
+def make_run_db(runs: list[dict]):
+    conn = sqlite3.connect(":memory:")
+    columns = [col for col in runs[0].keys() if col != "RunName"]
+    utilities.create_run_info_table(conn, "RunInfo", columns, logging.getLogger("test_run_selection"))
+    values = [[run["RunName"]] + row for run, row in zip(runs, utilities.convert_run_info_values(runs, columns))]
+    conn.executemany(f"INSERT INTO `RunInfo`(`RunName`,{','.join([f'`{col}`' for col in columns])}) VALUES({','.join(['?']*(len(columns) + 1))});", values)
+    return conn
+
+
+def test_parse_run_selection():
+    conditions = utilities.parse_run_selection(["sample=FBK-1,FBK-* type=CV", "temperature<-20 pixel=1 2"])
+    assert conditions == [
+        ("sample", "=", ["FBK-1", "FBK-*"]),
+        ("type", "=", [utilities.CVIV_Types.CV.value]),
+        ("temperature [C]", "<", [-20.0]),
+        ("pixel row", "=", [1]),
+        ("pixel col", "=", [2]),
+    ]
+
+
+@pytest.mark.parametrize("selection", [["unknown=1"], ["temperature=cold"], ["pixel!=1 2"], ["FBK-1"]])
+def test_parse_invalid_run_selection(selection):
+    with pytest.raises(RuntimeError):
+        utilities.parse_run_selection(selection)
+
+
+def test_compile_run_selection():
+    where_sql, params = utilities.compile_run_selection(utilities.parse_run_selection(["sample=FBK-1,FBK-* temperature>=-20"]))
+    assert where_sql == "WHERE (`sample` = ? OR `sample` GLOB ?) AND `temperature [C]` >= ?"
+    assert params == ["FBK-1", "FBK-*", -20.0]
+
+
+# != has to keep the runs where the column is not set, which NOT IN alone would drop
+def test_select_runs_not_equal_keeps_unset():
+    runs = benchmark_run_db.make_synthetic_runs(3)
+    runs[0]["sample"] = "FBK-1"
+    runs[1]["sample"] = "FBK-2"
+    runs[2]["sample"] = None
+    conn = make_run_db(runs)
+
+    assert utilities.select_runs(conn, "RunInfo", ["sample!=FBK-1"]) == [("CVIV-Run0001",), ("CVIV-Run0002",)]
+    assert utilities.select_runs(conn, "RunInfo", ["sample!=FBK-*"]) == [("CVIV-Run0002",)]
+    assert utilities.select_runs(conn, "RunInfo", ["sample=FBK-*"]) == [("CVIV-Run0000",), ("CVIV-Run0001",)]
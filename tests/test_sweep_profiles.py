@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import utilities
+
+
+@pytest.mark.parametrize("voltage,direction,segment", [
+    ([0, 1, 2, 3, 4, 5], [1, 1, 1, 1, 1, 1], [0, 0, 0, 0, 0, 0]),
+    ([0, 1, 2, 1, 0], [1, 1, 1, -1, -1], [0, 0, 0, 1, 1]),
+    ([0, 0, 1, 1.02, 2, 2], [1, 1, 1, 1, 1, 1], [0, 0, 0, 0, 0, 0]),  # Repeated setpoints, also at the start and end
+    ([0, -1, -2, -2, -1, 0, 1], [-1, -1, -1, 1, 1, 1, 1], [0, 0, 0, 1, 1, 1, 1]),
+    ([3, 3, 3], [0, 0, 0], [0, 0, 0]),
+])
+def test_derive_sweep_segments(voltage, direction, segment):
+    result_direction, result_segment, is_coarse = utilities.derive_sweep_segments(numpy.array(voltage, dtype=float))
+    assert result_direction.tolist() == direction
+    assert result_segment.tolist() == segment
+    assert not is_coarse.any()
+
+
+# Only the leading sweeps with a much larger step than the finest sweep are coarse
+def test_derive_sweep_segments_coarse():
+    voltage = numpy.array([0, 10, 20, 30] + list(range(29, -1, -1)) + [5, 10], dtype=float)
+    direction, segment, is_coarse = utilities.derive_sweep_segments(voltage)
+    labels = utilities.get_segment_labels(direction, is_coarse)
+    assert segment.tolist() == [0]*4 + [1]*30 + [2]*2
+    assert is_coarse.tolist() == [True]*4 + [False]*32
+    assert labels[[0, 4, 34]].tolist() == ["coarse up", "fine down", "fine up"]
+
+
+@pytest.fixture
+def profiles_path(tmp_path):
+    profiles = {
+        "up": [0, 1, 2, 3, 4, 5],
+        "up_long": [0, 1, 2, 3, 4, 5, 6, 7],
+        "up_down": [0, 1, 2, 3, 4, 5, 4, 3, 2, 1, 0],
+    }
+    for name, setpoints in profiles.items():
+        numpy.savetxt(tmp_path / f"{name}.txt", setpoints)
+    return tmp_path
+
+
+@pytest.mark.parametrize("voltage,profile", [
+    ([0, 1, 2, 3, 4, 5], "up"),                            # All three start alike, the one of the same length wins
+    ([0, 1, 2, 3], "up"),                                  # A stopped run matches the shortest of the programs it follows
+    ([0, 1, 2, 3, 4, 5, 4], "up_down"),
+    ([0, 1.1, 2, 2.9, 4, 5, 6], "up_long"),                # Within the tolerance of the setpoints
+    ([0, 1, 2, 3.5], None),                                # Not following any program
+    ([0, 1, 2, 3, 4, 5, 4, 3, 2, 1, 0, -1], None),         # Longer than all the programs
+    ([], None),
+])
+def test_match_sweep_profile(profiles_path, voltage, profile):
+    match = utilities.match_sweep_profile(numpy.array(voltage, dtype=float), profiles_path)
+    assert (None if match is None else match.name) == profile
+
+
+def test_sweep_profile_segments(profiles_path):
+    match = utilities.match_sweep_profile(numpy.array([0, 1, 2, 3, 4, 5, 4], dtype=float), profiles_path)
+    assert match.segment.tolist() == [0]*6 + [1]*5
+    assert match.labels[[0, 6]].tolist() == ["fine up", "fine down"]
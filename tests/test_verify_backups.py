@@ -0,0 +1,53 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pandas
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import load_runs
+import utilities
+import verify_backups
+from test_load_runs import make_cv_run
+
+
+def load_test_runs(tmp_path: Path, backup_mode: str):
+    input_path = tmp_path / "input"
+    data_path = tmp_path / "data"
+    (input_path / "day0").mkdir(parents=True)
+    data_path.mkdir()
+    for idx in range(3):
+        (input_path / "day0" / f"run_{idx}.cv").write_text(make_cv_run(f"01/09/2023 1{idx}:00:00", [f"pixel 1 {idx}"]))
+    load_runs.script_main(data_path / "Load_Runs", data_path, data_path / "backup", input_path, workers=1, backup_mode=backup_mode, blob_codec="none")
+    return data_path / "run_db.sqlite", data_path / "backup"
+
+
+def run_verify(db_path: Path, backup_path: Path, restore: bool = False):
+    verify_backups.script_main(db_path, backup_path, workers=1, restore=restore)
+    report_df = pandas.read_csv(next((db_path.parent / "VerifyBackups").rglob("verify_report.csv")))
+    return sorted(zip(report_df["location"], report_df["status"]))
+
+
+# Runs loaded with --backupMode database only have their copy in the database, no backup file is expected for them
+def test_database_only_backups_not_missing(tmp_path):
+    db_path, backup_path = load_test_runs(tmp_path, "database")
+    assert run_verify(db_path, backup_path) == [("database", "ok")]*3
+
+
+# The old layout of the backup table, without the Codec column, can be used to restore a corrupted backup file
+def test_restore_from_legacy_backup_table(tmp_path):
+    db_path, backup_path = load_test_runs(tmp_path, "store")
+    with sqlite3.connect(db_path) as conn:
+        runs = conn.execute("SELECT `RunID`,`SHA256` FROM `RunInfo` ORDER BY `RunID`;").fetchall()
+        contents = {run_id: utilities.get_backup_store_path(backup_path, sha256).read_bytes() for run_id, sha256 in runs}
+        conn.execute("DROP TABLE `runBackup`;")
+        conn.execute("CREATE TABLE `runBackup` (`RunID` INTEGER PRIMARY KEY NOT NULL, `Data` BLOB NOT NULL);")
+        conn.executemany("INSERT INTO `runBackup`(`RunID`,`Data`) VALUES(?, ?);", contents.items())
+
+    corrupted_path = utilities.get_backup_store_path(backup_path, runs[0][1])
+    corrupted_path.write_bytes(b"corrupted")
+    assert run_verify(db_path, backup_path) == [("database", "ok")]*3 + [("file", "mismatch")] + [("file", "ok")]*2
+
+    assert run_verify(db_path, backup_path, restore=True) == [("database", "ok")]*3 + [("file", "mismatch"), ("file", "ok"), ("file", "ok"), ("file", "restored")]
+    assert corrupted_path.read_bytes() == contents[runs[0][0]]
@@ -0,0 +1,29 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import utilities
+
+
+def walk(base_path: Path, **kwargs):
+    return sorted(os.path.relpath(entry.path, base_path) for entry in utilities.walk_run_files(base_path, **kwargs))
+
+
+# Campaign directories linked from shared storage are walked, each directory only once and without looping
+def test_walk_symlinked_campaigns(tmp_path):
+    storage_path = tmp_path / "storage" / "day1"
+    input_path = tmp_path / "input"
+    (input_path / "day0" / "sub").mkdir(parents=True)
+    storage_path.mkdir(parents=True)
+    (input_path / "top.cv").write_text("")
+    (input_path / "day0" / "run_0.cv").write_text("")
+    (input_path / "day0" / "sub" / "run_1.cv").write_text("")
+    (storage_path / "run_2.cv").write_text("")
+    (input_path / "day1").symlink_to(storage_path)
+    (input_path / "loop").symlink_to(input_path)
+    (input_path / "day0" / "sub" / "deep").symlink_to(storage_path)
+
+    assert walk(input_path) == ["day0/run_0.cv", "day1/run_2.cv"]
+    assert walk(input_path, recursive=True) == ["day0/run_0.cv", "day0/sub/run_1.cv", "day1/run_2.cv", "top.cv"]